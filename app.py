@@ -1,58 +1,119 @@
 import os
 import logging
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_mail import Mail
 from werkzeug.middleware.proxy_fix import ProxyFix
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from uploads import UploadRequest
+from database import RoutingSession
+from metrics import init_metrics
+from compression import init_compression
+from assets import init_assets
 
 # Define base for SQLAlchemy models
 class Base(DeclarativeBase):
     pass
 
 # Initialize extensions
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 mail = Mail()
 
-# Create the Flask app
-app = Flask(__name__)
+def create_app(config='config.Config'):
+    """Build the Flask app
+
+    Importing this module creates no app, touches no database and starts
+    no threads, so gunicorn can preload it in the master and fork workers
+    (see gunicorn.conf.py). The schema is created and migrated explicitly
+    with `flask --app main init-db`; background tasks start per worker with
+    start_background_tasks().
+    """
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+
+    # Load configuration
+    app.config.from_object(config)
 
-# Load configuration
-app.config.from_object('config.Config')
+    # Set secret key
+    app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
 
-# Set secret key
-app.secret_key = os.environ.get("SESSION_SECRET", "default-secret-key-for-development")
+    # Configure logging, unless the server (e.g. gunicorn) already has
+    logging.basicConfig(level=app.config['LOG_LEVEL'])
 
-# Configure ProxyFix for proper URL generation
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    # Opt-in request profiling (see profiling.py)
+    if app.config['PROFILE_ENABLED']:
+        from profiling import ProfilerMiddleware
+        app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.config)
+    
+    # Configure ProxyFix for proper URL generation and client addresses (used by rate limits)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_X_FOR'], x_proto=1, x_host=1)
 
-# Initialize extensions with the app
-db.init_app(app)
-mail.init_app(app)
+    # Initialize extensions with the app
+    db.init_app(app)
+    mail.init_app(app)
 
-# Create database tables
-with app.app_context():
     # Import models here to avoid circular imports
     import models  # noqa: F401
-    db.create_all()
 
-# Register routes
-from auth_routes import auth_bp
-from file_routes import file_bp
-from routes import web_bp
+    # Register routes
+    from auth_routes import auth_bp
+    from file_routes import file_bp
+    from routes import web_bp
+    from monitoring_routes import monitoring_bp
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(file_bp)
+    app.register_blueprint(web_bp)
+    app.register_blueprint(monitoring_bp)
+
+    # Request metrics for /metrics
+    init_metrics(app)
+
+    # Compressed responses and fingerprinted static assets; after metrics, so
+    # its after_request hook (they run in reverse) sees the compressed size
+    init_compression(app)
+    init_assets(app)
+
+    # Error handlers
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return {"error": "Resource not found"}, 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        return {"error": "Internal server error"}, 500
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create or upgrade the database schema to the latest migration"""
+        from database import upgrade_schema
+        upgrade_schema()
+        click.echo("Database schema is up to date")
+
+    @app.cli.command('reindex')
+    @click.option('--missing', is_flag=True, help="Only index files missing from the index")
+    def reindex(missing):
+        """Rebuild the full-text search index from the stored files"""
+        from search import reindex as reindex_files
+        click.echo(f"Indexed {reindex_files(missing_only=missing)} files")
+
+    return app
+
+def start_background_tasks(app):
+    """Start this process's maintenance and mail delivery threads (once per process)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(file_bp)
-app.register_blueprint(web_bp)
+    Call it in each worker after forking, never in a preloading master:
+    threads do not survive fork().
+    """
+    if app.extensions.get('background_tasks_pid') == os.getpid():
+        return
+    app.extensions['background_tasks_pid'] = os.getpid()
 
-# Error handlers
-@app.errorhandler(404)
-def page_not_found(e):
-    return {"error": "Resource not found"}, 404
+    if app.config['JANITOR_INTERVAL']:
+        from janitor import start_janitor
+        start_janitor(app)
 
-@app.errorhandler(500)
-def internal_server_error(e):
-    return {"error": "Internal server error"}, 500
+    if app.config['MAIL_QUEUE_WORKERS'] and not app.testing:
+        from mailer import start_mail_workers
+        start_mail_workers(app)
@@ -0,0 +1,264 @@
+import io
+import sys
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app import create_app, start_background_tasks
+from uploads import HashingSpoolFile, SPOOLED_BODY_ENVIRON
+
+# Async (ASGI) serving mode
+#
+# Usage: uvicorn --factory asgi:create_application --workers 4   (any ASGI server works)
+#
+# Runs the unchanged Flask app behind an event loop so that a slow transfer
+# costs a coroutine and a socket rather than an OS thread:
+#  - the request body is received asynchronously and spooled (memory up to
+#    ASGI_BODY_BUFFER, then a HashingSpoolFile in UPLOAD_FOLDER) before a
+#    pool thread runs the view, so trickling uploads hold no thread; raw
+#    uploads adopt that spool as is, so their bytes are written to disk once
+#  - the view runs on a pool of ASGI_THREADS threads and returns as soon as
+#    it has decided on a response
+#  - response bodies are pulled chunk by chunk on the pool and awaited out
+#    to the client; files from send_file() (wsgi.file_wrapper) are read with
+#    non-blocking reads of ASGI_STREAM_CHUNK_SIZE
+#  - backpressure comes from awaiting send(); a client that disconnects
+#    stops the transfer
+#
+# A long-lived response (the Server-Sent Events change feed) keeps one of
+# the ASGI_THREADS threads for as long as it is open.
+#
+# Everything (auth, download tokens, Range, storage backends) is the same
+# code as the sync WSGI mode; only the transport differs.
+
+_DONE = object()
+
+class FileBody:
+    """wsgi.file_wrapper: lets the bridge stream a file returned by send_file() itself"""
+
+    def __init__(self, file, block_size=8192):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        # Used if a middleware iterates the body instead of the bridge
+        while True:
+            chunk = self.file.read(self.block_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+class AsyncBridge:
+    """ASGI application serving a WSGI app with asynchronous request and response bodies"""
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.config['ASGI_THREADS'],
+                                                thread_name_prefix='asgi')
+        return self._executor
+
+    async def run(self, context, fn, *args):
+        """Run fn on the pool inside context, shared by every step of one request"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args))
+
+    async def run_io(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+        body, length = await self.read_body(scope, receive, send)
+        if body is None:
+            return
+        try:
+            await self.respond(scope, receive, send, body, length)
+        finally:
+            body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_tasks(self.app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, scope, receive, send):
+        """Receive the whole request body; returns (file object, length), or (None, 0) if already answered"""
+        limit = self.config['MAX_CONTENT_LENGTH']
+        declared = next((v for k, v in scope['headers'] if k == b'content-length'), None)
+        if limit and declared and declared.isdigit() and int(declared) > limit:
+            await send_plain(send, 413, b'Request Entity Too Large')
+            return None, 0
+
+        body = io.BytesIO()
+        spooled = False
+        received = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if limit and received > limit:
+                body.close()
+                await send_plain(send, 413, b'Request Entity Too Large')
+                return None, 0
+
+            if spooled:
+                if chunk:
+                    await self.run_io(body.write, chunk)
+            else:
+                body.write(chunk)
+                if received > self.config['ASGI_BODY_BUFFER']:
+                    spool = await self.run_io(HashingSpoolFile, self.config['UPLOAD_FOLDER'])
+                    await self.run_io(spool.write, body.getvalue())
+                    body = spool
+                    spooled = True
+
+            if not message.get('more_body', False):
+                break
+
+        if spooled:
+            await self.run_io(body.seek, 0)
+        else:
+            body.seek(0)
+        return body, received
+
+    async def respond(self, scope, receive, send, body, length):
+        context = contextvars.copy_context()
+        environ = build_environ(scope, body, length)
+        started = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+            return written.append
+
+        iterable = await self.run(context, self.app, environ, start_response)
+        disconnected = asyncio.Event()
+        watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+        if isinstance(iterable, FileBody):
+            chunks = self.file_chunks(iterable.file)
+        else:
+            chunks = self.iterable_chunks(context, iterable)
+        try:
+            # The app may only call start_response once it produces its first chunk
+            first = await anext(chunks, b'')
+            started['sent'] = True
+            await send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in started['headers']],
+            })
+
+            for chunk in written + [first]:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            async for chunk in chunks:
+                if disconnected.is_set():
+                    return
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            watcher.cancel()
+            await chunks.aclose()
+            if hasattr(iterable, 'close'):
+                await self.run(context, iterable.close)
+
+    async def file_chunks(self, file):
+        chunk_size = self.config['ASGI_STREAM_CHUNK_SIZE']
+        while True:
+            chunk = await self.run_io(file.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    async def iterable_chunks(self, context, iterable):
+        iterator = await self.run(context, iter, iterable)
+        while True:
+            chunk = await self.run(context, next, iterator, _DONE)
+            if chunk is _DONE:
+                return
+            if chunk:
+                yield chunk
+
+def build_environ(scope, body, length):
+    """WSGI environ for an ASGI HTTP scope whose body has been received into body"""
+    server = scope.get('server') or ('localhost', None)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileBody,
+    }
+    if isinstance(body, HashingSpoolFile):
+        environ[SPOOLED_BODY_ENVIRON] = body
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+            # The body is complete, so its received length replaces any framing headers
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+async def send_plain(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def create_application(config='config.Config'):
+    """ASGI application factory"""
+    return AsyncBridge(create_app(config))
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import mimetypes
+from flask import current_app, request, url_for, send_from_directory
+from compression import brotli, available_encodings, negotiate_encoding
+
+# Fingerprinted, precompressed static assets
+#
+# Build step, run on deploy after the static files change:
+#
+#   python assets.py [static folder]
+#
+# copies every file in static/ to static/build/ with a content hash in its
+# name (css/styles.css -> build/css/styles.3f2a9c1b04de.css), writes .gz and,
+# when brotli is installed, .br variants next to the text ones at maximum
+# compression, and records the mapping in static/build/manifest.json.
+#
+# Templates link assets with {{ asset_url('css/styles.css') }}, which gives
+# the fingerprinted URL when a build exists and the plain one otherwise (a
+# checkout that was never built still works). A fingerprinted name changes
+# with its content, so the static view serves build/ files with a one year
+# immutable Cache-Control, picking the precompressed variant the client
+# accepts. Everything else in static/ keeps Flask's revalidated default.
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def is_compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def write_variant(path, encoding, data):
+    """Write a precompressed copy of data, unless it would not be smaller"""
+    if encoding == 'br':
+        body = brotli.compress(data, quality=11)
+    else:
+        body = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(body) < len(data):
+        with open(path + ENCODING_SUFFIXES[encoding], 'wb') as f:
+            f.write(body)
+
+def build_assets(static_folder):
+    """Rebuild static_folder/build and its manifest; returns the manifest"""
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    staging = build_root + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        # Never fingerprint a previous build
+        dirs[:] = [d for d in dirs if os.path.join(root, d) not in (build_root, staging)]
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            stem, ext = os.path.splitext(relative)
+            built = f'{stem}.{fingerprint(source)}{ext}'
+
+            target = os.path.join(staging, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            if is_compressible(name):
+                with open(source, 'rb') as f:
+                    data = f.read()
+                for encoding in available_encodings():
+                    write_variant(target, encoding, data)
+            manifest[relative] = f'{BUILD_DIR}/{built}'
+
+    with open(os.path.join(staging, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    shutil.rmtree(build_root, ignore_errors=True)
+    os.rename(staging, build_root)
+    return manifest
+
+def load_manifest():
+    """The app's asset manifest, read once per process; empty without a build"""
+    manifest = current_app.extensions.get('asset_manifest')
+    if manifest is None:
+        path = os.path.join(current_app.static_folder, BUILD_DIR, MANIFEST)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        current_app.extensions['asset_manifest'] = manifest
+    return manifest
+
+def asset_url(filename):
+    """URL of a static file, fingerprinted when a build exists (Jinja global)"""
+    return url_for('static', filename=load_manifest().get(filename, filename))
+
+def send_static_asset(filename):
+    """Static view: build/ files precompressed and cached for good, the rest as Flask does"""
+    if not filename.startswith(BUILD_DIR + '/'):
+        return current_app.send_static_file(filename)
+
+    directory = os.path.join(current_app.static_folder, BUILD_DIR)
+    name = filename[len(BUILD_DIR) + 1:]
+    offered = [e for e in ENCODING_SUFFIXES if os.path.isfile(os.path.join(directory, name + ENCODING_SUFFIXES[e]))]
+    encoding = negotiate_encoding(offered) if offered else None
+
+    response = send_from_directory(directory, name + ENCODING_SUFFIXES.get(encoding, ''),
+                                   mimetype=mimetypes.guess_type(name)[0],
+                                   max_age=current_app.config['ASSET_MAX_AGE'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if offered:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def init_assets(app):
+    """Serve app's static files with send_static_asset and provide asset_url to templates"""
+    app.view_functions['static'] = send_static_asset
+    app.add_template_global(asset_url)
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for source, built in sorted(build_assets(folder).items()):
+        print(f"{source} -> {built}")
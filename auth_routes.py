@@ -5,12 +5,38 @@ from werkzeug.security import generate_password_hash
 from app import db
 from models import User, UserRole
 from utils import generate_token, token_required, send_verification_email
+from mailer import notify_mail_workers
+from hashing import PasswordHasherBusy
+from ratelimit import get_rate_limiter
 
 auth_bp = Blueprint('auth', __name__)
 
+def too_many_requests(retry_after, is_api=True):
+    """429 response telling the client when to try again"""
+    if is_api:
+        response = jsonify({'message': 'Too many attempts, please try again later.'})
+    else:
+        response = current_app.make_response(
+            render_template('login.html', error='Too many attempts, please try again later'))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.5)))
+    return response
+
+@auth_bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """The password hashing queue is full"""
+    response = jsonify({'message': 'Server busy, please try again shortly.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
 @auth_bp.route('/api/signup', methods=['POST'])
 def signup():
     """API route for client user signup"""
+    retry_after = get_rate_limiter('signup').hit(request.remote_addr)
+    if retry_after:
+        return too_many_requests(retry_after)
+    
     data = request.get_json()
     
     # Validate required fields
@@ -40,25 +66,19 @@ def signup():
     # Add to database
     db.session.add(new_user)
     
+    # Generate verification URL
+    verification_url = url_for(
+        'auth.verify_email',
+        token=verification_token,
+        _external=True
+    )
+    
     try:
+        # Queue the verification email in the same transaction as the user;
+        # it is delivered in the background so signup never waits on SMTP
+        send_verification_email(new_user, verification_url)
         db.session.commit()
-        
-        # Generate verification URL
-        verification_url = url_for(
-            'auth.verify_email',
-            token=verification_token,
-            _external=True
-        )
-        
-        # Send verification email
-        success, error = send_verification_email(new_user, verification_url)
-        
-        if not success:
-            current_app.logger.error(f"Failed to send verification email: {error}")
-            return jsonify({
-                'message': 'User created but failed to send verification email. Please contact support.',
-                'verification_url': verification_url  # Include URL in response for testing
-            }), 201
+        notify_mail_workers()
         
         return jsonify({
             'message': 'User created successfully! Please check your email to verify your account.',
@@ -118,17 +138,17 @@ def login():
             else:
                 return render_template('login.html', error='Username and password are required')
     
+    # Throttle by client address, and per account once it has too many failed attempts
+    user_limiter = get_rate_limiter('login_user')
+    retry_after = get_rate_limiter('login_ip').hit(request.remote_addr) or user_limiter.retry_after(username)
+    if retry_after:
+        return too_many_requests(retry_after, is_api)
+    
     # Find user
     user = User.query.filter_by(username=username).first()
     
-    if not user:
-        if is_api:
-            return jsonify({'message': 'Invalid username or password!'}), 401
-        else:
-            return render_template('login.html', error='Invalid username or password')
-    
-    # Check password
-    if not user.check_password(password):
+    if not user or not user.check_password(password):
+        user_limiter.hit(username)
         if is_api:
             return jsonify({'message': 'Invalid username or password!'}), 401
         else:
@@ -141,6 +161,9 @@ def login():
         else:
             return render_template('login.html', error='Please verify your email before logging in')
     
+    # Earlier typos no longer count towards the account's lockout
+    user_limiter.reset(username)
+    
     # Generate token
     token = generate_token(user.id, user.role)
     
@@ -210,7 +233,7 @@ def create_ops_user(current_user):
 @auth_bp.route('/api/user/profile', methods=['GET'])
 @token_required
 def get_user_profile(current_user):
-    """Get current user profile"""
+    """Get current user profile, served from the cached principal"""
     return jsonify({
         'id': current_user.id,
         'username': current_user.username,
@@ -0,0 +1,372 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+# Hot path benchmark suite
+#
+# Seeds a throwaway database with users and files, then measures throughput
+# and p50/p99 latency of the request paths that matter most:
+#
+#   login           POST /api/login
+#   list_files      GET  /api/files
+#   download_link   GET  /api/download-file/<id>   (mints the download tokens)
+#   download        GET  /api/download/<token>     (each token once)
+#   upload_<size>   POST /api/upload               (raw body, unique content, per --sizes)
+#
+# Usage:
+#   python benchmarks/hot_paths.py --target testclient            # Flask test client, in-process
+#   python benchmarks/hot_paths.py --target gunicorn --workers 4  # real gunicorn over HTTP
+#   python benchmarks/hot_paths.py --output run.json --save-baseline benchmarks/baseline.json
+#   python benchmarks/hot_paths.py --baseline benchmarks/baseline.json   # exit 1 on regressions
+#
+# Runs are reproducible for a given --seed and parameters: the same users,
+# files, request order and payloads. Results are JSON (stdout or --output).
+# Compare only baselines recorded on the same machine and target.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+PASSWORD = 'bench-password'
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def parse_size(text):
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    text = text.strip().lower()
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def configure_environment(workdir):
+    """Point the app at a fresh database and lift limits that would throttle the benchmark"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['LOGIN_IP_RATE_LIMIT'] = str(10 ** 9)
+    os.environ['MAIL_QUEUE_WORKERS'] = '0'
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ['PROFILE_ENABLED'] = 'false'
+
+def seed(app, users, files, rng):
+    """Create users and an operations account, and upload files through the app"""
+    from app import db
+    from models import User, UserRole
+    from utils import generate_token
+
+    with app.app_context():
+        db.create_all()
+        ops = User(username='bench-ops', email='bench-ops@example.com', role=UserRole.OPERATIONS, is_verified=True)
+        ops.set_password(PASSWORD)
+        db.session.add(ops)
+        # One hash serves every account; hashing thousands of passwords would dominate seeding
+        password_hash = ops.password_hash
+        db.session.add_all([
+            User(username=f'bench-{i}', email=f'bench-{i}@example.com', role=UserRole.CLIENT,
+                 is_verified=True, password_hash=password_hash)
+            for i in range(users)
+        ])
+        db.session.commit()
+        ops_token = generate_token(ops.id, ops.role)
+
+    client = app.test_client()
+    file_ids = []
+    for i in range(files):
+        body = rng.randbytes(rng.randint(1024, 64 * 1024))
+        response = client.post('/api/upload', data=body, headers={
+            'Authorization': f'Bearer {ops_token}', 'Content-Type': 'application/octet-stream',
+            'X-Filename': f'seed-{i}.docx'})
+        if response.status_code != 201:
+            sys.exit(f"Seeding upload failed with {response.status_code}: {response.data[:200]!r}")
+        file_ids.append(response.get_json()['file']['id'])
+    return file_ids
+
+class TestClientTransport:
+    """Requests through the Flask test client: the app's own cost, without a server"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        data = response.get_data()
+        response.close()
+        return response.status_code, data, time.perf_counter() - started
+
+class HttpTransport:
+    """Requests over keep-alive HTTP connections, one per benchmark thread"""
+
+    def __init__(self, base_url):
+        self.parts = urlsplit(base_url)
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(
+                self.parts.hostname, self.parts.port, timeout=120)
+        return connection
+
+    def request(self, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        connection = self.connection()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+            self.local.connection = None
+        return response.status, data, time.perf_counter() - started
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(workers, threads):
+    """Run gunicorn with the repository's config on a free port; returns (process, base URL)"""
+    if shutil.which('gunicorn') is None:
+        sys.exit("gunicorn is not installed")
+    port = free_port()
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), PYTHONPATH=REPO_ROOT)
+    process = subprocess.Popen(['gunicorn', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py')],
+                               cwd=REPO_ROOT, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"gunicorn exited with {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit("gunicorn did not start within 30 seconds")
+
+def run_scenario(transport, requests, concurrency, make_request):
+    """Send requests calls of make_request(i) -> (method, path, body, headers) from concurrency threads"""
+    latencies = []
+    statuses = {}
+    errors = 0
+    results = [None] * requests
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            method, path, body, headers = make_request(i)
+            try:
+                status, data, elapsed = transport.request(method, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status < 400:
+                    latencies.append(elapsed)
+                    results[i] = data
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'duration_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+    }, results
+
+def run_suite(transport, args, users, file_ids):
+    rng = random.Random(args.seed)
+    json_headers = {'Content-Type': 'application/json'}
+
+    status, data, _ = transport.request('POST', '/api/login',
+                                        json.dumps({'username': 'bench-0', 'password': PASSWORD}), json_headers)
+    if status != 200:
+        sys.exit(f"Login failed with {status}: {data[:200]!r}")
+    client_auth = {'Authorization': f"Bearer {json.loads(data)['token']}"}
+    status, data, _ = transport.request('POST', '/api/login',
+                                        json.dumps({'username': 'bench-ops', 'password': PASSWORD}), json_headers)
+    ops_auth = {'Authorization': f"Bearer {json.loads(data)['token']}"}
+
+    results = {}
+    login_users = [rng.randrange(users) for _ in range(args.requests)]
+    results['login'], _ = run_scenario(transport, args.requests, args.concurrency, lambda i: (
+        'POST', '/api/login', json.dumps({'username': f'bench-{login_users[i]}', 'password': PASSWORD}),
+        json_headers))
+
+    results['list_files'], _ = run_scenario(transport, args.requests, args.concurrency, lambda i: (
+        'GET', '/api/files?limit=50', None, client_auth))
+
+    link_files = [rng.choice(file_ids) for _ in range(args.requests)]
+    results['download_link'], links = run_scenario(transport, args.requests, args.concurrency, lambda i: (
+        'GET', f'/api/download-file/{link_files[i]}', None, client_auth))
+
+    download_paths = [urlsplit(json.loads(link)['download-link']).path for link in links if link]
+    results['download'], _ = run_scenario(transport, len(download_paths), args.concurrency, lambda i: (
+        'GET', download_paths[i], None, client_auth))
+
+    for size_text in args.sizes.split(','):
+        size = parse_size(size_text)
+        # Unique content per request, so every upload is stored rather than deduplicated
+        payload = bytearray(random.Random(args.seed + size).randbytes(size))
+        count = max(1, min(args.requests, args.upload_bytes // size))
+
+        def upload(i, payload=payload, size=size):
+            body = i.to_bytes(8, 'big') + bytes(payload[8:]) if size >= 8 else bytes(payload)
+            return ('POST', '/api/upload', body, dict(ops_auth, **{
+                'Content-Type': 'application/octet-stream', 'X-Filename': f'bench-{i}.docx'}))
+
+        results[f'upload_{size_text.strip()}'], _ = run_scenario(transport, count, args.concurrency, upload)
+
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance):
+    """Print each scenario against the baseline; returns the regressed scenario names"""
+    regressions = []
+    print(f"{'scenario':<16} {'rps':>10} {'base':>10} {'p99 ms':>10} {'base':>10}", file=sys.stderr)
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<16} {current['throughput_rps']!s:>10} {'-':>10} {current['p99_ms']!s:>10} {'-':>10}",
+                  file=sys.stderr)
+            continue
+        slower = (base['throughput_rps'] and current['throughput_rps'] is not None and
+                  current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance))
+        laggier = (base['p99_ms'] and current['p99_ms'] is not None and
+                   current['p99_ms'] > base['p99_ms'] * (1 + tolerance))
+        failing = current['errors'] > base['errors']
+        flag = '  REGRESSION' if slower or laggier or failing else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<16} {current['throughput_rps']!s:>10} {base['throughput_rps']!s:>10} "
+              f"{current['p99_ms']!s:>10} {base['p99_ms']!s:>10}{flag}", file=sys.stderr)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the login, listing, download and upload paths')
+    parser.add_argument('--target', choices=['testclient', 'gunicorn'], default='testclient')
+    parser.add_argument('--users', type=int, default=100, help='Client accounts to seed')
+    parser.add_argument('--files', type=int, default=200, help='Files to seed')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+    parser.add_argument('--sizes', default='4k,1m,16m', help='Comma separated upload payload sizes')
+    parser.add_argument('--upload-bytes', type=parse_size, default=parse_size('256m'),
+                        help='Caps uploads per size to this many bytes in total')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='Compare against these stored results; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional drop in throughput or rise in p99 (default 0.2)')
+    parser.add_argument('--save-baseline', help='Also store the results here as the new baseline')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='hot-paths-')
+    configure_environment(workdir)
+
+    from app import create_app
+    logging.getLogger().setLevel(logging.WARNING)
+    app = create_app()
+    file_ids = seed(app, args.users, args.files, random.Random(args.seed))
+
+    process = None
+    try:
+        if args.target == 'gunicorn':
+            process, base_url = start_gunicorn(args.workers, args.threads)
+            transport = HttpTransport(base_url)
+        else:
+            transport = TestClientTransport(app)
+        results = run_suite(transport, args, args.users, file_ids)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'target': args.target,
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'machine': platform.node(),
+            'parameters': {k: v for k, v in vars(args).items()
+                           if k not in ('output', 'baseline', 'save_baseline', 'tolerance')},
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta']['parameters'] != report['meta']['parameters']:
+            print("warning: baseline was recorded with different parameters", file=sys.stderr)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            sys.exit(f"Regressions: {', '.join(regressions)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+# Login storm benchmark
+#
+# Hammers /api/login from several threads while other threads time an
+# unrelated authenticated endpoint (/api/files). Reports logins/sec and the
+# latency the storm inflicts on everything else.
+#
+# Usage: python benchmarks/login_storm.py [--duration 10] [--login-threads 16] [--probe-threads 2]
+#   By default the app runs in-process on a threaded server over a throwaway
+#   SQLite database. Use --url to target a running deployment instead; it
+#   must have a user matching --username/--password. Try varying
+#   PASSWORD_HASH_WORKERS / PASSWORD_HASH_QUEUE_DEPTH between runs.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def start_local_server(username, password):
+    """Serve the app from a background thread and return its base URL"""
+    workdir = tempfile.mkdtemp(prefix='login-storm-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    # The storm comes from one address; throttling would end it immediately
+    os.environ.setdefault('LOGIN_IP_RATE_LIMIT', str(10 ** 9))
+    os.environ.setdefault('MAIL_QUEUE_WORKERS', '0')
+
+    from werkzeug.serving import make_server
+    from app import create_app, db
+    from models import User, UserRole
+
+    # Per-request debug logging would dominate the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(username=username, email=f'{username}@example.com', role=UserRole.CLIENT, is_verified=True)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+class Client:
+    """Keep-alive HTTP connection for one benchmark thread"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=60)
+
+    def request(self, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+        return response.status, data, time.perf_counter() - started
+
+def login_body(username, password):
+    return json.dumps({'username': username, 'password': password})
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure login throughput and its effect on other requests')
+    parser.add_argument('--url', help='Base URL of a running server (default: start one in-process)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run the storm')
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--probe-threads', type=int, default=2)
+    parser.add_argument('--username', default='storm')
+    parser.add_argument('--password', default='storm-password')
+    args = parser.parse_args()
+
+    base_url = args.url or start_local_server(args.username, args.password)
+    headers = {'Content-Type': 'application/json'}
+    body = login_body(args.username, args.password)
+
+    status, data, _ = Client(base_url).request('POST', '/api/login', body, headers)
+    if status != 200:
+        sys.exit(f"Login failed with {status}: {data[:200]!r}")
+    probe_headers = {'Authorization': f"Bearer {json.loads(data)['token']}"}
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    login_statuses = {}
+    login_latencies = []
+    probe_latencies = []
+
+    def storm():
+        client = Client(base_url)
+        while not stop.is_set():
+            status, _, elapsed = client.request('POST', '/api/login', body, headers)
+            with lock:
+                login_statuses[status] = login_statuses.get(status, 0) + 1
+                if status == 200:
+                    login_latencies.append(elapsed)
+
+    def probe():
+        client = Client(base_url)
+        while not stop.is_set():
+            status, _, elapsed = client.request('GET', '/api/files', headers=probe_headers)
+            if status == 200:
+                with lock:
+                    probe_latencies.append(elapsed)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=storm) for _ in range(args.login_threads)]
+    threads += [threading.Thread(target=probe) for _ in range(args.probe_threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    def ms(value):
+        return 'n/a' if value is None else f'{value * 1000:.1f} ms'
+
+    print(f"duration:            {elapsed:.1f} s")
+    print(f"logins/sec:          {login_statuses.get(200, 0) / elapsed:.1f}")
+    print(f"login statuses:      {dict(sorted(login_statuses.items()))}")
+    print(f"login p50 / p99:     {ms(percentile(login_latencies, 50))} / {ms(percentile(login_latencies, 99))}")
+    print(f"probe requests:      {len(probe_latencies)}")
+    print(f"probe p50 / p99:     {ms(percentile(probe_latencies, 50))} / {ms(percentile(probe_latencies, 99))}")
+
+if __name__ == '__main__':
+    main()
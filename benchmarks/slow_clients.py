@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+# Slow-client load test
+#
+# Opens many concurrent downloads that read their bodies slowly (like
+# clients on poor links) and checks how many the server keeps serving at
+# once. Meanwhile it times a cheap API call to show whether other requests
+# still get through. Run it once per serving mode and compare, e.g.:
+#
+#   gunicorn -w 4 -b :8000 main:app                  # sync mode
+#   uvicorn --factory asgi:create_application --workers 4 --port 8001  # async mode (asgi.py)
+#
+#   python benchmarks/slow_clients.py --target sync=http://127.0.0.1:8000 \
+#                                     --target asgi=http://127.0.0.1:8001 --connections 2000
+#
+# Needs an operations account (default admin/admin123 from
+# create_initial_user.py). A client account is signed up and verified via
+# the verification_url the signup API returns. Raise the open file limit
+# (ulimit -n) for large --connections.
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+async def http_request(base_url, method, path, body=b'', headers=None):
+    """One request on a fresh connection; returns (status, headers, body)"""
+    parts = urlsplit(base_url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: close',
+                 f'Content-Length: {len(body)}']
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        status, response_headers = await read_head(reader)
+        return status, response_headers, await reader.read()
+    finally:
+        writer.close()
+
+async def read_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return int(status_line.split()[1]), headers
+
+async def api(base_url, method, path, payload=None, token=None, raw=None, extra_headers=None):
+    headers = dict(extra_headers or {})
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    body = raw if raw is not None else (json.dumps(payload).encode() if payload is not None else b'')
+    if payload is not None:
+        headers['Content-Type'] = 'application/json'
+    status, _, data = await http_request(base_url, method, path, body, headers)
+    return status, data
+
+async def prepare(base_url, ops, size, connections):
+    """Upload a test file and mint one single-use download link per connection"""
+    username, password = ops.split(':', 1)
+    status, data = await api(base_url, 'POST', '/api/login', {'username': username, 'password': password})
+    if status != 200:
+        sys.exit(f"{base_url}: operations login failed with {status}: {data[:200]!r}")
+    ops_token = json.loads(data)['token']
+
+    status, data = await api(base_url, 'POST', '/api/upload', token=ops_token, raw=os.urandom(size),
+                             extra_headers={'Content-Type': 'application/octet-stream',
+                                            'X-Filename': 'slow-clients.docx'})
+    if status != 201:
+        sys.exit(f"{base_url}: upload failed with {status}: {data[:200]!r}")
+    file_id = json.loads(data)['file']['id']
+
+    client = f'slow-{uuid.uuid4().hex[:8]}'
+    status, data = await api(base_url, 'POST', '/api/signup',
+                             {'username': client, 'email': f'{client}@example.com', 'password': 'slow-clients'})
+    if status != 201:
+        sys.exit(f"{base_url}: signup failed with {status}: {data[:200]!r}")
+    await api(base_url, 'GET', urlsplit(json.loads(data)['verification_url']).path)
+    status, data = await api(base_url, 'POST', '/api/login', {'username': client, 'password': 'slow-clients'})
+    client_token = json.loads(data)['token']
+
+    semaphore = asyncio.Semaphore(50)
+
+    async def link():
+        async with semaphore:
+            _, data = await api(base_url, 'GET', f'/api/download-file/{file_id}', token=client_token)
+            return urlsplit(json.loads(data)['download-link']).path
+
+    links = await asyncio.gather(*(link() for _ in range(connections)))
+    return client_token, links
+
+async def slow_download(base_url, path, token, rate, hold, timeout, results):
+    """Download path reading at most rate bytes/second, for hold seconds"""
+    parts = urlsplit(base_url)
+    started = time.perf_counter()
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A small receive buffer makes the server feel the slow reader
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, (parts.hostname, parts.port or 80))
+        reader, writer = await asyncio.open_connection(sock=sock)
+    except OSError:
+        results['connect_errors'] += 1
+        return
+
+    try:
+        writer.write((f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                      f'Authorization: Bearer {token}\r\nConnection: close\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+        status, _ = await asyncio.wait_for(read_head(reader), timeout)
+        results['first_byte'].append(time.perf_counter() - started)
+        if status != 200:
+            results['errors'] += 1
+            return
+
+        results['active'] += 1
+        results['peak_active'] = max(results['peak_active'], results['active'])
+        deadline = time.perf_counter() + hold
+        try:
+            while time.perf_counter() < deadline:
+                if not await reader.read(rate):
+                    break
+                results['bytes'] += rate
+                await asyncio.sleep(1)
+        finally:
+            results['active'] -= 1
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError):
+        results['timeouts'] += 1
+    finally:
+        writer.close()
+
+async def probe(base_url, token, stop, latencies, failures):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            status, _ = await asyncio.wait_for(api(base_url, 'GET', '/api/files?limit=1', token=token), 10)
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures.append(status)
+        except (asyncio.TimeoutError, OSError):
+            failures.append('timeout')
+        await asyncio.sleep(0.2)
+
+async def run_target(name, base_url, args):
+    token, links = await prepare(base_url, args.ops, args.size, args.connections)
+    results = {'first_byte': [], 'errors': 0, 'timeouts': 0, 'connect_errors': 0,
+               'active': 0, 'peak_active': 0, 'bytes': 0}
+    stop = asyncio.Event()
+    probe_latencies, probe_failures = [], []
+    prober = asyncio.ensure_future(probe(base_url, token, stop, probe_latencies, probe_failures))
+
+    downloads = []
+    for path in links:
+        downloads.append(asyncio.ensure_future(
+            slow_download(base_url, path, token, args.rate, args.hold, args.timeout, results)))
+        await asyncio.sleep(args.ramp / len(links))
+    await asyncio.gather(*downloads)
+    stop.set()
+    await prober
+
+    def ms(value):
+        return 'n/a' if value is None else f'{value * 1000:.0f} ms'
+
+    print(f"[{name}] {base_url}")
+    print(f"  connections:           {args.connections}")
+    print(f"  peak concurrent:       {results['peak_active']}")
+    print(f"  served / timed out:    {len(results['first_byte']) - results['errors']} / {results['timeouts']}")
+    print(f"  errors / connect errs: {results['errors']} / {results['connect_errors']}")
+    print(f"  first byte p50 / p99:  {ms(percentile(results['first_byte'], 50))} / "
+          f"{ms(percentile(results['first_byte'], 99))}")
+    print(f"  probe p50 / p99:       {ms(percentile(probe_latencies, 50))} / {ms(percentile(probe_latencies, 99))}"
+          f" ({len(probe_failures)} failed)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare how many slow downloads each serving mode sustains')
+    parser.add_argument('--target', action='append', required=True, metavar='NAME=URL',
+                        help='Server to test, e.g. sync=http://127.0.0.1:8000 (repeatable)')
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--rate', type=int, default=4096, help='Bytes each client reads per second')
+    parser.add_argument('--hold', type=float, default=30.0, help='Seconds each client keeps downloading')
+    parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which connections are opened')
+    parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for response headers')
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024, help='Size of the downloaded file')
+    parser.add_argument('--ops', default='admin:admin123', help='Operations account as USER:PASSWORD')
+    args = parser.parse_args()
+
+    for target in args.target:
+        name, _, url = target.partition('=')
+        asyncio.run(run_target(name, url or name, args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import time
+import threading
+from collections import OrderedDict
+from metrics import record_cache_lookup
+
+# In-process caches
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries also expire after a TTL
+
+    Keeps hit/miss counters so callers can report cache effectiveness; a
+    named cache also reports its get() lookups to the request metrics.
+    """
+
+    def __init__(self, maxsize, ttl, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            hit = entry is not None and entry[0] > time.monotonic()
+            if hit:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+        if self.name:
+            record_cache_lookup(self.name, hit)
+        return entry[1] if hit else default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """Store value only if key has no live entry; returns the existing value or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return None
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
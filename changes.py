@@ -0,0 +1,180 @@
+import json
+import time
+import datetime
+import threading
+from flask import current_app
+from sqlalchemy import event, insert, select, func
+from sqlalchemy.orm import Session
+from app import db
+from models import File, FileEvent, FileAction, User
+
+# File change feed
+#
+# Every flush that inserts or deletes File rows also inserts a FileEvent in
+# the same transaction, so the feed can never disagree with the files table.
+# Event ids only grow and serve as the cursor: a client loads the listing
+# once (which carries `changes_cursor`), then applies the changes after it:
+#
+#   GET /api/files/changes?since=<cursor>          one page of changes, polled
+#   GET /api/files/changes/stream?since=<cursor>   the same as Server-Sent Events
+#
+# The files page polls every CHANGES_CLIENT_POLL seconds. The stream is off
+# unless CHANGES_STREAM_ENABLED, since every open stream holds a worker
+# thread (or an ASGI_THREADS thread) for as long as it lasts.
+#
+# The stream checks the table every CHANGES_STREAM_POLL seconds and is woken
+# at once by commits in its own process, so events from every worker reach
+# every stream. It ends after CHANGES_STREAM_TIMEOUT to free its worker
+# thread; clients reconnect with Last-Event-ID. Events older than
+# CHANGES_RETENTION are purged by the janitor, and a cursor from before the
+# oldest remaining event is answered with 410 so the client reloads the
+# listing instead.
+#
+# Bulk deletes (query.delete(), delete(File)) bypass the flush; call
+# record_file_events() next to them.
+#
+# With concurrent writers an event id may commit after a higher one, and a
+# cursor already past it would skip it for good. So the feed only moves
+# past events older than CHANGES_VISIBILITY_DELAY: it stops before the
+# first younger one, whose lower-id neighbours may still be uncommitted.
+# Writers commit well within the delay, and events arrive that much later.
+# Cursors from the listing are settled the same way, so clients may see a
+# change they already have; they apply changes by file id.
+
+_changed = threading.Condition()
+
+def record_file_events(session, action, file_ids):
+    """Insert change feed events for file_ids in the session's transaction"""
+    if file_ids:
+        session.connection().execute(insert(FileEvent),
+                                     [{'file_id': file_id, 'action': action} for file_id in file_ids])
+        session.info['file_events'] = True
+
+@event.listens_for(Session, 'after_flush')
+def record_flushed_file_events(session, flush_context):
+    record_file_events(session, FileAction.ADDED, [obj.id for obj in session.new if isinstance(obj, File)])
+    record_file_events(session, FileAction.DELETED, [obj.id for obj in session.deleted if isinstance(obj, File)])
+
+@event.listens_for(Session, 'after_commit')
+def wake_change_streams(session):
+    if session.info.pop('file_events', False):
+        with _changed:
+            _changed.notify_all()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_file_events(session):
+    session.info.pop('file_events', None)
+
+def visibility_horizon():
+    """Events created after this may still have uncommitted lower ids"""
+    delay = current_app.config['CHANGES_VISIBILITY_DELAY']
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=delay)
+
+def settled_cursor():
+    """Scalar subquery: the newest cursor with no event below it younger than the horizon"""
+    horizon = visibility_horizon()
+    first_unsettled = select(func.min(FileEvent.id)).where(FileEvent.created_at > horizon).scalar_subquery()
+    return select(func.max(FileEvent.id)).where(
+        FileEvent.created_at <= horizon,
+        FileEvent.id < func.coalesce(first_unsettled, FileEvent.id + 1)
+    ).scalar_subquery()
+
+def latest_change_id():
+    """Cursor of the newest settled change, 0 when there are none"""
+    return db.session.scalar(select(settled_cursor())) or 0
+
+def cursor_expired(since):
+    """Check whether changes after since have been purged
+
+    The purge always keeps the newest event, so an empty table means
+    nothing was ever recorded.
+    """
+    oldest = db.session.scalar(select(func.min(FileEvent.id)))
+    return oldest is not None and since < oldest - 1
+
+def get_changes(since, limit):
+    """Settled changes after the since cursor, oldest first; returns (changes, cursor, has_more)
+
+    Added files carry their listing entry, or None when the file has been
+    deleted again since.
+    """
+    horizon = visibility_horizon()
+    events = db.session.scalars(
+        select(FileEvent).where(FileEvent.id > since).order_by(FileEvent.id).limit(limit + 1)
+    ).all()
+    for index, e in enumerate(events):
+        if e.created_at > horizon:
+            # Never move the cursor past an event that may have uncommitted neighbours
+            events = events[:index]
+            break
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    added_ids = {e.file_id for e in events if e.action == FileAction.ADDED}
+    files = {}
+    if added_ids:
+        rows = db.session.execute(
+            select(*File.listing_columns()).join(User, File.uploader_id == User.id).where(File.id.in_(added_ids))
+        )
+        files = {row.id: File.row_to_dict(row) for row in rows}
+
+    changes = []
+    for e in events:
+        change = e.to_dict()
+        if e.action == FileAction.ADDED:
+            change['file'] = files.get(e.file_id)
+        changes.append(change)
+
+    cursor = events[-1].id if events else since
+    return changes, cursor, has_more
+
+def parse_cursor(value):
+    """Parse a since cursor or Last-Event-ID; returns (cursor, error)"""
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        return None, "Invalid cursor!"
+    if cursor < 0:
+        return None, "Invalid cursor!"
+    return cursor, None
+
+def sse(event_name, data, event_id=None):
+    lines = [f'event: {event_name}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+def stream_changes(since):
+    """Server-Sent Events for the changes after since, until CHANGES_STREAM_TIMEOUT"""
+    config = current_app.config
+    poll = config['CHANGES_STREAM_POLL']
+    heartbeat = config['CHANGES_STREAM_HEARTBEAT']
+    page_size = config['CHANGES_PAGE_SIZE']
+    deadline = time.monotonic() + config['CHANGES_STREAM_TIMEOUT']
+    last_sent = time.monotonic()
+
+    yield f'retry: {int(poll * 1000)}\n\n'
+    if cursor_expired(since):
+        yield sse('reset', {'message': 'Cursor expired, reload the file list!'})
+        return
+
+    while True:
+        changes, since, has_more = get_changes(since, page_size)
+        # Hand the connection back to the pool while idle
+        db.session.remove()
+        for change in changes:
+            yield sse('change', change, change['id'])
+        if changes:
+            last_sent = time.monotonic()
+        if has_more:
+            continue
+
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_sent >= heartbeat:
+            yield ': keep-alive\n\n'
+            last_sent = now
+        with _changed:
+            _changed.wait(min(poll, deadline - now))
@@ -0,0 +1,81 @@
+import gzip
+from flask import current_app, request
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it responses are gzip only
+    brotli = None
+
+# Negotiated compression of dynamic responses
+#
+# After each request, 200 responses whose type is in COMPRESS_MIMETYPES
+# (the JSON API, rendered pages) and whose body is at least
+# COMPRESS_MIN_SIZE bytes are compressed with the best encoding the client
+# accepts: brotli when installed, else gzip. Streams (the change feed),
+# files and already encoded bodies are left alone.
+#
+# A compressed body is a different representation, so a strong ETag is
+# weakened: If-None-Match compares weakly and still answers 304.
+# Bodies with an ETag (the response cache's) are compressed once per
+# encoding and kept in a COMPRESS_CACHE_SIZE entry LRU.
+
+def available_encodings():
+    """Encodings this process can produce, most preferred first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+def negotiate_encoding(offered):
+    """Best of the offered encodings the client accepts, or None"""
+    return request.accept_encodings.best_match(offered)
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def get_compressed_cache():
+    cache = current_app.extensions.get('compressed_cache')
+    if cache is None:
+        cache = current_app.extensions['compressed_cache'] = TTLCache(
+            current_app.config['COMPRESS_CACHE_SIZE'], float('inf'), name='compressed')
+    return cache
+
+def compress_response(response):
+    config = current_app.config
+    if (response.status_code != 200 or response.mimetype not in config['COMPRESS_MIMETYPES']
+            or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+
+    # The representation depends on Accept-Encoding whether or not this client gets it compressed
+    response.vary.add('Accept-Encoding')
+    if request.method == 'HEAD' or (response.content_length or 0) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = negotiate_encoding(available_encodings())
+    if encoding is None:
+        return response
+
+    level = config['COMPRESS_BROTLI_QUALITY'] if encoding == 'br' else config['COMPRESS_LEVEL']
+    etag, weak = response.get_etag()
+    if etag:
+        cache = get_compressed_cache()
+        body = cache.get((etag, encoding))
+        if body is None:
+            body = compress(response.get_data(), encoding, level)
+            cache.set((etag, encoding), body)
+    else:
+        body = compress(response.get_data(), encoding, level)
+
+    if len(body) >= response.content_length:
+        return response
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_compression(app):
+    """Compress app's dynamic responses if COMPRESS_ENABLED"""
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
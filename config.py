@@ -1,17 +1,37 @@
 import os
+from database import InstrumentedQueuePool, REPLICA_BIND
 
 class Config:
     # Flask configuration
-    DEBUG = True
+    DEBUG = os.environ.get('FLASK_DEBUG', 'false').lower() in ['true', 'on', '1']
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
     
     # SQLAlchemy configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool per process and bind (see database.py); each worker holds up to size + overflow
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 300))  # Seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['true', 'on', '1']
     SQLALCHEMY_ENGINE_OPTIONS = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        # Reuse the most recent connection so idle ones age out under light load
+        "pool_use_lifo": True,
     }
     
+    # Read replica for read-only endpoints; replication lag makes their results eventually consistent
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    # Binds do not inherit SQLALCHEMY_ENGINE_OPTIONS, so the replica gets the same pool settings explicitly
+    SQLALCHEMY_BINDS = ({REPLICA_BIND: dict(SQLALCHEMY_ENGINE_OPTIONS, url=DATABASE_REPLICA_URL)}
+                        if DATABASE_REPLICA_URL else {})
+    
     # Mail configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -20,12 +40,163 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@example.com')
     
+    # Outbound mail queue (see mailer.py); MAIL_QUEUE_WORKERS 0 leaves delivery to `python mailer.py`
+    MAIL_QUEUE_WORKERS = int(os.environ.get('MAIL_QUEUE_WORKERS', 1))  # Delivery threads per process
+    MAIL_QUEUE_BATCH_SIZE = int(os.environ.get('MAIL_QUEUE_BATCH_SIZE', 20))  # Messages per SMTP connection
+    MAIL_QUEUE_POLL_INTERVAL = int(os.environ.get('MAIL_QUEUE_POLL_INTERVAL', 10))  # Seconds
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 8))
+    MAIL_RETRY_BACKOFF = int(os.environ.get('MAIL_RETRY_BACKOFF', 30))  # Seconds, doubled per attempt
+    MAIL_RETRY_BACKOFF_MAX = int(os.environ.get('MAIL_RETRY_BACKOFF_MAX', 3600))
+    MAIL_CLAIM_TIMEOUT = 600  # Seconds before a batch claimed by a crashed worker is retried
+    MAIL_OUTBOX_RETENTION = int(os.environ.get('MAIL_OUTBOX_RETENTION', 7 * 24 * 3600))  # Seconds sent mail is kept
+    
     # Upload configuration
-    UPLOAD_FOLDER = 'uploads'
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 4 * 1024 * 1024 * 1024))  # 4GB max upload
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB read/write chunks
+    
+    # Async serving mode (see asgi.py)
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))  # Threads running views and blocking I/O
+    ASGI_BODY_BUFFER = 1024 * 1024  # Request bodies larger than this are spooled to disk
+    ASGI_STREAM_CHUNK_SIZE = int(os.environ.get('ASGI_STREAM_CHUNK_SIZE', 64 * 1024))  # Per-connection send size
+    
+    # Storage configuration ('local' keeps blobs in UPLOAD_FOLDER, 's3' in an S3-compatible bucket)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. a MinIO server
+    S3_REGION = os.environ.get('S3_REGION')
+    # Redirect downloads to presigned backend URLs instead of streaming them through the app
+    STORAGE_PRESIGNED_DOWNLOADS = os.environ.get('STORAGE_PRESIGNED_DOWNLOADS', 'false').lower() in ['true', 'on', '1']
+    STORAGE_PRESIGNED_EXPIRES = int(os.environ.get('STORAGE_PRESIGNED_EXPIRES', 300))  # Seconds
+    
+    # Who sends download bytes for local storage: 'app' (the worker), 'x-accel-redirect' (nginx)
+    # or 'x-sendfile' (Apache mod_xsendfile, lighttpd); see deploy/nginx.conf.example
+    DOWNLOAD_DELIVERY = os.environ.get('DOWNLOAD_DELIVERY', 'app')
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-uploads/')
+    
+    # Proxies in front of the app that append to X-Forwarded-For. The client address
+    # (used by rate limits) is only taken from the header with a proxy; 0 trusts none
+    PROXY_X_FOR = int(os.environ.get('PROXY_X_FOR', 0))
+    
+    # Download tokens: 'database' stores a DownloadToken row per link, 'signed' issues
+    # self-contained Fernet tokens (ENCRYPTION_KEY) checked against a replay cache
+    DOWNLOAD_TOKEN_MODE = os.environ.get('DOWNLOAD_TOKEN_MODE', 'database')
+    DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 24 * 3600))  # Seconds
+    DOWNLOAD_REPLAY_CACHE_SIZE = int(os.environ.get('DOWNLOAD_REPLAY_CACHE_SIZE', 100000))
+    ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY')
+    
+    # Seconds a redeemed download token still accepts Range/conditional requests
+    DOWNLOAD_RESUME_WINDOW = int(os.environ.get('DOWNLOAD_RESUME_WINDOW', 3600))
+    
+    # Resumable upload configuration
+    UPLOAD_SESSION_CHUNK_SIZE = 8 * 1024 * 1024  # Default part size offered to clients
+    UPLOAD_SESSION_MIN_CHUNK_SIZE = 256 * 1024
+    UPLOAD_SESSION_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', 24 * 3600))  # Seconds since last activity
     ALLOWED_EXTENSIONS = {'pptx', 'docx', 'xlsx'}
     
+    # File listing configuration
+    FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE', 50))
+    FILES_MAX_PAGE_SIZE = int(os.environ.get('FILES_MAX_PAGE_SIZE', 200))
+    
+    # Maintenance configuration (see janitor.py); JANITOR_INTERVAL 0 disables the in-process task
+    JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 0))  # Seconds between runs
+    JANITOR_REAP = os.environ.get('JANITOR_REAP', 'false').lower() in ['true', 'on', '1']
+    JANITOR_BATCH_SIZE = 1000
+    JANITOR_ORPHAN_GRACE = int(os.environ.get('JANITOR_ORPHAN_GRACE', 3600))  # Seconds
+    
     # JWT configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'default-jwt-secret-key')
     JWT_TOKEN_LOCATION = ['headers']
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
+    
+    # Password hashing pool (see hashing.py); calls beyond the queue depth get a 503
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE_DEPTH = int(os.environ.get('PASSWORD_HASH_QUEUE_DEPTH', 32))
+    
+    # Rate limits per worker process (see ratelimit.py): requests allowed per period in seconds
+    LOGIN_IP_RATE_LIMIT = int(os.environ.get('LOGIN_IP_RATE_LIMIT', 30))  # Login attempts per client address
+    LOGIN_IP_RATE_PERIOD = 60
+    LOGIN_USER_RATE_LIMIT = int(os.environ.get('LOGIN_USER_RATE_LIMIT', 5))  # Failed logins per username
+    LOGIN_USER_RATE_PERIOD = 300
+    SIGNUP_RATE_LIMIT = int(os.environ.get('SIGNUP_RATE_LIMIT', 10))  # Signups per client address
+    SIGNUP_RATE_PERIOD = 3600
+    
+    # Prometheus metrics on /metrics (needs prometheus_client); scrapers send the token as a Bearer token
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN')
+    
+    # Opt-in request profiling (see profiling.py); off means no middleware at all
+    PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', 'false').lower() in ['true', 'on', '1']
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests profiled
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')  # Requests with `X-Profile: <token>` are always profiled
+    PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')  # 'cprofile' or 'sampling'
+    PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))  # Seconds, sampling mode
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    
+    # File listing/details response cache (see response_cache.py)
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))  # Entries per process
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))  # Seconds
+    RESPONSE_CACHE_LOCAL_TTL = int(os.environ.get('RESPONSE_CACHE_LOCAL_TTL', 2))  # Seconds, cap without a shared tier
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')  # Optional shared tier: memory:// or redis://...
+    
+    # Response compression (see compression.py) and static assets (see assets.py)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    COMPRESS_MIMETYPES = {'application/json', 'text/html'}
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # Bytes; smaller bodies are sent as is
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip, 1-9
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))  # brotli, 0-11
+    COMPRESS_CACHE_SIZE = 256  # Compressed bodies kept per process, by ETag
+    ASSET_MAX_AGE = 365 * 24 * 3600  # Seconds, fingerprinted build/ files only
+    
+    # File previews (see previews.py); PREVIEW_WORKERS 0 leaves generation to the janitor
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))  # Generation threads per process
+    PREVIEW_QUEUE_DEPTH = int(os.environ.get('PREVIEW_QUEUE_DEPTH', 64))  # Jobs queued or running per process
+    PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', 50 * 1024 * 1024))  # Bytes read per package part
+    PREVIEW_TEXT_LENGTH = 2000  # Characters of document text in a summary
+    PREVIEW_TABLE_ROWS = 20  # Spreadsheet summary size
+    PREVIEW_TABLE_COLUMNS = 10
+    PREVIEW_RETRY_AFTER = int(os.environ.get('PREVIEW_RETRY_AFTER', 300))  # Seconds before the janitor takes over
+    PREVIEW_BATCH_SIZE = 50  # Previews generated per janitor run
+    PREVIEW_MAX_AGE = 30 * 24 * 3600  # Seconds clients may cache a preview
+    
+    # Full-text search (see search.py); SEARCH_WORKERS 0 leaves indexing to the janitor
+    SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', 2))  # Indexing threads per process
+    SEARCH_QUEUE_DEPTH = int(os.environ.get('SEARCH_QUEUE_DEPTH', 256))  # Jobs queued or running per process
+    SEARCH_MAX_TEXT = int(os.environ.get('SEARCH_MAX_TEXT', 200000))  # Characters indexed per file
+    SEARCH_PAGE_SIZE = 20  # Default results per page
+    SEARCH_MAX_PAGE_SIZE = 100
+    SEARCH_MAX_RESULTS = 1000  # Deepest result reachable by paging
+    SEARCH_RETRY_AFTER = int(os.environ.get('SEARCH_RETRY_AFTER', 300))  # Seconds before the janitor takes over
+    SEARCH_BATCH_SIZE = 100  # Files indexed per janitor run
+    
+    # File change feed (see changes.py)
+    CHANGES_PAGE_SIZE = 500  # Most changes per response
+    CHANGES_VISIBILITY_DELAY = float(os.environ.get('CHANGES_VISIBILITY_DELAY', 5))  # Seconds before an event is sent; must exceed the longest file write transaction
+    CHANGES_RETENTION = int(os.environ.get('CHANGES_RETENTION', 7 * 24 * 3600))  # Seconds events are kept
+    CHANGES_STREAM_POLL = float(os.environ.get('CHANGES_STREAM_POLL', 2))  # Seconds between checks for other workers' changes
+    CHANGES_STREAM_HEARTBEAT = 15  # Seconds of silence before a keep-alive comment
+    CHANGES_STREAM_TIMEOUT = int(os.environ.get('CHANGES_STREAM_TIMEOUT', 300))  # Seconds before clients must reconnect
+    CHANGES_STREAM_ENABLED = os.environ.get('CHANGES_STREAM_ENABLED', 'false').lower() in ['true', 'on', '1']  # Each open stream holds a worker thread
+    CHANGES_CLIENT_POLL = int(os.environ.get('CHANGES_CLIENT_POLL', 15))  # Seconds between the files page's polls without the stream
+    
+    # Authenticated user cache (per process); changes made by other processes show after the TTL
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # Seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+
+class TestingConfig(Config):
+    """Configuration for the test suite: in-memory database, no background threads"""
+    TESTING = True
+    DEBUG = False
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # In-memory SQLite needs its single shared connection
+    SQLALCHEMY_BINDS = {}
+    UPLOAD_FOLDER = 'test_uploads'
+    MAIL_QUEUE_WORKERS = 0
+    JANITOR_INTERVAL = 0
+    PREVIEW_WORKERS = 0
+    SEARCH_WORKERS = 0
+    CHANGES_VISIBILITY_DELAY = 0  # Tests have a single writer
+    RESPONSE_CACHE_ENABLED = False  # Tests recreate tables without bumping generations
@@ -1,9 +1,10 @@
-from app import app, db
+from app import create_app, db
 from models import User, UserRole
 
 # Script to create initial operations user for testing
 
 def create_ops_user():
+    app = create_app()
     with app.app_context():
         # Check if user already exists
         if User.query.filter_by(username='admin').first():
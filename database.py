@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from sqlalchemy import exc, inspect
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy.session import Session
+
+# Database engine plumbing: connection pool instrumentation and read-replica routing
+
+REPLICA_BIND = 'replica'
+
+# Schema migrations (Alembic, see migrations/)
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alembic.ini')
+BASELINE_REVISION = '0001'  # The schema init-db created with create_all() before migrations
+UNMODELED_TABLES = ('file_search',)  # Raw DDL (see search.py), with the shadow tables FTS5 creates
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic filter leaving the tables no model declares out of autogenerate"""
+    return not (type_ == 'table' and reflected and compare_to is None and name.startswith(UNMODELED_TABLES))
+
+class PoolStats:
+    """Thread-safe counters of how long connection checkouts take"""
+
+    # Upper bounds (seconds) of the wait-time histogram buckets
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.histogram = [0] * len(self.BUCKETS)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.histogram[i] += 1
+                    break
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+                'wait_seconds_mean': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+                'wait_histogram': {('+Inf' if bound == float('inf') else str(bound)): count
+                                   for bound, count in zip(self.BUCKETS, self.histogram)},
+            }
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording the time every checkout waits for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.observe(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.observe(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+def pool_status(engine):
+    """Size, usage and checkout wait statistics of an engine's pool"""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        status.update(pool.stats.to_dict())
+    return status
+
+class RoutingSession(Session):
+    """Session that sends reads to the replica bind while read_replica routing is on
+
+    Routing is switched on per request by utils.read_replica. Flushes, and
+    anything after the session has written, always use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_replica') and not self._flushing \
+                and not (self.new or self.dirty or self.deleted):
+            engines = self._db.engines
+            if REPLICA_BIND in engines:
+                return engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def upgrade_schema(revision='head'):
+    """Migrate the primary database to revision (needs an app context)
+
+    A database created by init-db before migrations existed has tables but
+    no alembic_version: it has the baseline schema, so it is stamped there
+    and every later revision runs.
+    """
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+    from app import db
+
+    config = AlembicConfig(ALEMBIC_INI)
+    tables = inspect(db.engine).get_table_names()
+    if tables and 'alembic_version' not in tables:
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, revision)
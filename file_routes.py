@@ -1,15 +1,41 @@
 import os
-from flask import Blueprint, request, jsonify, send_file, current_app, url_for, session, redirect, render_template
+import datetime
+import mimetypes
+from urllib.parse import quote
+from flask import (Blueprint, Response, request, jsonify, send_file, current_app, url_for, session, redirect,
+                   render_template, stream_with_context)
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import ContentRange
+from sqlalchemy.orm import joinedload
 from app import db
-from models import File, UserRole, User
-from utils import token_required, require_role, save_file, encrypt_url, validate_download_token
+from models import File, Blob, UserRole, User, UploadSession, PreviewStatus
+from uploads import write_chunk, discard_chunk, received_chunks, SPOOLED_BODY_ENVIRON
+from storage import get_storage, blob_key, content_disposition
+from response_cache import cached_response
+from previews import preview_key, schedule_preview
+from search import search_dialect, parse_query, search_files
+from changes import latest_change_id, cursor_expired, get_changes, parse_cursor, stream_changes
+from utils import (token_required, require_role, read_replica, save_file, save_stream, encrypt_url,
+                   validate_download_token, parse_file_list_params, paginate_files,
+                   create_upload_session, touch_upload_session, finalize_upload_session,
+                   discard_upload_session, purge_expired_upload_sessions, release_blob, unlink_content,
+                   delete_download_tokens, get_user_principal)
 
 file_bp = Blueprint('file', __name__)
 
+def is_form_request():
+    """Check if the request is a browser form post rather than a Bearer token API call"""
+    if request.headers.get('Authorization', '').startswith('Bearer '):
+        return False
+    return bool(request.content_type and 'multipart/form-data' in request.content_type)
+
 @file_bp.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Upload file (operations user only) - with support for both API and form-based requests"""
+    """Upload file (operations user only) - with support for both API and form-based requests
+
+    Besides multipart forms, API clients may send the file as a raw
+    application/octet-stream body with the name in an X-Filename header.
+    """
     # Check for session-based authentication
     user_id = session.get('user_id')
     role = session.get('role')
@@ -20,7 +46,7 @@ def upload_file():
         
         if not auth_header or not auth_header.startswith('Bearer '):
             # For form-based requests, redirect to login page
-            if request.content_type and 'multipart/form-data' in request.content_type:
+            if is_form_request():
                 return redirect('/login')
             return jsonify({'message': 'Authentication required!'}), 401
         
@@ -33,7 +59,7 @@ def upload_file():
                 current_app.config['JWT_SECRET_KEY'], 
                 algorithms=['HS256']
             )
-            user = User.query.get(data['sub'])
+            user = get_user_principal(int(data['sub']))
             
             if not user or user.role != UserRole.OPERATIONS:
                 return jsonify({'message': 'Permission denied!'}), 403
@@ -41,18 +67,32 @@ def upload_file():
             current_user = user
         except Exception as e:
             # For form-based requests, redirect to login page with error
-            if request.content_type and 'multipart/form-data' in request.content_type:
+            if is_form_request():
                 return render_template('login.html', error='Invalid or expired token. Please login again.')
             return jsonify({'message': 'Invalid token!'}), 401
     else:
         # Use session authentication
-        current_user = User.query.get(user_id)
+        current_user = get_user_principal(user_id)
         if not current_user or current_user.role != UserRole.OPERATIONS:
             return redirect('/login')
     
+    # Raw body uploads are streamed from the socket in chunks, no multipart parsing
+    if request.mimetype == 'application/octet-stream':
+        original_filename = request.headers.get('X-Filename') or request.args.get('filename')
+        file_record, error = save_stream(request.stream, original_filename, current_user.id,
+                                         spool=request.environ.get(SPOOLED_BODY_ENVIRON))
+        
+        if error:
+            return jsonify({'message': f'Error saving file: {error}'}), 500
+        
+        return jsonify({
+            'message': 'File uploaded successfully!',
+            'file': file_record.to_dict()
+        }), 201
+    
     # Check if file part exists in request
     if 'file' not in request.files:
-        if request.content_type and 'multipart/form-data' in request.content_type:
+        if is_form_request():
             return render_template('upload.html', error='No file selected!')
         return jsonify({'message': 'No file part in the request!'}), 400
         
@@ -60,7 +100,7 @@ def upload_file():
     
     # Check if a file was selected
     if file.filename == '':
-        if request.content_type and 'multipart/form-data' in request.content_type:
+        if is_form_request():
             return render_template('upload.html', error='No file selected!')
         return jsonify({'message': 'No file selected!'}), 400
     
@@ -68,12 +108,12 @@ def upload_file():
     file_record, error = save_file(file, current_user.id)
     
     if error:
-        if request.content_type and 'multipart/form-data' in request.content_type:
+        if is_form_request():
             return render_template('upload.html', error=f'Error saving file: {error}')
         return jsonify({'message': f'Error saving file: {error}'}), 500
     
     # Respond based on request type
-    if request.content_type and 'multipart/form-data' in request.content_type:
+    if is_form_request():
         return render_template('upload.html', success=f'File {file.filename} uploaded successfully!')
         
     return jsonify({
@@ -81,24 +121,252 @@ def upload_file():
         'file': file_record.to_dict()
     }), 201
 
+# Resumable (chunked) uploads
+#
+# POST   /api/uploads                       start a session: filename, file_size, [chunk_size, sha256]
+# PUT    /api/uploads/<id>/chunks/<index>   raw part body; parts may be sent in parallel and in any order
+# GET    /api/uploads/<id>                  session status with the received chunk indexes
+# POST   /api/uploads/<id>/complete         assemble the parts into a file record
+# DELETE /api/uploads/<id>                  abandon the session
+
+def get_upload_session(current_user, upload_id):
+    """Return the caller's live upload session or None"""
+    upload_session = db.session.get(UploadSession, upload_id)
+    if not upload_session or upload_session.uploader_id != current_user.id or upload_session.is_expired():
+        return None
+    return upload_session
+
+@file_bp.route('/api/uploads', methods=['POST'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def start_upload_session(current_user):
+    """Start a resumable upload session (operations user only)"""
+    data = request.get_json(silent=True) or {}
+    
+    if not all(k in data for k in ('filename', 'file_size')):
+        return jsonify({'message': 'Missing required fields!'}), 400
+    
+    # Opportunistically reclaim abandoned sessions
+    purge_expired_upload_sessions()
+    
+    upload_session, error = create_upload_session(
+        current_user.id,
+        data['filename'],
+        data['file_size'],
+        chunk_size=data.get('chunk_size'),
+        expected_hash=data.get('sha256')
+    )
+    
+    if error:
+        return jsonify({'message': error}), 400
+    
+    return jsonify({
+        'upload': upload_session.to_dict(),
+        'received_chunks': []
+    }), 201
+
+@file_bp.route('/api/uploads/<upload_id>', methods=['GET'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def get_upload_status(current_user, upload_id):
+    """Report which chunks of an upload session have been received"""
+    upload_session = get_upload_session(current_user, upload_id)
+    
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found!'}), 404
+    
+    return jsonify({
+        'upload': upload_session.to_dict(),
+        'received_chunks': received_chunks(current_app.config['UPLOAD_FOLDER'], upload_session.id)
+    }), 200
+
+@file_bp.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def upload_chunk(current_user, upload_id, index):
+    """Store one numbered chunk of an upload session"""
+    upload_session = get_upload_session(current_user, upload_id)
+    
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found!'}), 404
+    
+    if index >= upload_session.total_chunks:
+        return jsonify({'message': 'Chunk index out of range!'}), 400
+    
+    expected_size = upload_session.expected_chunk_size(index)
+    if request.content_length is not None and request.content_length != expected_size:
+        return jsonify({'message': f'Chunk {index} must be {expected_size} bytes!'}), 400
+    
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    size, digest = write_chunk(request.stream, upload_folder, upload_session.id, index,
+                               current_app.config['UPLOAD_CHUNK_SIZE'])
+    
+    expected_digest = request.headers.get('X-Chunk-SHA256')
+    if size != expected_size or (expected_digest and expected_digest.lower() != digest):
+        discard_chunk(upload_folder, upload_session.id, index)
+        return jsonify({'message': f'Chunk {index} is incomplete or corrupt!'}), 400
+    
+    touch_upload_session(upload_session)
+    
+    return jsonify({
+        'index': index,
+        'size': size,
+        'sha256': digest
+    }), 200
+
+@file_bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def complete_upload_session(current_user, upload_id):
+    """Assemble a fully received upload session into a file"""
+    upload_session = get_upload_session(current_user, upload_id)
+    
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found!'}), 404
+    
+    file_record, error = finalize_upload_session(upload_session)
+    
+    if error:
+        return jsonify({'message': error}), 409
+    
+    return jsonify({
+        'message': 'File uploaded successfully!',
+        'file': file_record.to_dict()
+    }), 201
+
+@file_bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def abort_upload_session(current_user, upload_id):
+    """Abandon an upload session and delete its chunks"""
+    upload_session = get_upload_session(current_user, upload_id)
+    
+    if not upload_session:
+        return jsonify({'message': 'Upload session not found!'}), 404
+    
+    discard_upload_session(upload_session)
+    
+    return jsonify({'message': 'Upload session deleted!'}), 200
+
 @file_bp.route('/api/files', methods=['GET'])
 @token_required
 @require_role([UserRole.CLIENT])
+@read_replica
+@cached_response
 def list_files(current_user):
-    """List all files (client user only)"""
-    files = File.query.all()
+    """List files (client user only) - keyset paginated, filterable and sortable
+
+    Query parameters: limit, cursor, sort (uploaded_at|filename|file_size),
+    order (asc|desc), file_type (comma separated), uploader (username),
+    uploaded_after and uploaded_before (ISO 8601).
+    """
+    params, error = parse_file_list_params(request.args)
+    
+    if error:
+        return jsonify({'message': error}), 400
+    
+    rows, next_cursor = paginate_files(params)
+    
+    return jsonify({
+        'files': [File.row_to_dict(row) for row in rows],
+        'next_cursor': next_cursor,
+        'changes_cursor': (rows[0].changes_cursor or 0) if rows else latest_change_id()
+    }), 200
+
+@file_bp.route('/api/files/changes', methods=['GET'])
+@token_required
+@require_role([UserRole.CLIENT])
+@read_replica
+def list_file_changes(current_user):
+    """Files added and deleted after a cursor (client user only)
+
+    Query parameters: since (a changes_cursor or cursor from an earlier
+    response; omitted returns just the current cursor) and limit.
+    """
+    if 'since' not in request.args:
+        return jsonify({'changes': [], 'cursor': latest_change_id(), 'has_more': False}), 200
+    
+    since, error = parse_cursor(request.args['since'])
+    if error:
+        return jsonify({'message': error}), 400
+    
+    if cursor_expired(since):
+        return jsonify({'message': 'Cursor expired, reload the file list!'}), 410
+    
+    page_size = current_app.config['CHANGES_PAGE_SIZE']
+    limit = request.args.get('limit', page_size, type=int)
+    changes, cursor, has_more = get_changes(since, max(1, min(limit, page_size)))
     
     return jsonify({
-        'files': [file.to_dict() for file in files]
+        'changes': changes,
+        'cursor': cursor,
+        'has_more': has_more
     }), 200
 
+@file_bp.route('/api/files/search', methods=['GET'])
+@token_required
+@require_role([UserRole.CLIENT])
+@read_replica
+def search_file_contents(current_user):
+    """Files whose name or content match a query, best first (client user only)
+
+    Query parameters: q (words that must all match), limit and page.
+    Snippets are HTML with the matches in <mark>.
+    """
+    if search_dialect() is None:
+        return jsonify({'message': 'Search is not available!'}), 501
+    
+    terms = parse_query(request.args.get('q'))
+    if terms is None:
+        return jsonify({'message': 'Missing search query!'}), 400
+    
+    config = current_app.config
+    limit = max(1, min(request.args.get('limit', config['SEARCH_PAGE_SIZE'], type=int), config['SEARCH_MAX_PAGE_SIZE']))
+    page = request.args.get('page', 1, type=int)
+    if page < 1 or (page - 1) * limit >= config['SEARCH_MAX_RESULTS']:
+        return jsonify({'message': 'Page out of range!'}), 400
+    
+    results, has_more = search_files(terms, limit, (page - 1) * limit)
+    has_more = has_more and page * limit < config['SEARCH_MAX_RESULTS']
+    
+    return jsonify({
+        'results': results,
+        'next_page': page + 1 if has_more else None
+    }), 200
+
+@file_bp.route('/api/files/changes/stream', methods=['GET'])
+@token_required
+@require_role([UserRole.CLIENT])
+def stream_file_changes(current_user):
+    """Server-Sent Events stream of file changes after a cursor (client user only)
+
+    Resumes from the Last-Event-ID header when reconnecting, else from the
+    since query parameter, else from now. Answers 404 unless
+    CHANGES_STREAM_ENABLED.
+    """
+    if not current_app.config['CHANGES_STREAM_ENABLED']:
+        return jsonify({'message': 'Change stream is disabled, poll /api/files/changes instead!'}), 404
+    
+    value = request.headers.get('Last-Event-ID') or request.args.get('since')
+    if value is None:
+        since = latest_change_id()
+    else:
+        since, error = parse_cursor(value)
+        if error:
+            return jsonify({'message': error}), 400
+    
+    response = Response(stream_with_context(stream_changes(since)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Tell nginx not to buffer the stream
+    return response
+
 @file_bp.route('/api/download-file/<int:file_id>', methods=['GET'])
 @token_required
 @require_role([UserRole.CLIENT])
 def get_download_link(current_user, file_id):
     """Get encrypted download link for a file (client user only)"""
     # Check if file exists
-    file = File.query.get(file_id)
+    file = db.session.get(File, file_id)
     
     if not file:
         return jsonify({'message': 'File not found!'}), 404
@@ -121,28 +389,125 @@ def get_download_link(current_user, file_id):
 @token_required
 @require_role([UserRole.CLIENT])
 def download_file(current_user, token):
-    """Download file using encrypted token (client user only)"""
-    file, error = validate_download_token(token, current_user.id)
+    """Download file using encrypted token (client user only)
+
+    Supports Range/If-Range for resumed and segmented downloads and
+    If-None-Match/If-Modified-Since revalidation against a strong ETag
+    derived from the stored content hash.
+    """
+    resume = bool(request.range or request.if_none_match or request.if_modified_since)
+    file, error = validate_download_token(token, current_user.id, resume=resume)
     
     if error:
         return jsonify({'message': error}), 401
     
-    # Check if file exists on disk
-    if not os.path.exists(file.file_path):
+    return send_stored_file(file)
+
+def send_stored_file(file):
+    """Respond with a file's content from the configured storage backend"""
+    # Legacy uploads that predate the blob store live at file_path on local disk
+    if not file.content_hash:
+        if not os.path.exists(file.file_path):
+            return jsonify({'message': 'File not found on the server!'}), 404
+        if current_app.config['DOWNLOAD_DELIVERY'] != 'app':
+            return offload_to_proxy(file, file.file_path)
+        return send_file(file.file_path, download_name=file.original_filename, as_attachment=True,
+                         conditional=True)
+    
+    storage = get_storage()
+    key = blob_key(file.content_hash)
+    etag = file.content_hash
+    last_modified = file.uploaded_at.replace(tzinfo=datetime.timezone.utc, microsecond=0)
+    
+    # Revalidation: the content behind a hash never changes
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag) or request.if_none_match.star_tag
+    else:
+        not_modified = bool(request.if_modified_since and last_modified <= request.if_modified_since)
+    
+    if not_modified:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    
+    if current_app.config['STORAGE_PRESIGNED_DOWNLOADS']:
+        # Let the client fetch the bytes from the object store directly
+        url = storage.presigned_url(key, file.original_filename,
+                                    current_app.config['STORAGE_PRESIGNED_EXPIRES'])
+        if url:
+            return redirect(url)
+    
+    if not storage.exists(key):
         return jsonify({'message': 'File not found on the server!'}), 404
     
-    # Send file
-    return send_file(
-        file.file_path,
-        download_name=file.original_filename,
-        as_attachment=True
-    )
+    local_path = storage.local_path(key)
+    if local_path and current_app.config['DOWNLOAD_DELIVERY'] != 'app':
+        # The front-end server streams the bytes (and handles Range) with sendfile(2)
+        response = offload_to_proxy(file, local_path)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    
+    # A single byte range, unless If-Range says the client holds other content
+    byte_range = None
+    if request.range and len(request.range.ranges) == 1 and if_range_matches(etag, last_modified):
+        byte_range = request.range.range_for_length(file.file_size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{file.file_size}'
+            return response
+    
+    if byte_range is None and local_path:
+        # Full local downloads keep using the server's file wrapper (sendfile)
+        response = send_file(local_path, download_name=file.original_filename, as_attachment=True,
+                             conditional=False, etag=False)
+    else:
+        start, stop = byte_range or (0, file.file_size)
+        mimetype = mimetypes.guess_type(file.original_filename)[0] or 'application/octet-stream'
+        body = storage.open(key, start, stop - 1, chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'])
+        response = Response(stream_with_context(body), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stop - start
+        response.headers['Content-Disposition'] = content_disposition(file.original_filename)
+        if byte_range:
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, file.file_size)
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.accept_ranges = 'bytes'
+    return response
+
+def offload_to_proxy(file, path):
+    """Empty response telling the front-end server to send the file at path itself"""
+    mimetype = mimetypes.guess_type(file.original_filename)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    response.headers['Content-Disposition'] = content_disposition(file.original_filename)
+    
+    if current_app.config['DOWNLOAD_DELIVERY'] == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        relative = os.path.relpath(path, current_app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = current_app.config['X_ACCEL_REDIRECT_PREFIX'] + quote(relative)
+    
+    return response
+
+def if_range_matches(etag, last_modified):
+    """Check an If-Range precondition; a missing header always matches"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return if_range.date == last_modified
+    return True
 
 @file_bp.route('/api/files/<int:file_id>', methods=['GET'])
 @token_required
+@read_replica
+@cached_response
 def get_file_details(current_user, file_id):
     """Get file details"""
-    file = File.query.get(file_id)
+    file = db.session.get(File, file_id, options=[joinedload(File.uploader)])
     
     if not file:
         return jsonify({'message': 'File not found!'}), 404
@@ -151,26 +516,75 @@ def get_file_details(current_user, file_id):
         'file': file.to_dict()
     }), 200
 
+@file_bp.route('/api/files/<int:file_id>/preview', methods=['GET'])
+@token_required
+@read_replica
+def get_file_preview(current_user, file_id):
+    """Get a file's preview: its embedded thumbnail image or a JSON text/table summary
+
+    Answers 202 while the preview is still being generated. A preview is
+    derived from the content hash, so it is served with a strong ETag and
+    may be cached for PREVIEW_MAX_AGE.
+    """
+    file = db.session.get(File, file_id)
+    
+    if not file:
+        return jsonify({'message': 'File not found!'}), 404
+    
+    blob = db.session.get(Blob, file.content_hash) if file.content_hash else None
+    
+    if not blob or blob.preview_status in (PreviewStatus.UNAVAILABLE, PreviewStatus.FAILED):
+        return jsonify({'message': 'No preview available for this file!'}), 404
+    
+    if blob.preview_status == PreviewStatus.PENDING:
+        # Re-queue in case the upload's job was lost; a queued job is not duplicated
+        schedule_preview(blob.hash)
+        response = jsonify({'message': 'Preview is being generated, retry shortly.'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '5'
+        return response
+    
+    etag = f'preview-{blob.hash}'
+    # Weak comparison: a compressed summary goes out with the ETag weakened
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        storage = get_storage()
+        key = preview_key(blob.hash)
+        if not storage.exists(key):
+            return jsonify({'message': 'No preview available for this file!'}), 404
+        response = Response(b''.join(storage.open(key)), mimetype=blob.preview_type)
+    
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['PREVIEW_MAX_AGE']
+    return response
+
 @file_bp.route('/api/files/<int:file_id>', methods=['DELETE'])
 @token_required
 @require_role([UserRole.OPERATIONS])
 def delete_file(current_user, file_id):
     """Delete a file (operations user only)"""
-    file = File.query.get(file_id)
+    file = db.session.get(File, file_id)
     
     if not file:
         return jsonify({'message': 'File not found!'}), 404
     
-    # Delete file from disk
-    if os.path.exists(file.file_path):
-        os.remove(file.file_path)
-    
-    # Delete file from database
-    db.session.delete(file)
-    
+    file_path, digest = file.file_path, file.content_hash
     try:
+        # Drop the blob reference, outstanding links and the record together
+        released = release_blob(file)
+        delete_download_tokens([file.id])
+        db.session.delete(file)
         db.session.commit()
-        return jsonify({'message': 'File deleted successfully!'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': f'Error deleting file: {str(e)}'}), 500
+    
+    if released:
+        try:
+            unlink_content(file_path, digest)
+        except Exception:
+            # The janitor reaps content left without a blob row
+            current_app.logger.exception("Could not unlink the content of deleted file %s", file_id)
+    return jsonify({'message': 'File deleted successfully!'}), 200
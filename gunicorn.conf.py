@@ -0,0 +1,78 @@
+import os
+import glob
+import shutil
+import tempfile
+import multiprocessing
+
+# Gunicorn configuration
+#
+# Usage: gunicorn -c gunicorn.conf.py
+#
+# The app is imported once in the master (preload_app) and shared
+# copy-on-write with the forked workers, so workers boot fast and share
+# the imported code. Anything that must not cross fork() is handled per
+# worker in post_worker_init: inherited database connections are dropped
+# and the background threads (janitor, mail delivery) are started.
+#
+# Create or upgrade the schema before starting: flask --app main init-db
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ['true', 'on', '1']
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# 'gthread' (default), 'sync', or an async class such as 'uvicorn.workers.UvicornWorker'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))  # Per worker, gthread only
+
+if 'uvicorn' in worker_class.lower():
+    wsgi_app = "asgi:create_application()"
+else:
+    wsgi_app = "app:create_app()"
+
+preload_app = env_flag('GUNICORN_PRELOAD', 'true')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound slow memory growth; 0 disables
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+# Workers write their metrics to files here so /metrics can sum them (see metrics.py).
+# Named before the app, and so prometheus_client, is imported (preloading imports
+# it before any server hook runs). This module is read again on every HUP, so the
+# metric files are only wiped when the master starts. A directory the operator
+# names is kept on exit; the per-master default one is removed.
+default_metrics_dir = os.path.join(tempfile.gettempdir(), f'fileshare-metrics-{os.getpid()}')
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', default_metrics_dir)
+os.makedirs(metrics_dir, exist_ok=True)
+
+def on_starting(server):
+    # Start from zero rather than adding to a previous run
+    for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(path)
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
+
+def on_exit(server):
+    if metrics_dir == default_metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+def post_worker_init(worker):
+    from app import db, start_background_tasks
+
+    # The ASGI bridge wraps the Flask app
+    app = getattr(worker.wsgi, 'app', worker.wsgi)
+    with app.app_context():
+        # Drop any pooled connections inherited from the master without closing them under it
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    start_background_tasks(app)
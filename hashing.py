@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing
+#
+# scrypt/pbkdf2 are deliberately slow. Running them inline lets a burst of
+# logins take every CPU the worker has. Here they run on a small per-process
+# pool instead: PASSWORD_HASH_WORKERS threads, with at most
+# PASSWORD_HASH_QUEUE_DEPTH calls queued or running. hashlib releases the
+# GIL while hashing, so other requests keep running. Past the queue limit
+# callers fail fast with PasswordHasherBusy instead of piling up.
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+class PasswordHasher:
+    """Bounded executor for password hashing and verification"""
+
+    def __init__(self, workers, queue_depth):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(queue_depth)
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password)
+
+    def verify(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+def get_password_hasher():
+    """Per-process password hasher, created on first use"""
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = current_app.extensions['password_hasher'] = PasswordHasher(
+            current_app.config['PASSWORD_HASH_WORKERS'],
+            current_app.config['PASSWORD_HASH_QUEUE_DEPTH']
+        )
+    return hasher
@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import random
+import logging
+import datetime
+import threading
+from flask import current_app
+from sqlalchemy import delete, select, func, or_, and_
+from app import db
+from models import File, Blob, DownloadToken, RedeemedToken, OutboundEmail, EmailStatus, FileEvent, FileAction, PreviewStatus
+from storage import get_storage, blob_key
+from changes import record_file_events
+from search import search_dialect, index_files, unindex_files, unindexed_files
+from previews import preview_key, generate_preview
+from utils import purge_expired_upload_sessions, delete_download_tokens
+from metrics import record_janitor_run
+
+# Background maintenance
+#
+# Reclaims what the request path never cleans up:
+#  - DownloadToken rows that are expired, or used and past the resume window
+#  - redemption records of signed download tokens that have expired
+#  - abandoned resumable upload sessions
+#  - delivered or abandoned outbox email past MAIL_OUTBOX_RETENTION
+#  - file change feed events past CHANGES_RETENTION
+#  - crashed upload spools (.upload-*.part) left in UPLOAD_FOLDER
+#  - orphan blobs: stored content without a Blob row (process died before commit)
+#  - unreferenced Blob rows, and File rows whose content has gone missing
+#  - previews never generated by the upload path (queue full, worker gone)
+#
+# Usage: python janitor.py [--reap] [--dry-run]
+#   Expired tokens, sessions and spools are always purged (unless --dry-run);
+#   orphans and dangling rows are only reported unless --reap is given.
+#
+# Each run's counts are logged, and exported on /metrics as the rows and
+# bytes reclaimed per task and the time of the last run (see metrics.py).
+
+logger = logging.getLogger(__name__)
+
+def purge_download_tokens(batch_size, dry_run=False):
+    """Delete expired and spent download tokens in bounded batches"""
+    now = datetime.datetime.utcnow()
+    resume_cutoff = now - datetime.timedelta(seconds=current_app.config['DOWNLOAD_RESUME_WINDOW'])
+    reclaimable = or_(
+        DownloadToken.expiration < now,
+        and_(DownloadToken.is_used.is_(True),
+             or_(DownloadToken.used_at.is_(None), DownloadToken.used_at < resume_cutoff))
+    )
+
+    if dry_run:
+        return DownloadToken.query.filter(reclaimable).count()
+
+    deleted = 0
+    while True:
+        ids = db.session.scalars(select(DownloadToken.id).where(reclaimable).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        db.session.execute(delete(DownloadToken).where(DownloadToken.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+def purge_redeemed_tokens(batch_size, dry_run=False):
+    """Delete redemption records of signed download tokens that have expired"""
+    expired = RedeemedToken.expires_at < datetime.datetime.utcnow()
+
+    if dry_run:
+        return RedeemedToken.query.filter(expired).count()
+
+    deleted = 0
+    while True:
+        nonces = db.session.scalars(select(RedeemedToken.nonce).where(expired).limit(batch_size)).all()
+        if not nonces:
+            return deleted
+        db.session.execute(delete(RedeemedToken).where(RedeemedToken.nonce.in_(nonces)))
+        db.session.commit()
+        deleted += len(nonces)
+
+def purge_sent_emails(batch_size, dry_run=False):
+    """Delete delivered and given-up outbox messages past the retention period"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=current_app.config['MAIL_OUTBOX_RETENTION'])
+    finished = and_(OutboundEmail.status.in_([EmailStatus.SENT, EmailStatus.FAILED]),
+                    OutboundEmail.created_at < cutoff)
+
+    if dry_run:
+        return OutboundEmail.query.filter(finished).count()
+
+    deleted = 0
+    while True:
+        ids = db.session.scalars(select(OutboundEmail.id).where(finished).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        db.session.execute(delete(OutboundEmail).where(OutboundEmail.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+def purge_file_events(batch_size, dry_run=False):
+    """Delete change feed events past the retention period, always keeping the newest one"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=current_app.config['CHANGES_RETENTION'])
+    newest = db.session.scalar(select(func.max(FileEvent.id)))
+    if newest is None:
+        return 0
+    expired = and_(FileEvent.created_at < cutoff, FileEvent.id < newest)
+
+    if dry_run:
+        return FileEvent.query.filter(expired).count()
+
+    deleted = 0
+    while True:
+        ids = db.session.scalars(select(FileEvent.id).where(expired).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        db.session.execute(delete(FileEvent).where(FileEvent.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+def purge_stale_spools(grace, dry_run=False):
+    """Remove upload spool files older than grace seconds left behind by crashed workers"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    if not os.path.isdir(upload_folder):
+        return 0
+
+    cutoff = time.time() - grace
+    removed = 0
+    for name in os.listdir(upload_folder):
+        path = os.path.join(upload_folder, name)
+        if name.startswith('.upload-') and name.endswith('.part') and os.path.getmtime(path) < cutoff:
+            if not dry_run:
+                os.remove(path)
+            removed += 1
+    return removed
+
+def generate_pending_previews(batch_size):
+    """Generate up to batch_size previews left pending for longer than PREVIEW_RETRY_AFTER"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=current_app.config['PREVIEW_RETRY_AFTER'])
+    digests = db.session.scalars(
+        select(Blob.hash).where(Blob.preview_status == PreviewStatus.PENDING, Blob.created_at < cutoff)
+        .limit(batch_size)
+    ).all()
+    for digest in digests:
+        generate_preview(digest)
+    return len(digests)
+
+def index_pending_files(batch_size):
+    """Index up to batch_size files left out of the search index for longer than SEARCH_RETRY_AFTER"""
+    if search_dialect() is None:
+        return 0
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=current_app.config['SEARCH_RETRY_AFTER'])
+    return index_files(unindexed_files(batch_size, uploaded_before=cutoff))
+
+def is_referenced(digest):
+    return db.session.scalar(select(File.id).where(File.content_hash == digest).limit(1)) is not None
+
+RECONCILE_STATS = ('orphan_blobs', 'unreferenced_blobs', 'dangling_files')
+
+def reconcile_blobs(grace, batch_size, reap=False):
+    """Compare stored content with the blobs table
+
+    Blobs younger than grace seconds are ignored: an upload stores its
+    content just before committing the row that references it.
+    """
+    storage = get_storage()
+    cutoff = time.time() - grace
+    now = datetime.datetime.utcnow()
+    stats = {'orphan_blobs': 0, 'orphan_bytes': 0, 'unreferenced_blobs': 0, 'dangling_files': 0}
+
+    stored = {}
+    for key, modified in storage.list_blobs():
+        stored[key.rsplit('/', 1)[-1]] = modified
+
+    # Stored content no Blob row points at
+    hashes = list(stored)
+    for start in range(0, len(hashes), batch_size):
+        batch = hashes[start:start + batch_size]
+        known = set(db.session.scalars(select(Blob.hash).where(Blob.hash.in_(batch))))
+        for digest in batch:
+            if digest in known or stored[digest] > cutoff:
+                continue
+            stats['orphan_blobs'] += 1
+            key = blob_key(digest)
+            stats['orphan_bytes'] += storage.size(key)
+            logger.info("Orphan blob %s", key)
+            if reap:
+                storage.delete(key)
+
+    # Blob rows nothing references any more, or whose content is gone
+    last_hash = ''
+    while True:
+        blobs = Blob.query.filter(Blob.hash > last_hash).order_by(Blob.hash).limit(batch_size).all()
+        if not blobs:
+            break
+        last_hash = blobs[-1].hash
+
+        for blob in blobs:
+            if blob.created_at and (now - blob.created_at).total_seconds() < grace:
+                continue
+            if not is_referenced(blob.hash):
+                stats['unreferenced_blobs'] += 1
+                # Lock the row and re-check so a concurrent upload cannot gain a reference meanwhile
+                if reap and db.session.get(Blob, blob.hash, with_for_update=True) and not is_referenced(blob.hash):
+                    storage.delete(blob_key(blob.hash))
+                    storage.delete(preview_key(blob.hash))
+                    db.session.delete(blob)
+            elif blob.hash not in stored:
+                dangling = File.query.filter_by(content_hash=blob.hash).all()
+                stats['dangling_files'] += len(dangling)
+                for file in dangling:
+                    logger.warning("File %s (%s) has no stored content", file.id, file.original_filename)
+                if reap:
+                    delete_download_tokens([file.id for file in dangling])
+                    for file in dangling:
+                        db.session.delete(file)
+                    storage.delete(preview_key(blob.hash))
+                    db.session.delete(blob)
+        db.session.commit()
+
+    # Legacy uploads stored outside the blob store
+    missing = [
+        row.id for row in db.session.execute(
+            select(File.id, File.file_path).where(File.content_hash.is_(None)))
+        if not os.path.exists(row.file_path)
+    ]
+    stats['dangling_files'] += len(missing)
+    for file_id in missing:
+        logger.warning("File %s has no stored content", file_id)
+    if reap and missing:
+        delete_download_tokens(missing)
+        db.session.execute(delete(File).where(File.id.in_(missing)))
+        record_file_events(db.session, FileAction.DELETED, missing)
+        unindex_files(db.session, missing)
+        db.session.commit()
+
+    return stats
+
+def run_janitor(reap=False, dry_run=False):
+    """Run every maintenance step once and return what was reclaimed"""
+    config = current_app.config
+    batch_size = config['JANITOR_BATCH_SIZE']
+    grace = config['JANITOR_ORPHAN_GRACE']
+    started = time.monotonic()
+
+    stats = {
+        'download_tokens': purge_download_tokens(batch_size, dry_run),
+        'redeemed_tokens': purge_redeemed_tokens(batch_size, dry_run),
+        'upload_sessions': 0 if dry_run else purge_expired_upload_sessions(batch_size),
+        'outbox_emails': purge_sent_emails(batch_size, dry_run),
+        'file_events': purge_file_events(batch_size, dry_run),
+        'stale_spools': purge_stale_spools(grace, dry_run),
+        'previews': 0 if dry_run else generate_pending_previews(config['PREVIEW_BATCH_SIZE']),
+        'search_index': 0 if dry_run else index_pending_files(config['SEARCH_BATCH_SIZE']),
+    }
+    stats.update(reconcile_blobs(grace, batch_size, reap=reap and not dry_run))
+    stats['duration_seconds'] = round(time.monotonic() - started, 3)
+
+    logger.info("Janitor run: %s", ' '.join(f'{k}={v}' for k, v in stats.items()))
+    if not dry_run:
+        # Per-process running totals, plus the exported counters
+        finished_at = time.time()
+        totals = current_app.extensions.setdefault('janitor_totals', {})
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+        totals['runs'] = totals.get('runs', 0) + 1
+        current_app.extensions['janitor_last_run'] = dict(stats, finished_at=finished_at)
+
+        # Storage findings are only reclaimed when reaping
+        found = RECONCILE_STATS if not reap else ()
+        reclaimed = {name: value for name, value in stats.items()
+                     if name not in found and name not in ('orphan_bytes', 'duration_seconds')}
+        record_janitor_run(reclaimed, {'orphan_blobs': stats['orphan_bytes'] if reap else 0}, finished_at)
+    return stats
+
+def start_janitor(app, interval=None):
+    """Run the janitor every interval seconds in a daemon thread of this process"""
+    interval = interval or app.config['JANITOR_INTERVAL']
+
+    def loop():
+        # Spread workers out so they do not all sweep at the same moment
+        time.sleep(random.uniform(0, interval))
+        while True:
+            with app.app_context():
+                try:
+                    run_janitor(reap=app.config['JANITOR_REAP'])
+                except Exception:
+                    logger.exception("Janitor run failed")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='janitor', daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.INFO)
+    with app.app_context():
+        results = run_janitor(reap='--reap' in sys.argv[1:], dry_run='--dry-run' in sys.argv[1:])
+    for name, value in results.items():
+        print(f"{name}: {value}")
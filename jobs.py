@@ -0,0 +1,73 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app import db
+
+# Background jobs
+#
+# Work that follows an upload (previews, search indexing) runs on small
+# per-process pools instead of in the request. A pool runs each job in an
+# app context of its own and admits at most queue_depth jobs queued or
+# running: past that, submit() refuses at once and the job is left for the
+# janitor's sweep, so a burst of uploads can never pile up unbounded work.
+# A job already queued under the same key is not queued twice.
+
+logger = logging.getLogger(__name__)
+
+class JobPool:
+    """Bounded executor running jobs in app contexts off the request path"""
+
+    def __init__(self, app, name, workers, queue_depth):
+        self.app = app
+        self.name = name
+        self.pid = os.getpid()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(queue_depth)
+        self.pending = set()
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, args):
+        with self.app.app_context():
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("%s job %s failed", self.name, key)
+            finally:
+                db.session.remove()
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) unless key is already queued; returns False when the queue is full"""
+        with self._lock:
+            if key in self.pending:
+                return True
+            if not self.slots.acquire(blocking=False):
+                self.rejected += 1
+                return False
+            self.pending.add(key)
+
+        def done(_):
+            with self._lock:
+                self.pending.discard(key)
+            self.slots.release()
+
+        try:
+            future = self.executor.submit(self.run, key, fn, args)
+        except BaseException:
+            done(None)
+            raise
+        future.add_done_callback(done)
+        return True
+
+def get_job_pool(name, workers, queue_depth):
+    """The current app's per-process pool called name, or None when workers is 0"""
+    if not workers:
+        return None
+    pool = current_app.extensions.get(f'{name}_jobs')
+    # Executor threads do not survive fork()
+    if pool is None or pool.pid != os.getpid():
+        pool = current_app.extensions[f'{name}_jobs'] = JobPool(
+            current_app._get_current_object(), name, workers, queue_depth)
+    return pool
@@ -0,0 +1,184 @@
+import sys
+import time
+import uuid
+import random
+import logging
+import datetime
+import threading
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import select, update, or_, and_
+from app import db, mail
+from models import OutboundEmail, EmailStatus
+
+# Outbound mail queue
+#
+# Request handlers never talk to the SMTP server. They add an OutboundEmail
+# row in their own transaction (queue_email) and wake the workers
+# (notify_mail_workers) once it is committed. Worker threads claim due
+# messages in batches and send each batch over one SMTP connection.
+# Failures are retried with exponential backoff until MAIL_MAX_ATTEMPTS.
+#
+# Claiming uses a conditional UPDATE tagged with a per-batch token, so
+# several threads or processes can drain the same outbox. A batch whose
+# worker died is claimed again after MAIL_CLAIM_TIMEOUT.
+#
+# Usage: python mailer.py [--forever]
+#   Delivers everything that is due once, or keeps polling with --forever
+#   (for deployments running with MAIL_QUEUE_WORKERS=0).
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+def queue_email(recipient, subject, html):
+    """Add a message to the outbox; it is sent once the caller commits"""
+    email = OutboundEmail(recipient=recipient, subject=subject, html=html)
+    db.session.add(email)
+    return email
+
+def retry_delay(attempts):
+    """Seconds before the next attempt: exponential backoff with jitter"""
+    config = current_app.config
+    delay = min(config['MAIL_RETRY_BACKOFF'] * 2 ** (attempts - 1), config['MAIL_RETRY_BACKOFF_MAX'])
+    return delay * random.uniform(0.5, 1.0)
+
+def claim_batch(batch_size):
+    """Mark up to batch_size due messages as being sent by this worker and return them"""
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=current_app.config['MAIL_CLAIM_TIMEOUT'])
+    claimable = or_(
+        and_(OutboundEmail.status == EmailStatus.PENDING, OutboundEmail.next_attempt_at <= now),
+        and_(OutboundEmail.status == EmailStatus.SENDING, OutboundEmail.claimed_at < stale)
+    )
+
+    ids = db.session.scalars(
+        select(OutboundEmail.id).where(claimable)
+        .order_by(OutboundEmail.next_attempt_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not ids:
+        db.session.commit()
+        return []
+
+    # Re-checking the condition in the UPDATE keeps two workers from claiming the same row
+    token = uuid.uuid4().hex
+    db.session.execute(
+        update(OutboundEmail)
+        .where(OutboundEmail.id.in_(ids), claimable)
+        .values(status=EmailStatus.SENDING, claim_token=token, claimed_at=now)
+    )
+    db.session.commit()
+    return OutboundEmail.query.filter_by(claim_token=token).all()
+
+def deliver_batch(emails):
+    """Send a claimed batch over one SMTP connection; returns (sent, failed)"""
+    sent = failed = 0
+    errors = {}
+
+    try:
+        with mail.connect() as connection:
+            for email in emails:
+                try:
+                    connection.send(Message(subject=email.subject, recipients=[email.recipient], html=email.html))
+                    errors[email.id] = None
+                except Exception as e:
+                    errors[email.id] = str(e)
+    except Exception as e:
+        # Connecting or logging in failed; nothing in the batch went out
+        logger.warning("Could not connect to %s:%s: %s", current_app.config['MAIL_SERVER'],
+                       current_app.config['MAIL_PORT'], e)
+        for email in emails:
+            errors.setdefault(email.id, str(e))
+
+    now = datetime.datetime.utcnow()
+    for email in emails:
+        error = errors.get(email.id, 'Not attempted')
+        email.claim_token = None
+        email.attempts += 1
+        if error is None:
+            email.status = EmailStatus.SENT
+            email.sent_at = now
+            email.last_error = None
+            sent += 1
+            continue
+
+        email.last_error = error
+        failed += 1
+        if email.attempts >= current_app.config['MAIL_MAX_ATTEMPTS']:
+            email.status = EmailStatus.FAILED
+            logger.error("Giving up on email %s to %s: %s", email.id, email.recipient, error)
+        else:
+            email.status = EmailStatus.PENDING
+            email.next_attempt_at = now + datetime.timedelta(seconds=retry_delay(email.attempts))
+    db.session.commit()
+    return sent, failed
+
+def process_outbox(batch_size=None):
+    """Deliver every message that is due; returns counts of sent and failed attempts"""
+    batch_size = batch_size or current_app.config['MAIL_QUEUE_BATCH_SIZE']
+    stats = {'sent': 0, 'failed': 0}
+    while True:
+        emails = claim_batch(batch_size)
+        if not emails:
+            return stats
+        sent, failed = deliver_batch(emails)
+        stats['sent'] += sent
+        stats['failed'] += failed
+
+def start_mail_workers(app, workers=None):
+    """Start the delivery threads of this process (once)"""
+    workers = app.config['MAIL_QUEUE_WORKERS'] if workers is None else workers
+
+    def loop():
+        while True:
+            _wakeup.clear()
+            with app.app_context():
+                try:
+                    process_outbox()
+                except Exception:
+                    logger.exception("Mail delivery run failed")
+                finally:
+                    db.session.remove()
+            _wakeup.wait(app.config['MAIL_QUEUE_POLL_INTERVAL'])
+
+    with _workers_lock:
+        # Threads inherited through fork() are dead in the child
+        _workers[:] = [thread for thread in _workers if thread.is_alive()]
+        while len(_workers) < workers:
+            thread = threading.Thread(target=loop, name=f'mailer-{len(_workers)}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+    return _workers
+
+def ensure_mail_workers():
+    """Start this process's delivery threads on first use; returns whether any run"""
+    if any(thread.is_alive() for thread in _workers):
+        return True
+    app = current_app._get_current_object()
+    # Tests drive delivery explicitly with process_outbox()
+    if app.testing or not app.config['MAIL_QUEUE_WORKERS']:
+        return False
+    start_mail_workers(app)
+    return True
+
+def notify_mail_workers():
+    """Wake the delivery threads after committing queued mail"""
+    if ensure_mail_workers():
+        _wakeup.set()
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.INFO)
+    with app.app_context():
+        while True:
+            results = process_outbox()
+            print(f"sent: {results['sent']} failed: {results['failed']}")
+            if '--forever' not in sys.argv[1:]:
+                break
+            time.sleep(app.config['MAIL_QUEUE_POLL_INTERVAL'])
@@ -1,4 +1,11 @@
-from app import app
+from app import create_app, start_background_tasks
+from database import upgrade_schema
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Development server: apply pending migrations (production runs `flask --app main init-db`)
+    with app.app_context():
+        upgrade_schema()
+    start_background_tasks(app)
+    app.run(host="0.0.0.0", port=5000, debug=app.config['DEBUG'])
@@ -0,0 +1,143 @@
+import os
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, multiprocess
+except ImportError:  # prometheus_client is only needed for METRICS_ENABLED
+    prometheus_client = None
+
+# Prometheus request metrics (exposed on /metrics, see monitoring_routes.py)
+#
+# Every request records, labelled by Flask endpoint (blueprint.view), its
+# count by status, its latency to the start of the response, the body bytes
+# received (uploads) and sent (downloads), and how many SQL statements it ran
+# and for how long. Named TTLCaches count their hits and misses. Janitor
+# runs count the rows and bytes each task reclaimed, and when they finished.
+#
+# Under gunicorn each worker keeps its own values; gunicorn.conf.py points
+# PROMETHEUS_MULTIPROC_DIR at a shared directory so /metrics, served by any
+# one worker, reports the sum over all of them. The variable must be set
+# before prometheus_client is imported.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+if prometheus_client is not None:
+    REQUESTS = Counter('fileshare_http_requests_total', 'HTTP requests handled',
+                       ['method', 'endpoint', 'status'])
+    REQUEST_LATENCY = Histogram('fileshare_http_request_duration_seconds',
+                                'Time from receiving a request to starting its response',
+                                ['method', 'endpoint'], buckets=LATENCY_BUCKETS)
+    REQUESTS_IN_PROGRESS = Gauge('fileshare_http_requests_in_progress', 'Requests being handled',
+                                 multiprocess_mode='livesum')
+    REQUEST_BYTES = Counter('fileshare_http_request_bytes_total', 'Request body bytes received (uploads)',
+                            ['endpoint'])
+    RESPONSE_BYTES = Counter('fileshare_http_response_bytes_total',
+                             'Response body bytes sent, by declared length (downloads)', ['endpoint'])
+    DB_QUERIES = Histogram('fileshare_db_queries_per_request', 'SQL statements run by one request',
+                           ['endpoint'], buckets=QUERY_COUNT_BUCKETS)
+    DB_TIME = Histogram('fileshare_db_seconds_per_request', 'Time one request spent running SQL',
+                        ['endpoint'], buckets=LATENCY_BUCKETS)
+    CACHE_LOOKUPS = Counter('fileshare_cache_lookups_total', 'In-process cache lookups', ['cache', 'result'])
+    JANITOR_ROWS = Counter('fileshare_janitor_reclaimed_total', 'Rows and files reclaimed or processed by the janitor',
+                           ['task'])
+    JANITOR_BYTES = Counter('fileshare_janitor_reclaimed_bytes_total', 'Stored bytes reclaimed by the janitor',
+                            ['task'])
+    JANITOR_LAST_RUN = Gauge('fileshare_janitor_last_run_timestamp_seconds',
+                             'Unix time the last janitor run finished', multiprocess_mode='max')
+
+def init_metrics(app):
+    """Record request metrics for app if METRICS_ENABLED and prometheus_client is installed"""
+    if not app.config['METRICS_ENABLED'] or prometheus_client is None:
+        if app.config['METRICS_ENABLED']:
+            app.logger.warning("METRICS_ENABLED is set but prometheus_client is not installed")
+        return
+
+    app.extensions['metrics'] = True
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(leave_request)
+
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+
+def endpoint_label():
+    # The endpoint rather than the path keeps the label set small and bounded
+    return request.endpoint or 'unmatched'
+
+def start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_db = [0, 0.0]  # Statements, seconds
+    REQUESTS_IN_PROGRESS.inc()
+
+def finish_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+
+    endpoint = endpoint_label()
+    REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+    REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+    if request.content_length:
+        REQUEST_BYTES.labels(endpoint).inc(request.content_length)
+    if response.content_length:
+        RESPONSE_BYTES.labels(endpoint).inc(response.content_length)
+    queries, seconds = g.metrics_db
+    DB_QUERIES.labels(endpoint).observe(queries)
+    DB_TIME.labels(endpoint).observe(seconds)
+    return response
+
+def leave_request(exc):
+    # Teardown runs even when a hook fails before the response is built
+    if 'metrics_db' in g:
+        REQUESTS_IN_PROGRESS.dec()
+        g.pop('metrics_db')
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_started'].pop()
+    if has_request_context():
+        stats = g.get('metrics_db')
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - started
+
+def handle_error(context):
+    if context.connection is not None and context.connection.info.get('metrics_query_started'):
+        context.connection.info['metrics_query_started'].pop()
+
+def record_cache_lookup(cache, hit):
+    if prometheus_client is not None:
+        CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def record_janitor_run(reclaimed, reclaimed_bytes, finished_at):
+    """Count what a janitor run reclaimed, each {task: amount}"""
+    if prometheus_client is None:
+        return
+    for task, count in reclaimed.items():
+        JANITOR_ROWS.labels(task).inc(count)
+    for task, size in reclaimed_bytes.items():
+        JANITOR_BYTES.labels(task).inc(size)
+    JANITOR_LAST_RUN.set(finished_at)
+
+def render_metrics():
+    """Current metrics in the Prometheus text format; returns (body, content type)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """Drop an exited worker's live gauges (called from gunicorn's child_exit hook)"""
+    if prometheus_client is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
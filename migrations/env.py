@@ -0,0 +1,50 @@
+from logging.config import fileConfig
+from alembic import context
+from flask import current_app, has_app_context
+from app import create_app, db
+from database import include_object
+
+# Alembic environment: migrates the app's primary database. Read replicas
+# receive schema changes through replication, never directly.
+
+config = context.config
+
+if config.config_file_name and not has_app_context():
+    fileConfig(config.config_file_name)
+
+def run_migrations_offline():
+    """Emit the migration SQL instead of running it (alembic upgrade --sql)"""
+    context.configure(
+        url=db.engine.url.render_as_string(hide_password=False),
+        target_metadata=db.metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={'paramstyle': 'named'},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with db.engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=db.metadata,
+            include_object=include_object,
+            # SQLite can only alter tables by copying them
+            render_as_batch=connection.dialect.name == 'sqlite',
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+def run_migrations():
+    if context.is_offline_mode():
+        run_migrations_offline()
+    else:
+        run_migrations_online()
+
+if has_app_context():
+    # Called from the app (flask --app main init-db)
+    run_migrations()
+else:
+    with create_app().app_context():
+        run_migrations()
@@ -0,0 +1,64 @@
+"""Baseline schema: the tables init-db created before migrations were introduced
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 07:42:50.021464
+
+A database from that time has exactly these tables and no alembic_version;
+upgrade_schema() stamps it here and the later revisions bring it up to date.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=64), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password_hash', sa.String(length=256), nullable=False),
+        sa.Column('role', sa.Enum('OPERATIONS', 'CLIENT', name='userrole'), nullable=False),
+        sa.Column('is_verified', sa.Boolean(), nullable=True),
+        sa.Column('verification_token', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+
+    op.create_table('files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('original_filename', sa.String(length=255), nullable=False),
+        sa.Column('file_path', sa.String(length=512), nullable=False),
+        sa.Column('file_type', sa.String(length=10), nullable=False),
+        sa.Column('file_size', sa.Integer(), nullable=False),
+        sa.Column('uploader_id', sa.Integer(), nullable=False),
+        sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['uploader_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    op.create_table('download_tokens',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('token', sa.String(length=512), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expiration', sa.DateTime(), nullable=False),
+        sa.Column('is_used', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['file_id'], ['files.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token')
+    )
+
+def downgrade():
+    op.drop_table('download_tokens')
+    op.drop_table('files')
+    op.drop_table('users')
+    sa.Enum(name='userrole').drop(op.get_bind(), checkfirst=True)
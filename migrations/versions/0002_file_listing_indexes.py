@@ -0,0 +1,29 @@
+"""Keyset pagination indexes for the file listing
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 07:44:03.117942
+"""
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# Every sort key is paired with id so the (sort_key, id) seek is a single index range scan
+INDEXES = {
+    'ix_files_uploaded_at_id': ['uploaded_at', 'id'],
+    'ix_files_original_filename_id': ['original_filename', 'id'],
+    'ix_files_file_size_id': ['file_size', 'id'],
+    'ix_files_file_type_uploaded_at_id': ['file_type', 'uploaded_at', 'id'],
+    'ix_files_uploader_id_uploaded_at_id': ['uploader_id', 'uploaded_at', 'id'],
+}
+
+def upgrade():
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'files', columns)
+
+def downgrade():
+    for name in reversed(list(INDEXES)):
+        op.drop_index(name, table_name='files')
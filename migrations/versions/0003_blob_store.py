@@ -0,0 +1,40 @@
+"""Content-addressed blob store: blobs table, files.content_hash, 64-bit file sizes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 07:46:31.840275
+
+Files uploaded before the blob store keep a NULL content_hash and their own
+file_path, which the app still serves.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('blobs',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+    )
+
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_files_content_hash', 'blobs', ['content_hash'], ['hash'])
+        batch_op.alter_column('file_size', existing_type=sa.Integer(), type_=sa.BigInteger(),
+                              existing_nullable=False)
+    op.create_index('ix_files_content_hash', 'files', ['content_hash'])
+
+def downgrade():
+    op.drop_index('ix_files_content_hash', table_name='files')
+    with op.batch_alter_table('files') as batch_op:
+        batch_op.drop_column('content_hash')
+        batch_op.alter_column('file_size', existing_type=sa.BigInteger(), type_=sa.Integer(),
+                              existing_nullable=False)
+    op.drop_table('blobs')
@@ -0,0 +1,34 @@
+"""Resumable chunked upload sessions
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 07:48:15.392641
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('upload_sessions',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('uploader_id', sa.Integer(), nullable=False),
+        sa.Column('original_filename', sa.String(length=255), nullable=False),
+        sa.Column('file_size', sa.BigInteger(), nullable=False),
+        sa.Column('chunk_size', sa.Integer(), nullable=False),
+        sa.Column('expected_hash', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['uploader_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_upload_sessions_uploader_id', 'upload_sessions', ['uploader_id'])
+    op.create_index('ix_upload_sessions_expires_at', 'upload_sessions', ['expires_at'])
+
+def downgrade():
+    op.drop_index('ix_upload_sessions_expires_at', table_name='upload_sessions')
+    op.drop_index('ix_upload_sessions_uploader_id', table_name='upload_sessions')
+    op.drop_table('upload_sessions')
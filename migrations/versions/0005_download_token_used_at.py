@@ -0,0 +1,20 @@
+"""Redemption time of download tokens
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 07:51:40.668013
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('download_tokens', sa.Column('used_at', sa.DateTime(), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table('download_tokens') as batch_op:
+        batch_op.drop_column('used_at')
@@ -0,0 +1,28 @@
+"""Indexes for email verification, download token and janitor lookups
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 08:05:12.448210
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Partial: only unverified users hold a token
+    op.create_index('ix_users_verification_token', 'users', ['verification_token'], unique=True,
+                    postgresql_where=sa.text('verification_token IS NOT NULL'),
+                    sqlite_where=sa.text('verification_token IS NOT NULL'))
+    op.create_index('ix_download_tokens_file_id', 'download_tokens', ['file_id'])
+    op.create_index('ix_download_tokens_user_id', 'download_tokens', ['user_id'])
+    op.create_index('ix_download_tokens_expiration', 'download_tokens', ['expiration'])
+
+def downgrade():
+    op.drop_index('ix_download_tokens_expiration', table_name='download_tokens')
+    op.drop_index('ix_download_tokens_user_id', table_name='download_tokens')
+    op.drop_index('ix_download_tokens_file_id', table_name='download_tokens')
+    op.drop_index('ix_users_verification_token', table_name='users')
@@ -0,0 +1,29 @@
+"""File change feed events
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 11:20:37.905113
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('file_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('action', sa.Enum('ADDED', 'DELETED', name='fileaction'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_autoincrement=True
+    )
+    op.create_index('ix_file_events_created_at', 'file_events', ['created_at'])
+
+def downgrade():
+    op.drop_index('ix_file_events_created_at', table_name='file_events')
+    op.drop_table('file_events')
+    sa.Enum(name='fileaction').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,30 @@
+"""Preview state on blobs
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 13:02:18.530914
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+preview_status = sa.Enum('PENDING', 'READY', 'UNAVAILABLE', 'FAILED', name='previewstatus')
+
+def upgrade():
+    preview_status.create(op.get_bind(), checkfirst=True)
+    # Existing blobs start PENDING; the janitor generates their previews
+    op.add_column('blobs', sa.Column('preview_status', preview_status, nullable=False,
+                                     server_default='PENDING'))
+    op.add_column('blobs', sa.Column('preview_type', sa.String(length=64), nullable=True))
+    op.create_index('ix_blobs_preview_status_created_at', 'blobs', ['preview_status', 'created_at'])
+
+def downgrade():
+    op.drop_index('ix_blobs_preview_status_created_at', table_name='blobs')
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.drop_column('preview_type')
+        batch_op.drop_column('preview_status')
+    preview_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,41 @@
+"""Full-text search index
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 16:05:12.418730
+
+Existing files are not indexed here; run `flask --app main reindex` after
+upgrading, or let the janitor index them in batches.
+"""
+from alembic import op
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+UPGRADE = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE file_search USING fts5("
+        "filename, content, tokenize = 'porter unicode61 remove_diacritics 2')",
+        "INSERT INTO file_search (file_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    ],
+    'postgresql': [
+        "CREATE TABLE file_search ("
+        "file_id INTEGER PRIMARY KEY REFERENCES files (id) ON DELETE CASCADE, "
+        "filename TEXT NOT NULL, "
+        "content TEXT NOT NULL, "
+        "document tsvector GENERATED ALWAYS AS (setweight(to_tsvector('english', filename), 'A') || "
+        "setweight(to_tsvector('english', content), 'D')) STORED)",
+        "CREATE INDEX ix_file_search_document ON file_search USING gin (document)",
+    ],
+}
+
+def upgrade():
+    # Other databases have no search
+    for statement in UPGRADE.get(op.get_bind().dialect.name, ()):
+        op.execute(statement)
+
+def downgrade():
+    if op.get_bind().dialect.name in UPGRADE:
+        op.execute('DROP TABLE IF EXISTS file_search')
@@ -0,0 +1,26 @@
+"""Redemptions of signed download tokens, shared by every worker
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 17:12:44.205317
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table('redeemed_tokens',
+        sa.Column('nonce', sa.String(length=16), nullable=False),
+        sa.Column('used_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('nonce')
+    )
+    op.create_index('ix_redeemed_tokens_expires_at', 'redeemed_tokens', ['expires_at'])
+
+def downgrade():
+    op.drop_index('ix_redeemed_tokens_expires_at', table_name='redeemed_tokens')
+    op.drop_table('redeemed_tokens')
@@ -1,14 +1,36 @@
 import datetime
 import enum
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from hashing import get_password_hasher
 
 class UserRole(enum.Enum):
     OPERATIONS = 'operations'
     CLIENT = 'client'
 
+class PreviewStatus(enum.Enum):
+    PENDING = 'pending'
+    READY = 'ready'
+    UNAVAILABLE = 'unavailable'
+    FAILED = 'failed'
+
+class FileAction(enum.Enum):
+    ADDED = 'added'
+    DELETED = 'deleted'
+
+class EmailStatus(enum.Enum):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Email verification lookups; only unverified users hold a token, so the index stays small
+        db.Index('ix_users_verification_token', 'verification_token', unique=True,
+                 postgresql_where=db.text('verification_token IS NOT NULL'),
+                 sqlite_where=db.text('verification_token IS NOT NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -23,10 +45,51 @@ class User(db.Model):
     files = db.relationship('File', backref='uploader', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_password_hasher().hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(self.password_hash, password)
+    
+    def is_operations_user(self):
+        return self.role == UserRole.OPERATIONS
+    
+    def is_client_user(self):
+        return self.role == UserRole.CLIENT
+
+class Blob(db.Model):
+    """Content-addressed stored file, shared by every File with the same SHA-256"""
+    __tablename__ = 'blobs'
+    __table_args__ = (
+        # Janitor sweep of previews that were never generated
+        db.Index('ix_blobs_preview_status_created_at', 'preview_status', 'created_at'),
+    )
+    
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 hex digest
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    preview_status = db.Column(db.Enum(PreviewStatus), nullable=False, default=PreviewStatus.PENDING,
+                               server_default=PreviewStatus.PENDING.name)  # See previews.py
+    preview_type = db.Column(db.String(64), nullable=True)  # Mimetype of the stored preview
+    
+    # Relationships
+    files = db.relationship('File', backref='blob', lazy=True)
+
+class UserPrincipal:
+    """Detached, immutable snapshot of the fields authorization needs, safe to cache across requests"""
+    __slots__ = ('id', 'username', 'email', 'role', 'is_verified', 'created_at')
+    
+    def __init__(self, id, username, email, role, is_verified, created_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.is_verified = is_verified
+        self.created_at = created_at
+    
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.role, user.is_verified, user.created_at)
     
     def is_operations_user(self):
         return self.role == UserRole.OPERATIONS
@@ -36,13 +99,24 @@ class User(db.Model):
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Keyset pagination indexes for the file listing: every sort key is
+        # paired with id so the (sort_key, id) seek is a single index range scan
+        db.Index('ix_files_uploaded_at_id', 'uploaded_at', 'id'),
+        db.Index('ix_files_original_filename_id', 'original_filename', 'id'),
+        db.Index('ix_files_file_size_id', 'file_size', 'id'),
+        # Filtered listings (by type or uploader) ordered by upload time
+        db.Index('ix_files_file_type_uploaded_at_id', 'file_type', 'uploaded_at', 'id'),
+        db.Index('ix_files_uploader_id_uploaded_at_id', 'uploader_id', 'uploaded_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(512), nullable=False)
     file_type = db.Column(db.String(10), nullable=False)
-    file_size = db.Column(db.Integer, nullable=False)  # Size in bytes
+    file_size = db.Column(db.BigInteger, nullable=False)  # Size in bytes
+    content_hash = db.Column(db.String(64), db.ForeignKey('blobs.hash'), nullable=True, index=True)  # SHA-256 hex digest
     uploader_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
@@ -55,17 +129,60 @@ class File(db.Model):
             'uploader': self.uploader.username,
             'uploaded_at': self.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
         }
+    
+    @staticmethod
+    def listing_columns():
+        """Columns needed to serialize a file, for projection queries joined to users"""
+        return (
+            File.id,
+            File.original_filename,
+            File.file_type,
+            File.file_size,
+            File.uploaded_at,
+            User.username.label('uploader'),
+        )
+    
+    @staticmethod
+    def row_to_dict(row):
+        """Serialize a row selected with listing_columns() the same way as to_dict()"""
+        return {
+            'id': row.id,
+            'filename': row.original_filename,
+            'file_type': row.file_type,
+            'file_size': row.file_size,
+            'uploader': row.uploader,
+            'uploaded_at': row.uploaded_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class FileEvent(db.Model):
+    """Entry in the file change feed (see changes.py); the id is the feed cursor"""
+    __tablename__ = 'file_events'
+    __table_args__ = {'sqlite_autoincrement': True}  # Never reuse ids, even after a purge empties the table
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, nullable=False)  # No foreign key: deletions outlive the file row
+    action = db.Column(db.Enum(FileAction), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'action': self.action.value,
+            'file_id': self.file_id,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
 
 class DownloadToken(db.Model):
     __tablename__ = 'download_tokens'
     
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(512), nullable=False, unique=True)
-    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    token = db.Column(db.String(512), nullable=False, unique=True)  # The unique index serves redemption lookups
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    expiration = db.Column(db.DateTime, nullable=False)
+    expiration = db.Column(db.DateTime, nullable=False, index=True)  # Janitor purge of expired tokens
     is_used = db.Column(db.Boolean, default=False)
+    used_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     file = db.relationship('File', backref='download_tokens')
@@ -73,3 +190,69 @@ class DownloadToken(db.Model):
     
     def is_expired(self):
         return datetime.datetime.utcnow() > self.expiration
+
+class RedeemedToken(db.Model):
+    """Redemption of a signed download token, shared by every worker (see utils.validate_signed_token)"""
+    __tablename__ = 'redeemed_tokens'
+    
+    nonce = db.Column(db.String(16), primary_key=True)  # The token's random nonce
+    used_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Janitor purge once the token has expired
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(32), primary_key=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)  # Declared total size in bytes
+    chunk_size = db.Column(db.Integer, nullable=False)
+    expected_hash = db.Column(db.String(64), nullable=True)  # Optional client-supplied SHA-256
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    # Relationships
+    uploader = db.relationship('User', backref='upload_sessions')
+    
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.file_size // self.chunk_size))
+    
+    def expected_chunk_size(self, index):
+        """Size every chunk must have; only the last one may be shorter"""
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.file_size - self.chunk_size * (self.total_chunks - 1)
+    
+    def is_expired(self):
+        return datetime.datetime.utcnow() > self.expires_at
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.original_filename,
+            'file_size': self.file_size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class OutboundEmail(db.Model):
+    """Queued email, delivered by the mailer workers (see mailer.py)"""
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Enum(EmailStatus), nullable=False, default=EmailStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True)  # Worker batch currently delivering it
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
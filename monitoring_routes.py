@@ -0,0 +1,32 @@
+import hmac
+from flask import Blueprint, jsonify, request, current_app
+from app import db
+from models import UserRole
+from utils import token_required, require_role
+from database import pool_status
+from metrics import render_metrics
+
+# Create blueprint for operational monitoring endpoints
+monitoring_bp = Blueprint('monitoring', __name__)
+
+@monitoring_bp.route('/api/ops/db-pool', methods=['GET'])
+@token_required
+@require_role([UserRole.OPERATIONS])
+def db_pool(current_user):
+    """Connection pool usage and checkout wait times of this worker process, per bind"""
+    return jsonify({
+        'binds': {key or 'primary': pool_status(engine) for key, engine in db.engines.items()}
+    }), 200
+
+@monitoring_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Request metrics in the Prometheus text format, summed over all worker processes"""
+    if 'metrics' not in current_app.extensions:
+        return jsonify({'message': 'Metrics are disabled'}), 404
+
+    token = current_app.config['METRICS_AUTH_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'message': 'Invalid metrics token!'}), 401
+
+    body, content_type = render_metrics()
+    return body, 200, {'Content-Type': content_type}
@@ -0,0 +1,281 @@
+import io
+import re
+import json
+import logging
+import zipfile
+import tempfile
+import posixpath
+from contextlib import contextmanager
+from xml.etree.ElementTree import iterparse
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from models import Blob, PreviewStatus
+from storage import get_storage, blob_key
+from jobs import get_job_pool
+
+# File previews
+#
+# After an upload commits new content, a preview of it is generated on a
+# bounded per-process pool (PREVIEW_WORKERS threads, at most
+# PREVIEW_QUEUE_DEPTH jobs queued or running) so the upload response never
+# waits for it. Previews belong to the blob, like the content, so duplicate
+# uploads share one:
+#
+#  - the thumbnail Office embeds in the package (docProps/thumbnail.jpeg or .png)
+#  - otherwise a JSON summary: the opening text of a document or of the
+#    first slide, or the top-left cells of the first sheet
+#
+# The preview is stored at previews/ab/<sha256> in the storage backend and
+# Blob.preview_status/preview_type record the outcome. Jobs rejected by a
+# full queue, lost with their process, or uploaded before previews existed
+# stay PENDING; the janitor generates those after PREVIEW_RETRY_AFTER.
+#
+# Package members are parsed incrementally and capped at PREVIEW_MAX_SIZE
+# uncompressed bytes, so a zip bomb costs no more than that.
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_TYPES = {'.jpeg': 'image/jpeg', '.jpg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif'}
+SUMMARY_TYPE = 'application/json'
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+S = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def preview_key(digest):
+    """Storage key of the preview of the blob with the given SHA-256 hex digest"""
+    return f"previews/{digest[:2]}/{digest}"
+
+# Extraction
+
+def open_member(package, name, max_size):
+    """Open a package member for parsing, or None if it is missing or too large"""
+    try:
+        info = package.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > max_size:
+        return None
+    return package.open(info)
+
+def find_thumbnail(package):
+    for name in package.namelist():
+        stem, ext = posixpath.splitext(name)
+        if stem.lower() == 'docprops/thumbnail' and ext.lower() in THUMBNAIL_TYPES:
+            return name, THUMBNAIL_TYPES[ext.lower()]
+    return None, None
+
+def paragraph_text(member, paragraph_tag, text_tag, max_length):
+    """Text of the paragraphs in an XML member, up to max_length characters"""
+    paragraphs, current, length = [], [], 0
+    for event, element in iterparse(member, events=('end',)):
+        if element.tag == text_tag and element.text:
+            current.append(element.text)
+        elif element.tag == paragraph_tag:
+            text = ''.join(current).strip()
+            current = []
+            element.clear()
+            if text:
+                paragraphs.append(text)
+                length += len(text) + 1
+                if length >= max_length:
+                    break
+    return '\n'.join(paragraphs)[:max_length]
+
+def numbered_slides(package):
+    """Slide parts ordered by the number in their names, for packages without relationships"""
+    names = [name for name in package.namelist() if re.fullmatch(r'ppt/slides/slide\d+\.xml', name)]
+    return sorted(names, key=lambda name: int(re.search(r'\d+', name).group())) or ['ppt/slides/slide1.xml']
+
+def slide_names(package):
+    """Part names of the slides in presentation order"""
+    member = open_member(package, 'ppt/presentation.xml', 1024 * 1024)
+    rels = open_member(package, 'ppt/_rels/presentation.xml.rels', 1024 * 1024)
+    if member is None or rels is None:
+        return numbered_slides(package)
+    ids = [element.get(f'{R}id') for event, element in iterparse(member, events=('end',))
+           if element.tag.endswith('}sldId')]
+    targets = {}
+    for event, element in iterparse(rels, events=('end',)):
+        if element.tag == f'{REL}Relationship':
+            targets[element.get('Id')] = posixpath.normpath(posixpath.join('ppt', element.get('Target')))
+    return [targets[rel_id] for rel_id in ids if rel_id in targets] or numbered_slides(package)
+
+def first_sheet(package):
+    """(name, part name) of the first worksheet"""
+    member = open_member(package, 'xl/workbook.xml', 1024 * 1024)
+    rels = open_member(package, 'xl/_rels/workbook.xml.rels', 1024 * 1024)
+    if member is None or rels is None:
+        return None, 'xl/worksheets/sheet1.xml'
+    name = rel_id = None
+    for event, element in iterparse(member, events=('end',)):
+        if element.tag == f'{S}sheet':
+            name, rel_id = element.get('name'), element.get(f'{R}id')
+            break
+    for event, element in iterparse(rels, events=('end',)):
+        if element.tag == f'{REL}Relationship' and element.get('Id') == rel_id:
+            target = element.get('Target')
+            if target.startswith('/'):
+                return name, target.lstrip('/')
+            return name, posixpath.normpath(posixpath.join('xl', target))
+    return name, 'xl/worksheets/sheet1.xml'
+
+def column_index(reference):
+    """Zero-based column of a cell reference such as 'C7'"""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord('A') + 1
+    return index - 1
+
+def shared_strings(package, wanted, max_size):
+    """The shared strings with the given indexes"""
+    member = open_member(package, 'xl/sharedStrings.xml', max_size)
+    strings = {}
+    if member is None or not wanted:
+        return strings
+    last = max(wanted)
+    index = 0
+    for event, element in iterparse(member, events=('end',)):
+        if element.tag == f'{S}si':
+            if index in wanted:
+                strings[index] = ''.join(t.text or '' for t in element.iter(f'{S}t'))
+            element.clear()
+            index += 1
+            if index > last:
+                break
+    return strings
+
+def sheet_summary(package, config):
+    max_rows, max_columns = config['PREVIEW_TABLE_ROWS'], config['PREVIEW_TABLE_COLUMNS']
+    name, part = first_sheet(package)
+    member = open_member(package, part, config['PREVIEW_MAX_SIZE'])
+    if member is None:
+        return None
+
+    rows = []  # Lists of (column, kind, value)
+    for event, element in iterparse(member, events=('end',)):
+        if element.tag == f'{S}row':
+            cells = []
+            for cell in element.iter(f'{S}c'):
+                column = column_index(cell.get('r', ''))
+                if column < 0:
+                    column = len(cells)
+                if column >= max_columns:
+                    continue
+                if cell.get('t') == 'inlineStr':
+                    value = ''.join(t.text or '' for t in cell.iter(f'{S}t'))
+                else:
+                    v = cell.find(f'{S}v')
+                    value = v.text if v is not None else None
+                if value is not None:
+                    cells.append((column, cell.get('t'), value))
+            element.clear()
+            rows.append(cells)
+            if len(rows) >= max_rows:
+                break
+
+    wanted = {int(value) for cells in rows for column, kind, value in cells if kind == 's'}
+    strings = shared_strings(package, wanted, config['PREVIEW_MAX_SIZE'])
+    table = []
+    for cells in rows:
+        row = [''] * (max(column for column, kind, value in cells) + 1 if cells else 0)
+        for column, kind, value in cells:
+            row[column] = strings.get(int(value), '') if kind == 's' else value
+        table.append(row)
+    while table and not any(table[-1]):
+        table.pop()
+    return {'kind': 'table', 'sheet': name, 'rows': table}
+
+def render_preview(path, config):
+    """Build the preview of an OOXML package; returns (data, mimetype) or (None, None)
+
+    The kind of document is told from the package parts rather than a file
+    name, since one blob may have been uploaded under several.
+    """
+    with zipfile.ZipFile(path) as package:
+        name, mimetype = find_thumbnail(package)
+        if name:
+            member = open_member(package, name, config['PREVIEW_MAX_SIZE'])
+            if member is not None:
+                return member.read(), mimetype
+
+        max_length = config['PREVIEW_TEXT_LENGTH']
+        parts = set(package.namelist())
+        summary = None
+        if 'word/document.xml' in parts:
+            member = open_member(package, 'word/document.xml', config['PREVIEW_MAX_SIZE'])
+            if member is not None:
+                summary = {'kind': 'text', 'text': paragraph_text(member, f'{W}p', f'{W}t', max_length)}
+        elif 'ppt/presentation.xml' in parts:
+            member = open_member(package, slide_names(package)[0], config['PREVIEW_MAX_SIZE'])
+            if member is not None:
+                summary = {'kind': 'text', 'text': paragraph_text(member, f'{A}p', f'{A}t', max_length)}
+        elif 'xl/workbook.xml' in parts:
+            summary = sheet_summary(package, config)
+
+    if summary is None:
+        return None, None
+    return json.dumps(summary).encode(), SUMMARY_TYPE
+
+# Generation
+
+@contextmanager
+def open_package(digest):
+    """Yield a blob's content as something zipfile can read, or None if too large to fetch"""
+    storage = get_storage()
+    key = blob_key(digest)
+    local_path = storage.local_path(key)
+    if local_path:
+        yield local_path
+    elif storage.size(key) > current_app.config['PREVIEW_MAX_SIZE']:
+        yield None
+    else:
+        # zipfile needs to seek; fetch remote content to a temporary file first
+        with tempfile.TemporaryFile(dir=current_app.config['UPLOAD_FOLDER']) as f:
+            for chunk in storage.open(key):
+                f.write(chunk)
+            f.seek(0)
+            yield f
+
+def generate_preview(digest):
+    """Generate and store the preview of a blob, recording the outcome on its row"""
+    config = current_app.config
+    storage = get_storage()
+    status, mimetype = PreviewStatus.UNAVAILABLE, None
+    try:
+        with open_package(digest) as package:
+            data, mimetype = render_preview(package, config) if package is not None else (None, None)
+        if data is not None:
+            storage.put_stream(preview_key(digest), io.BytesIO(data))
+            status = PreviewStatus.READY
+    except (zipfile.BadZipFile, SyntaxError, ValueError, KeyError, EOFError) as e:
+        # Not a well-formed package (ParseError is a SyntaxError)
+        logger.info("No preview for blob %s: %s", digest, e)
+    except Exception:
+        logger.exception("Preview generation failed for blob %s", digest)
+        status = PreviewStatus.FAILED
+
+    result = db.session.execute(
+        update(Blob).where(Blob.hash == digest).values(preview_status=status, preview_type=mimetype)
+    )
+    db.session.commit()
+    if result.rowcount == 0 and status == PreviewStatus.READY:
+        # The blob was deleted meanwhile
+        storage.delete(preview_key(digest))
+    return status
+
+def get_preview_generator():
+    """Per-process preview job pool, or None when PREVIEW_WORKERS is 0"""
+    config = current_app.config
+    return get_job_pool('preview', config['PREVIEW_WORKERS'], config['PREVIEW_QUEUE_DEPTH'])
+
+def schedule_preview(digest):
+    """Generate a blob's preview in the background once its row is committed"""
+    generator = get_preview_generator()
+    if generator is not None and not generator.submit(digest, generate_preview, digest):
+        logger.info("Preview queue full, blob %s left for the janitor", digest)
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import random
+import cProfile
+import threading
+import contextvars
+from collections import Counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Opt-in per-request profiling
+#
+# With PROFILE_ENABLED, ProfilerMiddleware wraps app.wsgi_app and profiles
+# requests picked by PROFILE_SAMPLE_RATE, or carrying an
+# `X-Profile: <PROFILE_TOKEN>` header. Each profiled request writes to
+# PROFILE_DIR, named by the X-Profile-Id response header:
+#
+#   <id>.prof       PROFILE_MODE 'cprofile': pstats dump (snakeviz, flameprof, gprof2dot)
+#   <id>.collapsed  PROFILE_MODE 'sampling': folded stacks ("a;b;c 12") for
+#                   flamegraph.pl, speedscope or inferno
+#   <id>.json       method, path, status, timings and the SQL statement timeline
+#
+# Profiling covers the view and producing the response body. When
+# PROFILE_ENABLED is off the middleware is not installed at all, so it
+# costs nothing.
+#
+# Only one cProfile can be active per process (Python 3.12+ profiles
+# through sys.monitoring), so concurrent requests picked for 'cprofile'
+# are sampled instead while another capture is running.
+
+_current = contextvars.ContextVar('profile', default=None)
+_cprofile_lock = threading.Lock()  # Held while a cProfile capture is running
+
+def collapse(frame):
+    """Folded stack of frame, root first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class StackSampler:
+    """Samples one thread's stack every interval seconds from a helper thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+class RequestProfile:
+    """Profiler state of one request"""
+
+    def __init__(self, mode, interval):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.mode = mode
+        self.queries = []
+        self.status = None
+        self.started = time.perf_counter()
+        if mode == 'sampling':
+            self.profiler = StackSampler(interval)
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+
+    def resume(self):
+        """Profile the calling thread until pause()"""
+        if self.mode == 'sampling':
+            self.profiler.thread_id = threading.get_ident()
+        else:
+            self.profiler.enable()
+
+    def pause(self):
+        if self.mode != 'sampling':
+            self.profiler.disable()
+
+    def finish(self, directory, environ):
+        """Stop profiling and write the profile files"""
+        elapsed = time.perf_counter() - self.started
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        if self.mode == 'sampling':
+            self.profiler.stop()
+            self.profiler.write(base + '.collapsed')
+        else:
+            self.profiler.dump_stats(base + '.prof')
+
+        with open(base + '.json', 'w') as f:
+            json.dump({
+                'id': self.id,
+                'mode': self.mode,
+                'method': environ.get('REQUEST_METHOD'),
+                'path': environ.get('PATH_INFO'),
+                'query_string': environ.get('QUERY_STRING'),
+                'status': self.status,
+                'duration_ms': round(elapsed * 1000, 3),
+                'sql_ms': round(sum(q['duration_ms'] for q in self.queries), 3),
+                'queries': self.queries,
+            }, f, indent=2)
+
+class ProfiledBody:
+    """Response iterable that keeps profiling while the body is produced"""
+
+    def __init__(self, iterable, profile, finish):
+        self.iterable = iterable
+        self.profile = profile
+        self.finish = finish
+
+    def __iter__(self):
+        iterator = iter(self.iterable)
+        while True:
+            self.profile.resume()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.profile.pause()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.finish()
+
+class ProfilerMiddleware:
+    """WSGI middleware profiling sampled or explicitly requested requests"""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.directory = config['PROFILE_DIR']
+        self.sample_rate = config['PROFILE_SAMPLE_RATE']
+        self.token = config['PROFILE_TOKEN']
+        self.mode = config['PROFILE_MODE']
+        self.interval = config['PROFILE_SAMPLE_INTERVAL']
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    def should_profile(self, environ):
+        header = environ.get('HTTP_X_PROFILE')
+        if header and self.token and hmac.compare_digest(header, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        mode = self.mode
+        if mode == 'cprofile' and not _cprofile_lock.acquire(blocking=False):
+            mode = 'sampling'
+        profile = RequestProfile(mode, self.interval)
+        _current.set(profile)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            profile.status = int(status.split(' ', 1)[0])
+            headers.append(('X-Profile-Id', profile.id))
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            _current.set(None)
+            try:
+                profile.finish(self.directory, environ)
+            finally:
+                if profile.mode == 'cprofile':
+                    _cprofile_lock.release()
+
+        profile.resume()
+        try:
+            iterable = self.wsgi_app(environ, profiled_start_response)
+        except BaseException:
+            profile.pause()
+            finish()
+            raise
+        profile.pause()
+        return ProfiledBody(iterable, profile, finish)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('profile_query_started', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None or not conn.info.get('profile_query_started'):
+        return
+    started = conn.info['profile_query_started'].pop()
+    profile.queries.append({
+        'offset_ms': round((started - profile.started) * 1000, 3),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        'statement': statement,
+        'rows': cursor.rowcount,
+    })
@@ -0,0 +1,59 @@
+import time
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+# Request rate limiting
+#
+# Token buckets kept in process memory. Each gunicorn worker has its own,
+# so with N workers a client can get up to N times the configured rate;
+# the limits are sized for that.
+
+class RateLimiter:
+    """Thread-safe token buckets keyed by string, at most maxsize of them (LRU)"""
+
+    def __init__(self, limit, period, maxsize=100000):
+        self.capacity = limit
+        self.rate = limit / period  # Tokens refilled per second
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        tokens, updated_at = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated_at) * self.rate)
+
+    def retry_after(self, key):
+        """Seconds until key has a token again, without taking one (0 if it has one now)"""
+        with self._lock:
+            tokens = self._refill(key, time.monotonic())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def hit(self, key):
+        """Take a token; returns 0 if allowed, otherwise seconds until the next one"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+def get_rate_limiter(name):
+    """Per-process limiter configured by <NAME>_RATE_LIMIT and <NAME>_RATE_PERIOD"""
+    limiters = current_app.extensions.setdefault('rate_limiters', {})
+    limiter = limiters.get(name)
+    if limiter is None:
+        prefix = name.upper()
+        limiter = limiters[name] = RateLimiter(
+            current_app.config[f'{prefix}_RATE_LIMIT'],
+            current_app.config[f'{prefix}_RATE_PERIOD']
+        )
+    return limiter
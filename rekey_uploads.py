@@ -0,0 +1,118 @@
+import os
+import sys
+import hashlib
+from sqlalchemy import func
+from app import create_app, db
+from models import File, Blob
+from storage import LocalStorage, blob_key
+
+# Script to move existing uploads into the content-addressed blob store
+# (STORAGE_BACKEND 'local'; run it before switching a deployment to 's3')
+#
+# Every File whose content does not yet live at UPLOAD_FOLDER/ab/cd/<sha256>
+# is hashed, hard-linked to its blob path and re-pointed at it. The blob's
+# reference count is taken in the same transaction, so the script can be
+# interrupted and re-run at any point, even while the app is serving and
+# deleting files. The old name is unlinked only after the batch has been
+# committed. At the end, reference counts are checked against the files
+# table and any mismatch is reported.
+#
+# Usage: python rekey_uploads.py [--dry-run]
+
+BATCH_SIZE = 100
+
+def hash_file(path, chunk_size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def rekey_file(file, storage, chunk_size):
+    """Link one file into the blob store, taking a blob reference; returns the old path to unlink after commit"""
+    digest = hash_file(file.file_path, chunk_size)
+    target = storage.local_path(blob_key(digest))
+
+    # Like acquire_blob(): hold the row before touching the content, so a
+    # concurrent release of the last other reference cannot unlink it under us
+    blob = db.session.get(Blob, digest, with_for_update=True)
+    if blob:
+        blob.ref_count = Blob.ref_count + 1
+    else:
+        db.session.add(Blob(hash=digest, size=os.path.getsize(file.file_path), ref_count=1))
+        db.session.flush()
+
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.link(file.file_path, target)
+
+    old_path = file.file_path
+    file.content_hash = digest
+    file.file_path = target
+    file.filename = f"{digest}.{file.file_type}"
+    return old_path
+
+def rekey_uploads(app, dry_run=False):
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        storage = LocalStorage(upload_folder)
+        chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+        stats = {'rekeyed': 0, 'already_keyed': 0, 'missing': 0}
+        last_id = 0
+
+        while True:
+            files = File.query.filter(File.id > last_id).order_by(File.id).limit(BATCH_SIZE).all()
+            if not files:
+                break
+            last_id = files[-1].id
+
+            old_paths = []
+            for file in files:
+                if file.content_hash and file.file_path == storage.local_path(blob_key(file.content_hash)) \
+                        and os.path.exists(file.file_path):
+                    stats['already_keyed'] += 1
+                    continue
+
+                if not os.path.exists(file.file_path):
+                    print(f"Missing content for file {file.id}: {file.file_path}")
+                    stats['missing'] += 1
+                    continue
+
+                stats['rekeyed'] += 1
+                if not dry_run:
+                    old_paths.append(rekey_file(file, storage, chunk_size))
+
+            if dry_run:
+                continue
+
+            db.session.commit()
+            for old_path in old_paths:
+                if os.path.exists(old_path) and os.path.dirname(os.path.abspath(old_path)) == \
+                        os.path.abspath(upload_folder):
+                    os.remove(old_path)
+
+        if not dry_run:
+            # Consistency check: every reference was taken above, so counts should match
+            counts = dict(
+                db.session.query(File.content_hash, func.count(File.id))
+                .filter(File.content_hash.isnot(None))
+                .group_by(File.content_hash)
+            )
+            stats['unreferenced_blobs'] = stats['ref_count_mismatches'] = 0
+            for blob in Blob.query.all():
+                expected = counts.get(blob.hash, 0)
+                stats['unreferenced_blobs'] += expected == 0
+                if blob.ref_count != expected:
+                    print(f"Blob {blob.hash} has ref_count {blob.ref_count}, {expected} files point at it")
+                    stats['ref_count_mismatches'] += 1
+
+        print("Dry run, nothing changed:" if dry_run else "Re-keyed uploads:")
+        for key, value in stats.items():
+            print(f"{key}: {value}")
+        return stats
+
+if __name__ == '__main__':
+    rekey_uploads(create_app(), dry_run='--dry-run' in sys.argv[1:])
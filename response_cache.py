@@ -0,0 +1,199 @@
+import json
+import hashlib
+import threading
+from functools import wraps
+from urllib.parse import urlsplit, urlencode
+from flask import current_app, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from cache import TTLCache
+from models import File
+
+try:
+    import redis
+except ImportError:  # redis is only needed for a redis:// RESPONSE_CACHE_URL
+    redis = None
+
+# Response cache for the file listing and file details
+#
+# Cached bodies are keyed by a generation number plus the request URL. Any
+# commit that inserts, changes or deletes File rows bumps the generation,
+# so every earlier entry stops matching at once; nothing is deleted
+# explicitly. Responses carry a strong ETag of the body and are answered
+# with 304 when the client already has it.
+#
+# Tiers: an in-process LRU (RESPONSE_CACHE_SIZE entries), and optionally a
+# shared tier named by RESPONSE_CACHE_URL that every worker reads and that
+# also holds the generation:
+#   memory://           process-local stand-in with the shared-tier interface (tests, one worker)
+#   redis://host:6379/0 Redis, shared by all workers and hosts
+# Without a shared tier the generation is per process and other workers only
+# see a change once their entries expire, so entries then live at most
+# RESPONSE_CACHE_LOCAL_TTL seconds instead of RESPONSE_CACHE_TTL. Run a
+# shared tier whenever there is more than one worker.
+
+GENERATION_KEY = 'files:generation'
+
+class MemorySharedCache:
+    """Process-local implementation of the shared tier interface"""
+
+    def __init__(self):
+        self._data = TTLCache(maxsize=100000, ttl=float('inf'))
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value, ttl):
+        self._data.set(key, value, ttl)
+
+    def incr(self, key):
+        with self._lock:
+            value = (self._data.get(key) or 0) + 1
+            self._data.set(key, value)
+            return value
+
+class RedisSharedCache:
+    """Shared tier in Redis"""
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("A redis:// RESPONSE_CACHE_URL requires redis to be installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, json.dumps(value), ex=max(1, int(ttl)))
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+def create_shared_cache(url):
+    """Build the shared tier named by RESPONSE_CACHE_URL, if any"""
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme
+    if scheme == 'memory':
+        return MemorySharedCache()
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisSharedCache(url)
+    raise ValueError(f"Unknown RESPONSE_CACHE_URL scheme: {scheme}")
+
+class ResponseCache:
+    """Generation-versioned cache of (body, etag) entries with a local and an optional shared tier"""
+
+    def __init__(self, maxsize, ttl, shared=None):
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl, name='response')
+        self.shared = shared
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        if self.shared is not None:
+            return self.shared.get(GENERATION_KEY) or 0
+        return self._generation
+
+    def bump(self):
+        if self.shared is not None:
+            self.shared.incr(GENERATION_KEY)
+        else:
+            with self._lock:
+                self._generation += 1
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                entry = (entry[0].encode(), entry[1])
+                self.local.set(key, entry)
+        return entry
+
+    def set(self, key, body, etag):
+        self.local.set(key, (body, etag))
+        if self.shared is not None:
+            self.shared.set(key, (body.decode(), etag), self.ttl)
+
+def get_response_cache():
+    """Response cache of the current app, or None when RESPONSE_CACHE_ENABLED is off"""
+    if not current_app.config['RESPONSE_CACHE_ENABLED']:
+        return None
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        config = current_app.config
+        shared = create_shared_cache(config['RESPONSE_CACHE_URL'])
+        ttl = config['RESPONSE_CACHE_TTL']
+        if shared is None:
+            # Writes in other workers are only seen once entries expire
+            ttl = min(ttl, config['RESPONSE_CACHE_LOCAL_TTL'])
+        cache = current_app.extensions['response_cache'] = ResponseCache(config['RESPONSE_CACHE_SIZE'], ttl, shared)
+    return cache
+
+def cached_response(f):
+    """Decorator serving a JSON view's 200 responses from the response cache
+
+    Only for views whose body depends on the URL alone, not on the caller:
+    put it below the authentication and role decorators. Misses are filled
+    from the primary even under read_replica, since rows from a lagging
+    replica would be stored under the generation their change just bumped.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        cache = get_response_cache()
+        if cache is None:
+            return f(*args, **kwargs)
+
+        # Read the generation first, so a change committed while the view runs
+        # leaves this entry under an already outdated key. The arguments are
+        # re-encoded, so a value containing & or = cannot pose as other arguments
+        args_key = urlencode(sorted(request.args.items(multi=True)))
+        key = f'files:{cache.generation()}:{request.path}?{args_key}'
+        entry = cache.get(key)
+        if entry is None:
+            replica = db.session.info.pop('read_replica', None)
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            finally:
+                if replica:
+                    db.session.info['read_replica'] = replica
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            cache.set(key, body, etag)
+        else:
+            body, etag = entry
+
+        response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Browsers keep the body but revalidate it on every use
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    return decorated
+
+@event.listens_for(Session, 'after_flush')
+def note_file_changes(session, flush_context):
+    if any(isinstance(obj, File) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['files_changed'] = True
+
+@event.listens_for(Session, 'do_orm_execute')
+def note_bulk_file_changes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is File.__mapper__:
+        orm_execute_state.session.info['files_changed'] = True
+
+@event.listens_for(Session, 'after_commit')
+def bump_file_generation(session):
+    if session.info.pop('files_changed', False) and has_app_context():
+        cache = get_response_cache()
+        if cache is not None:
+            cache.bump()
+
+@event.listens_for(Session, 'after_rollback')
+def forget_file_changes(session):
+    session.info.pop('files_changed', None)
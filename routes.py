@@ -22,7 +22,8 @@ def signup():
 @web_bp.route('/files')
 def files():
     """Render the files page for client users"""
-    return render_template('files.html')
+    return render_template('files.html', changes_stream=app.config['CHANGES_STREAM_ENABLED'],
+                           changes_poll=app.config['CHANGES_CLIENT_POLL'])
 
 @web_bp.route('/upload')
 def upload():
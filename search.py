@@ -0,0 +1,283 @@
+import re
+import html
+import logging
+import zipfile
+from xml.etree.ElementTree import iterparse
+from flask import current_app
+from sqlalchemy import event, text, select, bindparam
+from sqlalchemy.orm import Session
+from app import db
+from models import File, User
+from previews import open_member, open_package, paragraph_text, slide_names, W, A, S
+from jobs import get_job_pool
+
+# Full-text search over file names and document contents
+#
+# The index is the database's own: an FTS5 table on SQLite, a GIN-indexed
+# tsvector on PostgreSQL, both named file_search with one row per file. The
+# file name is weighted ten times the content. The tables are created by
+# raw DDL hooked to db.metadata (and by migration 0010), since neither fits
+# a model; other databases have no search.
+#
+# Indexing runs after the upload commits, on a bounded per-process pool
+# (SEARCH_WORKERS threads, SEARCH_QUEUE_DEPTH jobs). The text is streamed
+# out of the package's XML parts (document body, slides in order, the
+# shared strings and sheet names of a workbook), capped at
+# SEARCH_MAX_TEXT characters. Files with the same content reuse the text
+# already extracted. Files the pool never got to are indexed by the
+# janitor after SEARCH_RETRY_AFTER; `flask --app main reindex` rebuilds
+# the index, or with --missing only fills the gaps.
+#
+# A query is split into words, all of which must match (stemmed). Results
+# are ranked by BM25 (SQLite) or cover density (PostgreSQL); snippets are
+# only built for the rows of the requested page.
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'file_search'
+PG_LANGUAGE = 'english'
+MAX_TERMS = 16
+MARK_START, MARK_END = '\x02', '\x03'  # Snippet highlight markers, replaced after HTML escaping
+
+SEARCH_DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5("
+        "filename, content, tokenize = 'porter unicode61 remove_diacritics 2')",
+        # ORDER BY rank uses these column weights
+        "INSERT INTO file_search (file_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS file_search ("
+        "file_id INTEGER PRIMARY KEY REFERENCES files (id) ON DELETE CASCADE, "
+        "filename TEXT NOT NULL, "
+        "content TEXT NOT NULL, "
+        f"document tsvector GENERATED ALWAYS AS (setweight(to_tsvector('{PG_LANGUAGE}', filename), 'A') || "
+        f"setweight(to_tsvector('{PG_LANGUAGE}', content), 'D')) STORED)",
+        "CREATE INDEX IF NOT EXISTS ix_file_search_document ON file_search USING gin (document)",
+    ],
+}
+
+# Per dialect: the file id column, upsert, ranked page and snippet statements
+ID_COLUMN = {'sqlite': 'rowid', 'postgresql': 'file_id'}
+
+UPSERT = {
+    'sqlite': "INSERT OR REPLACE INTO file_search (rowid, filename, content) "
+              "SELECT id, original_filename, :content FROM files WHERE id = :file_id",
+    'postgresql': "INSERT INTO file_search (file_id, filename, content) "
+                  "SELECT id, original_filename, :content FROM files WHERE id = :file_id "
+                  "ON CONFLICT (file_id) DO UPDATE SET filename = EXCLUDED.filename, content = EXCLUDED.content",
+}
+
+RANKED = {
+    'sqlite': "SELECT rowid AS id, -rank AS score FROM file_search WHERE file_search MATCH :query "
+              "ORDER BY rank LIMIT :limit OFFSET :offset",
+    'postgresql': f"SELECT file_id AS id, ts_rank_cd(document, q, 1) AS score "
+                  f"FROM file_search, plainto_tsquery('{PG_LANGUAGE}', :query) q WHERE document @@ q "
+                  f"ORDER BY score DESC, file_id LIMIT :limit OFFSET :offset",
+}
+
+SNIPPETS = {
+    'sqlite': f"SELECT rowid AS id, snippet(file_search, -1, '{MARK_START}', '{MARK_END}', '…', 24) AS snippet "
+              f"FROM file_search WHERE file_search MATCH :query AND rowid IN :ids",
+    'postgresql': f"SELECT file_id AS id, ts_headline('{PG_LANGUAGE}', content, plainto_tsquery('{PG_LANGUAGE}', :query), "
+                  f"'StartSel={MARK_START}, StopSel={MARK_END}, MaxFragments=1, MaxWords=24, MinWords=8') AS snippet "
+                  f"FROM file_search WHERE file_id IN :ids",
+}
+
+def search_dialect():
+    """Name of the database dialect when it supports search, else None"""
+    name = db.engine.dialect.name
+    return name if name in SEARCH_DDL else None
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_table(target, connection, **kw):
+    for statement in SEARCH_DDL.get(connection.dialect.name, ()):
+        connection.execute(text(statement))
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_search_table(target, connection, **kw):
+    if connection.dialect.name in SEARCH_DDL:
+        connection.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+# Text extraction
+
+def extract_text(package, max_length):
+    """Searchable text of an OOXML package, up to max_length characters"""
+    max_size = current_app.config['PREVIEW_MAX_SIZE']
+    with zipfile.ZipFile(package) as z:
+        parts = set(z.namelist())
+        if 'word/document.xml' in parts:
+            members = [('word/document.xml', f'{W}p', f'{W}t')]
+        elif 'ppt/presentation.xml' in parts:
+            members = [(name, f'{A}p', f'{A}t') for name in slide_names(z)]
+        elif 'xl/workbook.xml' in parts:
+            members = [('xl/workbook.xml', f'{S}sheet', None), ('xl/sharedStrings.xml', f'{S}si', f'{S}t')]
+        else:
+            return ''
+
+        texts, length = [], 0
+        for name, paragraph_tag, text_tag in members:
+            member = open_member(z, name, max_size)
+            if member is None:
+                continue
+            if text_tag is None:
+                # Sheet names are attributes
+                text_ = ' '.join(e.get('name', '') for _, e in iterparse(member) if e.tag == paragraph_tag)
+            else:
+                text_ = paragraph_text(member, paragraph_tag, text_tag, max_length - length)
+            if text_:
+                texts.append(text_)
+                length += len(text_) + 1
+            if length >= max_length:
+                break
+        return '\n'.join(texts)[:max_length]
+
+def file_text(file):
+    """Extracted text of a file's content, '' when it has none"""
+    max_length = current_app.config['SEARCH_MAX_TEXT']
+    try:
+        if not file.content_hash:
+            # Legacy upload stored outside the blob store
+            return extract_text(file.file_path, max_length)
+        with open_package(file.content_hash) as package:
+            return extract_text(package, max_length) if package is not None else ''
+    except (zipfile.BadZipFile, SyntaxError, ValueError, KeyError, EOFError, OSError) as e:
+        logger.info("No text indexed for file %s: %s", file.id, e)
+        return ''
+
+# Indexing
+
+def indexed_text(dialect, digest):
+    """Text already indexed for another file with the same content, or None"""
+    id_column = ID_COLUMN[dialect]
+    return db.session.execute(
+        text(f"SELECT s.content FROM file_search s JOIN files f ON f.id = s.{id_column} "
+             f"WHERE f.content_hash = :digest LIMIT 1"),
+        {'digest': digest}
+    ).scalar()
+
+def index_files(file_ids, reuse=True):
+    """(Re)index files by id and commit; files deleted meanwhile are skipped. Returns the count indexed"""
+    dialect = search_dialect()
+    if dialect is None or not file_ids:
+        return 0
+
+    texts = {}
+    indexed = 0
+    for file in db.session.scalars(select(File).where(File.id.in_(file_ids))):
+        content = texts.get(file.content_hash) if file.content_hash else None
+        if content is None and reuse and file.content_hash:
+            content = indexed_text(dialect, file.content_hash)
+        if content is None:
+            content = file_text(file)
+        if file.content_hash:
+            texts[file.content_hash] = content
+        db.session.execute(text(UPSERT[dialect]), {'content': content, 'file_id': file.id})
+        indexed += 1
+    db.session.commit()
+    return indexed
+
+def unindex_files(session, file_ids):
+    """Remove files from the index in the session's transaction"""
+    if not file_ids:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in SEARCH_DDL:
+        session.execute(text(f'DELETE FROM file_search WHERE {ID_COLUMN[dialect]} IN :ids')
+                        .bindparams(bindparam('ids', expanding=True)), {'ids': file_ids})
+
+@event.listens_for(Session, 'after_flush')
+def unindex_deleted_files(session, flush_context):
+    unindex_files(session, [obj.id for obj in session.deleted if isinstance(obj, File)])
+
+def unindexed_files(batch_size, uploaded_before=None):
+    """Ids of up to batch_size files missing from the index"""
+    id_column = ID_COLUMN[search_dialect()]
+    query = select(File.id).where(
+        text(f'NOT EXISTS (SELECT 1 FROM file_search WHERE file_search.{id_column} = files.id)')
+    ).order_by(File.id).limit(batch_size)
+    if uploaded_before is not None:
+        query = query.where(File.uploaded_at < uploaded_before)
+    return db.session.scalars(query).all()
+
+def reindex(missing_only=False, batch_size=200):
+    """Index every file, or only those missing from the index; returns the count indexed"""
+    dialect = search_dialect()
+    if dialect is None:
+        return 0
+
+    total = 0
+    if missing_only:
+        while True:
+            file_ids = unindexed_files(batch_size)
+            if not file_ids:
+                return total
+            total += index_files(file_ids)
+
+    last_id = 0
+    while True:
+        file_ids = db.session.scalars(
+            select(File.id).where(File.id > last_id).order_by(File.id).limit(batch_size)).all()
+        if not file_ids:
+            break
+        total += index_files(file_ids, reuse=False)
+        last_id = file_ids[-1]
+
+    # Drop rows of files deleted while the index was out of reach, then compact
+    db.session.execute(text(f'DELETE FROM file_search WHERE {ID_COLUMN[dialect]} NOT IN (SELECT id FROM files)'))
+    if dialect == 'sqlite':
+        db.session.execute(text("INSERT INTO file_search (file_search) VALUES ('optimize')"))
+    db.session.commit()
+    return total
+
+def get_search_indexer():
+    """Per-process search indexing job pool, or None when SEARCH_WORKERS is 0"""
+    config = current_app.config
+    return get_job_pool('search', config['SEARCH_WORKERS'], config['SEARCH_QUEUE_DEPTH'])
+
+def schedule_indexing(file_id):
+    """Index a file in the background once its row is committed"""
+    indexer = get_search_indexer()
+    if indexer is not None and not indexer.submit(file_id, index_files, [file_id]):
+        logger.info("Search queue full, file %s left for the janitor", file_id)
+
+# Querying
+
+def parse_query(query):
+    """The words of a search query, or None if it has none"""
+    terms = re.findall(r'\w+', query or '')[:MAX_TERMS]
+    return terms or None
+
+def highlight(snippet):
+    """HTML of a snippet with its matches in <mark>"""
+    return html.escape(snippet or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def search_files(terms, limit, offset):
+    """One page of files matching all terms, best first; returns (hits, has_more)"""
+    dialect = search_dialect()
+    if dialect == 'sqlite':
+        query = ' '.join(f'"{term}"' for term in terms)
+    else:
+        query = ' '.join(terms)
+
+    ranked = db.session.execute(text(RANKED[dialect]),
+                                {'query': query, 'limit': limit + 1, 'offset': offset}).all()
+    has_more = len(ranked) > limit
+    ranked = ranked[:limit]
+    if not ranked:
+        return [], False
+
+    ids = [row.id for row in ranked]
+    snippets = dict(db.session.execute(
+        text(SNIPPETS[dialect]).bindparams(bindparam('ids', expanding=True)), {'query': query, 'ids': ids}
+    ).all())
+    files = {
+        row.id: File.row_to_dict(row) for row in db.session.execute(
+            select(*File.listing_columns()).join(User, File.uploader_id == User.id).where(File.id.in_(ids)))
+    }
+
+    hits = [
+        {'file': files[row.id], 'score': round(float(row.score), 4), 'snippet': highlight(snippets.get(row.id))}
+        for row in ranked if row.id in files
+    ]
+    return hits, has_more
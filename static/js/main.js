@@ -139,3 +139,54 @@ async function apiRequest(endpoint, method = 'GET', data = null) {
     
     return result;
 }
+
+// Function to follow an authenticated Server-Sent Events stream
+// (EventSource cannot send the Authorization header, so this reads the stream with fetch)
+async function streamEvents(endpoint, onEvent, lastEventId = null) {
+    const token = localStorage.getItem('token');
+    
+    if (!token) {
+        throw new Error('Not authenticated');
+    }
+    
+    const headers = {'Authorization': `Bearer ${token}`};
+    if (lastEventId !== null) {
+        headers['Last-Event-ID'] = String(lastEventId);
+    }
+    
+    const response = await fetch(endpoint, {headers: headers});
+    if (!response.ok) {
+        const error = new Error(`Event stream failed with status ${response.status}`);
+        error.status = response.status;
+        throw error;
+    }
+    
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) {
+            return lastEventId;
+        }
+        
+        buffer += value;
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        
+        messages.forEach(message => {
+            const event = {event: 'message', data: ''};
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event.event = line.slice(7);
+                else if (line.startsWith('id: ')) event.id = line.slice(4);
+                else if (line.startsWith('data: ')) event.data += line.slice(6);
+            });
+            if (event.id !== undefined) {
+                lastEventId = event.id;
+            }
+            if (event.data) {
+                onEvent(event.event, JSON.parse(event.data));
+            }
+        });
+    }
+}
@@ -0,0 +1,243 @@
+import os
+from urllib.parse import quote
+from flask import current_app
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 is only needed for STORAGE_BACKEND = 's3'
+    boto3 = None
+    ClientError = None
+
+# Storage backends
+#
+# Blob contents are addressed by a storage key such as "ab/cd/abcd1234...".
+# Uploads are always spooled and hashed on local disk in UPLOAD_FOLDER first;
+# a backend then takes ownership of the finished spool file via put_file().
+
+def blob_key(digest):
+    """Storage key of the blob with the given SHA-256 hex digest"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def content_disposition(download_name):
+    """Attachment Content-Disposition value that survives non-ASCII file names"""
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+
+class StorageBackend:
+    """Interface implemented by every storage backend"""
+
+    def put_file(self, key, path):
+        """Store the local file at path under key, consuming (removing) the local file"""
+        raise NotImplementedError
+
+    def put_stream(self, key, stream):
+        """Store everything read from a file-like object under key"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def open(self, key, start=0, end=None, chunk_size=1024 * 1024):
+        """Iterate over the bytes of key from start up to and including end"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def location(self, key):
+        """Human readable location of key, stored in File.file_path"""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path of key if the backend keeps files on local disk, else None"""
+        return None
+
+    def list_blobs(self):
+        """Iterate (key, last_modified_timestamp) over every stored blob"""
+        raise NotImplementedError
+
+    def presigned_url(self, key, download_name, expires_in):
+        """URL the client can fetch key from directly, or None if unsupported"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Files on a local (or shared network) filesystem below root"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put_file(self, key, path):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def put_stream(self, key, stream, chunk_size=1024 * 1024):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f'{target}.part'
+        with open(partial, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(partial, target)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def open(self, key, start=0, end=None, chunk_size=1024 * 1024):
+        remaining = None if end is None else end - start + 1
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            while remaining is None or remaining > 0:
+                chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def location(self, key):
+        return self._path(key)
+
+    def list_blobs(self):
+        # Only the ab/cd/<sha256> shards; skips legacy names, spools and upload sessions
+        for shard in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            shard_dir = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for sub in sorted(os.listdir(shard_dir)):
+                sub_dir = os.path.join(shard_dir, sub)
+                if not os.path.isdir(sub_dir):
+                    continue
+                for name in os.listdir(sub_dir):
+                    if len(name) == 64 and name.startswith(shard + sub):
+                        yield f'{shard}/{sub}/{name}', os.path.getmtime(os.path.join(sub_dir, name))
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, Ceph RGW, ...)"""
+
+    def __init__(self, bucket, prefix='', client=None, **client_options):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("STORAGE_BACKEND 's3' requires boto3 to be installed")
+            client = boto3.client('s3', **{k: v for k, v in client_options.items() if v})
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _key(self, key):
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def put_file(self, key, path):
+        # upload_file switches to parallel multipart uploads for large files
+        self.client.upload_file(path, self.bucket, self._key(key))
+        os.remove(path)
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self._key(key))
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        return self._head(key)['ContentLength']
+
+    def open(self, key, start=0, end=None, chunk_size=1024 * 1024):
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if start or end is not None:
+            params['Range'] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(**params)['Body']
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def location(self, key):
+        return f's3://{self.bucket}/{self._key(key)}'
+
+    def list_blobs(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        prefix = f'{self.prefix}/' if self.prefix else ''
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(prefix):]
+                # Only ab/cd/<sha256> blobs, not previews/ or anything else sharing the bucket
+                parts = key.split('/')
+                if len(parts) == 3 and len(parts[2]) == 64 and parts[2].startswith(parts[0] + parts[1]):
+                    yield key, item['LastModified'].timestamp()
+
+    def presigned_url(self, key, download_name, expires_in):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self._key(key),
+                'ResponseContentDisposition': content_disposition(download_name),
+            },
+            ExpiresIn=expires_in
+        )
+
+
+def create_storage(config):
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    backend = config.get('STORAGE_BACKEND', 'local')
+
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+
+    if backend == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region_name=config.get('S3_REGION'),
+        )
+
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def get_storage():
+    """Storage backend of the current app, created on first use"""
+    storage = current_app.extensions.get('storage')
+    # Rebuild a local backend whose UPLOAD_FOLDER has been reconfigured (e.g. by tests)
+    if storage is None or getattr(storage, 'root', None) not in (None, current_app.config['UPLOAD_FOLDER']):
+        storage = current_app.extensions['storage'] = create_storage(current_app.config)
+    return storage
@@ -0,0 +1,159 @@
+import unittest
+import asyncio
+import json
+import os
+import shutil
+from urllib.parse import urlsplit
+from app import create_app, db
+from models import User, File, UserRole
+from utils import generate_token
+import utils
+from asgi import AsyncBridge
+
+app = create_app('config.TestingConfig')
+application = AsyncBridge(app)
+
+def call_asgi(method, path, headers=None, body_chunks=(), query_string=b''):
+    """Run one HTTP request through the ASGI application; returns (status, headers, body messages)"""
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in body_chunks]
+    messages.append({'type': 'http.request', 'body': b'', 'more_body': False})
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # Stay connected until the response is complete
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'root_path': '',
+        'query_string': query_string,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (headers or {}).items()],
+        'client': ('127.0.0.1', 50000),
+        'server': ('localhost', 80),
+    }
+    asyncio.run(application(scope, receive, send))
+
+    start = sent[0]
+    response_headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in start['headers']}
+    bodies = [m['body'] for m in sent[1:] if m.get('body')]
+    return start['status'], response_headers, bodies
+
+class AsgiTestCase(unittest.TestCase):
+    """Test case for the ASGI serving mode"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        app.config['UPLOAD_FOLDER'] = 'test_uploads'
+        app.config['ASGI_BODY_BUFFER'] = 1024
+        app.config['ASGI_STREAM_CHUNK_SIZE'] = 1024
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.client_token = generate_token(client_user.id, client_user.role)
+
+        self.content = os.urandom(10 * 1024 + 7)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        app.config['ASGI_BODY_BUFFER'] = 1024 * 1024
+        app.config['ASGI_STREAM_CHUNK_SIZE'] = 64 * 1024
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self):
+        """Upload self.content as a raw body received in small pieces, spooled to disk"""
+        pieces = [self.content[i:i + 1000] for i in range(0, len(self.content), 1000)]
+        status, _, bodies = call_asgi(
+            'POST', '/api/upload',
+            headers={'Authorization': f'Bearer {self.ops_token}', 'Content-Type': 'application/octet-stream',
+                     'X-Filename': 'report.docx'},
+            body_chunks=pieces
+        )
+        self.assertEqual(status, 201)
+        return json.loads(b''.join(bodies))['file']['id']
+
+    def download_path(self, file_id):
+        response = self.client.get(
+            f'/api/download-file/{file_id}',
+            headers={'Authorization': f'Bearer {self.client_token}'}
+        )
+        return urlsplit(json.loads(response.data)['download-link']).path
+
+    def test_upload_and_streamed_download(self):
+        """Test a spooled upload, stored without a second copy, and a download streamed in chunks"""
+        def copy_again(*args):
+            raise AssertionError("the spooled body was copied again")
+
+        original = utils.spool_stream
+        utils.spool_stream = copy_again
+        try:
+            file_id = self.upload()
+        finally:
+            utils.spool_stream = original
+        with app.app_context():
+            self.assertEqual(db.session.get(File, file_id).file_size, len(self.content))
+
+        status, headers, bodies = call_asgi(
+            'GET', self.download_path(file_id),
+            headers={'Authorization': f'Bearer {self.client_token}'}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(b''.join(bodies), self.content)
+        self.assertEqual(int(headers['content-length']), len(self.content))
+        self.assertIn('report.docx', headers['content-disposition'])
+        # Sent in ASGI_STREAM_CHUNK_SIZE pieces rather than one buffer
+        self.assertEqual(len(bodies), 11)
+
+    def test_range_download(self):
+        """Test a resumed download through the async bridge"""
+        file_id = self.upload()
+
+        status, headers, bodies = call_asgi(
+            'GET', self.download_path(file_id),
+            headers={'Authorization': f'Bearer {self.client_token}', 'Range': 'bytes=100-2099'}
+        )
+        self.assertEqual(status, 206)
+        self.assertEqual(b''.join(bodies), self.content[100:2100])
+        self.assertEqual(headers['content-range'], f'bytes 100-2099/{len(self.content)}')
+
+    def test_oversized_body_rejected_before_reading(self):
+        """Test bodies above MAX_CONTENT_LENGTH are refused from the headers alone"""
+        status, _, _ = call_asgi(
+            'POST', '/api/upload',
+            headers={'Authorization': f'Bearer {self.ops_token}', 'Content-Type': 'application/octet-stream',
+                     'Content-Length': str(app.config['MAX_CONTENT_LENGTH'] + 1)}
+        )
+        self.assertEqual(status, 413)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,11 @@
 import unittest
 import json
-from app import app, db
+from app import create_app, db
 from models import User, UserRole
+from utils import generate_token
+from hashing import PasswordHasher
+
+app = create_app('config.TestingConfig')
 
 class AuthTestCase(unittest.TestCase):
     """Test case for authentication routes"""
@@ -9,8 +13,10 @@ class AuthTestCase(unittest.TestCase):
     def setUp(self):
         """Set up test environment"""
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+        app.extensions.pop('rate_limiters', None)
         
         with app.app_context():
             db.create_all()
@@ -133,6 +139,78 @@ class AuthTestCase(unittest.TestCase):
         
         self.assertEqual(response.status_code, 401)
     
+    def test_login_rate_limited(self):
+        """Test repeated failed logins for an account are refused with 429"""
+        def login(password):
+            return self.client.post(
+                '/api/login',
+                data=json.dumps({'username': 'testclient', 'password': password}),
+                content_type='application/json'
+            )
+        
+        for _ in range(app.config['LOGIN_USER_RATE_LIMIT']):
+            self.assertEqual(login('wrongpassword').status_code, 401)
+        
+        # Locked out without spending a password hash, even with the right password
+        response = login('password123')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+    
+    def test_successful_login_resets_account_limit(self):
+        """Test a successful login clears the account's failed attempts"""
+        def login(password):
+            return self.client.post(
+                '/api/login',
+                data=json.dumps({'username': 'testclient', 'password': password}),
+                content_type='application/json'
+            )
+        
+        for _ in range(2):
+            for _ in range(app.config['LOGIN_USER_RATE_LIMIT'] - 1):
+                self.assertEqual(login('wrongpassword').status_code, 401)
+            self.assertEqual(login('password123').status_code, 200)
+    
+    def test_login_ip_limit_ignores_forwarded_for(self):
+        """Test X-Forwarded-For is not trusted without a configured proxy"""
+        limit = app.config['LOGIN_IP_RATE_LIMIT']
+        app.config['LOGIN_IP_RATE_LIMIT'] = 2
+        app.extensions.pop('rate_limiters', None)
+        try:
+            statuses = [
+                self.client.post(
+                    '/api/login',
+                    data=json.dumps({'username': f'nobody{i}', 'password': 'x'}),
+                    content_type='application/json',
+                    headers={'X-Forwarded-For': f'203.0.113.{i}'}
+                ).status_code
+                for i in range(3)
+            ]
+        finally:
+            app.config['LOGIN_IP_RATE_LIMIT'] = limit
+        self.assertEqual(statuses, [401, 401, 429])
+    
+    def test_login_hasher_busy(self):
+        """Test logins fail fast with 503 when the password hashing queue is full"""
+        hasher = app.extensions['password_hasher'] = PasswordHasher(workers=1, queue_depth=1)
+        self.addCleanup(app.extensions.pop, 'password_hasher', None)
+        hasher.slots.acquire()
+        
+        response = self.client.post(
+            '/api/login',
+            data=json.dumps({'username': 'testclient', 'password': 'password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(hasher.rejected, 1)
+        
+        hasher.slots.release()
+        response = self.client.post(
+            '/api/login',
+            data=json.dumps({'username': 'testclient', 'password': 'password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+    
     def test_verify_email(self):
         """Test email verification"""
         response = self.client.get('/api/verify-email/test-verification-token')
@@ -152,6 +230,33 @@ class AuthTestCase(unittest.TestCase):
         
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Invalid verification token', response.data)
+    
+    def test_authenticated_user_cache(self):
+        """Test repeat requests reuse the cached user and updates invalidate it"""
+        with app.app_context():
+            user = User.query.filter_by(username='testclient').first()
+            token = generate_token(user.id, user.role)
+            user_id = user.id
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        self.assertEqual(self.client.get('/api/files', headers=headers).status_code, 200)
+        self.assertEqual(self.client.get('/api/files', headers=headers).status_code, 200)
+        cache = app.extensions['user_cache']
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        
+        # The profile is served from the cached principal
+        response = self.client.get('/api/user/profile', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['email'], 'testclient@example.com')
+        self.assertEqual(cache.stats()['hits'], 2)
+        
+        # A role change takes effect on the next request
+        with app.app_context():
+            db.session.get(User, user_id).role = UserRole.OPERATIONS
+            db.session.commit()
+        
+        self.assertEqual(self.client.get('/api/files', headers=headers).status_code, 403)
 
 if __name__ == '__main__':
     unittest.main()
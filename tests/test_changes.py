@@ -0,0 +1,170 @@
+import unittest
+import io
+import os
+import json
+import datetime
+import shutil
+from app import create_app, db
+from models import User, UserRole, FileEvent, FileAction
+from janitor import purge_file_events
+from utils import generate_token
+
+app = create_app('config.TestingConfig')
+
+class ChangeFeedTestCase(unittest.TestCase):
+    """Test case for the file change feed"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['CHANGES_STREAM_ENABLED'] = True
+        app.config['CHANGES_STREAM_TIMEOUT'] = 0  # Streams end after the pending changes
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_headers = {'Authorization': f'Bearer {generate_token(ops_user.id, ops_user.role)}'}
+            self.client_headers = {'Authorization': f'Bearer {generate_token(client_user.id, client_user.role)}'}
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self, filename):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(filename.encode()), filename)},
+            headers=self.ops_headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.data)['file']['id']
+
+    def changes(self, since):
+        response = self.client.get(f'/api/files/changes?since={since}', headers=self.client_headers)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_changes_since_listing(self):
+        """Test uploads and deletes after a listing show up as changes after its cursor"""
+        first_id = self.upload('first.docx')
+        listing = json.loads(self.client.get('/api/files', headers=self.client_headers).data)
+        cursor = listing['changes_cursor']
+        self.assertEqual(self.changes(cursor)['changes'], [])
+
+        second_id = self.upload('second.xlsx')
+        self.client.delete(f'/api/files/{first_id}', headers=self.ops_headers)
+
+        data = self.changes(cursor)
+        self.assertEqual([(c['action'], c['file_id']) for c in data['changes']],
+                         [('added', second_id), ('deleted', first_id)])
+        self.assertEqual(data['changes'][0]['file']['filename'], 'second.xlsx')
+        self.assertFalse(data['has_more'])
+
+        # Paging, and nothing further after the returned cursor
+        page = json.loads(self.client.get(f'/api/files/changes?since={cursor}&limit=1',
+                                          headers=self.client_headers).data)
+        self.assertEqual(len(page['changes']), 1)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(self.changes(data['cursor'])['changes'], [])
+
+        # Without a cursor only the current position is returned
+        current = json.loads(self.client.get('/api/files/changes', headers=self.client_headers).data)
+        self.assertEqual(current['cursor'], data['cursor'])
+
+    def test_cursor_waits_for_unsettled_events(self):
+        """Test the cursor never passes an event young enough to have uncommitted lower ids"""
+        app.config['CHANGES_VISIBILITY_DELAY'] = 60
+        try:
+            old = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+            with app.app_context():
+                # Event 2 was just written; a concurrent writer may still commit below it
+                db.session.add_all([
+                    FileEvent(file_id=10, action=FileAction.ADDED, created_at=old),
+                    FileEvent(file_id=11, action=FileAction.ADDED),
+                    FileEvent(file_id=12, action=FileAction.ADDED, created_at=old),
+                ])
+                db.session.commit()
+
+            data = self.changes(0)
+            self.assertEqual(([c['id'] for c in data['changes']], data['cursor']), ([1], 1))
+            self.assertEqual(self.changes(1)['changes'], [])
+            current = json.loads(self.client.get('/api/files/changes', headers=self.client_headers).data)
+            self.assertEqual(current['cursor'], 1)
+            listing = json.loads(self.client.get('/api/files', headers=self.client_headers).data)
+            self.assertEqual(listing['changes_cursor'], 1)
+
+            with app.app_context():
+                FileEvent.query.filter_by(id=2).update({'created_at': old})
+                db.session.commit()
+            data = self.changes(1)
+            self.assertEqual(([c['id'] for c in data['changes']], data['cursor']), ([2, 3], 3))
+        finally:
+            app.config['CHANGES_VISIBILITY_DELAY'] = 0
+
+    def test_invalid_requests(self):
+        """Test malformed cursors and non-client users are rejected"""
+        response = self.client.get('/api/files/changes?since=abc', headers=self.client_headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/files/changes?since=0', headers=self.ops_headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_stream(self):
+        """Test the event stream sends changes after the cursor and resumes from Last-Event-ID"""
+        file_id = self.upload('report.pptx')
+        response = self.client.get('/api/files/changes/stream?since=0', headers=self.client_headers)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn('event: change\nid: 1\n', body)
+        self.assertIn('"filename": "report.pptx"', body)
+
+        self.client.delete(f'/api/files/{file_id}', headers=self.ops_headers)
+        response = self.client.get('/api/files/changes/stream',
+                                   headers=dict(self.client_headers, **{'Last-Event-ID': '1'}))
+        body = response.get_data(as_text=True)
+        self.assertNotIn('id: 1\n', body)
+        self.assertIn('id: 2\n', body)
+        self.assertIn('"action": "deleted"', body)
+
+    def test_stream_disabled(self):
+        """Test the stream is off by default and the files page polls instead"""
+        app.config['CHANGES_STREAM_ENABLED'] = False
+        response = self.client.get('/api/files/changes/stream?since=0', headers=self.client_headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('const CHANGES_STREAM = false;', self.client.get('/files').get_data(as_text=True))
+
+    def test_purged_cursor_expires(self):
+        """Test the janitor keeps the newest event and old cursors get 410"""
+        for name in ('a.docx', 'b.docx', 'c.docx'):
+            self.upload(name)
+        with app.app_context():
+            FileEvent.query.update({'created_at': datetime.datetime.utcnow() - datetime.timedelta(days=30)})
+            db.session.commit()
+            self.assertEqual(purge_file_events(batch_size=10), 2)
+            self.assertEqual(FileEvent.query.count(), 1)
+
+        response = self.client.get('/api/files/changes?since=0', headers=self.client_headers)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual([c['id'] for c in self.changes(2)['changes']], [3])
+        body = self.client.get('/api/files/changes/stream?since=0', headers=self.client_headers).get_data(as_text=True)
+        self.assertIn('event: reset', body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import os
+import io
+import gzip
+import json
+import shutil
+import tempfile
+from app import create_app, db
+from config import TestingConfig
+from models import User, UserRole
+from assets import build_assets, asset_url
+from compression import brotli
+from utils import generate_token
+
+class CompressionTestingConfig(TestingConfig):
+    RESPONSE_CACHE_ENABLED = True
+    COMPRESS_MIN_SIZE = 500
+
+app = create_app(CompressionTestingConfig)
+
+class CompressionTestCase(unittest.TestCase):
+    """Test case for compressed API responses"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.client = app.test_client()
+        # Ids are reused across tests, so start with empty caches
+        for name in ('user_cache', 'response_cache', 'compressed_cache'):
+            app.extensions.pop(name, None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_headers = {'Authorization': f'Bearer {generate_token(ops_user.id, ops_user.role)}'}
+            self.client_headers = {'Authorization': f'Bearer {generate_token(client_user.id, client_user.role)}'}
+
+        for i in range(10):
+            self.client.post('/api/upload', data={'file': (io.BytesIO(f'content {i}'.encode()), f'report-{i}.docx')},
+                             headers=self.ops_headers, content_type='multipart/form-data')
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def get(self, path, **headers):
+        return self.client.get(path, headers=dict(self.client_headers, **headers))
+
+    def test_gzip_listing(self):
+        """Test a large JSON response is gzipped for clients that accept it"""
+        plain = self.get('/api/files')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        response = self.get('/api/files', **{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), json.loads(plain.data))
+
+    @unittest.skipUnless(brotli, "brotli is not installed")
+    def test_brotli_preferred(self):
+        """Test brotli is chosen when the client accepts it"""
+        response = self.get('/api/files', **{'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br')
+        self.assertEqual(len(json.loads(brotli.decompress(response.data))['files']), 10)
+
+        response = self.get('/api/files', **{'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+
+    def test_small_responses_uncompressed(self):
+        """Test bodies under COMPRESS_MIN_SIZE are sent as is"""
+        response = self.get('/api/files?limit=1', **{'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn(b'report-9.docx', response.data)
+
+    def test_conditional_request_with_compression(self):
+        """Test the weakened ETag of a compressed response still revalidates"""
+        response = self.get('/api/files', **{'Accept-Encoding': 'gzip'})
+        etag, weak = response.get_etag()
+        self.assertTrue(weak)
+
+        revalidated = self.get('/api/files', **{'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+        # Served again from the compressed body cache, byte for byte
+        again = self.get('/api/files', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(again.data, response.data)
+        self.assertEqual(app.extensions['compressed_cache'].hits, 1)
+
+class AssetTestCase(unittest.TestCase):
+    """Test case for fingerprinted, precompressed static assets"""
+
+    def setUp(self):
+        """Build the assets of a copy of the static folder"""
+        self.static_folder = app.static_folder
+        self.tempdir = tempfile.mkdtemp()
+        app.static_folder = os.path.join(self.tempdir, 'static')
+        shutil.copytree(self.static_folder, app.static_folder, ignore=shutil.ignore_patterns('build*'))
+        app.extensions.pop('asset_manifest', None)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Restore the static folder"""
+        app.static_folder = self.static_folder
+        app.extensions.pop('asset_manifest', None)
+        shutil.rmtree(self.tempdir)
+
+    def test_unbuilt_assets(self):
+        """Test templates link plain static URLs when no build exists"""
+        with app.test_request_context():
+            self.assertEqual(asset_url('css/styles.css'), '/static/css/styles.css')
+        response = self.client.get('/static/css/styles.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def test_built_assets(self):
+        """Test fingerprinted URLs in pages and precompressed, immutable build files"""
+        manifest = build_assets(app.static_folder)
+        built = manifest['css/styles.css']
+        self.assertRegex(built, r'^build/css/styles\.[0-9a-f]{12}\.css$')
+        # Building again gives the same names
+        self.assertEqual(build_assets(app.static_folder), manifest)
+
+        page = self.client.get('/login').get_data(as_text=True)
+        self.assertIn(f'/static/{built}', page)
+        self.assertIn(f"/static/{manifest['js/main.js']}", page)
+
+        with open(os.path.join(app.static_folder, 'css', 'styles.css'), 'rb') as f:
+            original = f.read()
+
+        response = self.client.get(f'/static/{built}', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        self.assertEqual(gzip.decompress(response.get_data()), original)
+        response.close()
+
+        response = self.client.get(f'/static/{built}')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_data(), original)
+        response.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from sqlalchemy import create_engine, exc, text
+from app import create_app, db
+from config import TestingConfig
+from models import User, File, UserRole
+from utils import generate_token
+from database import InstrumentedQueuePool, REPLICA_BIND, pool_status
+
+class ReplicaTestingConfig(TestingConfig):
+    # A second in-memory database standing in for a read replica
+    SQLALCHEMY_BINDS = {REPLICA_BIND: 'sqlite:///:memory:'}
+
+app = create_app(ReplicaTestingConfig)
+# init_app registered an (empty) metadata for the bind on the shared db object;
+# drop it so the other test modules' apps, which have no replica, can create_all()
+db.metadatas.pop(REPLICA_BIND, None)
+
+class DatabaseTestCase(unittest.TestCase):
+    """Test case for read-replica routing and connection pool metrics"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines[REPLICA_BIND])
+
+            # Same accounts on both databases, with a replica-only email and file to tell them apart
+            for bind in (None, REPLICA_BIND):
+                with db.engines[bind].begin() as connection:
+                    ops = User(username='testops', email='testops@example.com', role=UserRole.OPERATIONS)
+                    ops.set_password('password123')
+                    client = User(username='testclient', email=f'testclient@{bind or "primary"}.example.com',
+                                  role=UserRole.CLIENT)
+                    client.set_password('password123')
+                    for user in (ops, client):
+                        connection.execute(User.__table__.insert().values(
+                            username=user.username, email=user.email, password_hash=user.password_hash,
+                            role=user.role, is_verified=True))
+                    if bind:
+                        connection.execute(File.__table__.insert().values(
+                            filename='replica.docx', original_filename='replica.docx', file_path='replica.docx',
+                            file_type='docx', file_size=1, uploader_id=1))
+
+            self.ops_token = generate_token(1, UserRole.OPERATIONS)
+            self.client_token = generate_token(2, UserRole.CLIENT)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.metadata.drop_all(db.engines[REPLICA_BIND])
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def test_read_only_endpoints_use_replica(self):
+        """Test listing and details read the replica while writes stay on the primary"""
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+
+        response = self.client.get('/api/files', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        files = json.loads(response.data)['files']
+        self.assertEqual([f['filename'] for f in files], ['replica.docx'])
+
+        response = self.client.get(f"/api/files/{files[0]['id']}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        # The profile is served from the principal, loaded from the primary when authenticating
+        response = self.client.get('/api/user/profile', headers=headers)
+        self.assertEqual(json.loads(response.data)['email'], 'testclient@primary.example.com')
+
+        # Uploads are not routed, so the new file lands on the primary only
+        response = self.client.post(
+            '/api/upload',
+            data=b'written to the primary',
+            headers={'Authorization': f'Bearer {self.ops_token}', 'Content-Type': 'application/octet-stream',
+                     'X-Filename': 'primary.docx'}
+        )
+        self.assertEqual(response.status_code, 201)
+        with app.app_context():
+            self.assertEqual([f.original_filename for f in File.query.all()], ['primary.docx'])
+
+    def test_cached_responses_are_filled_from_primary(self):
+        """Test a cached listing is read from the primary, so replica lag cannot outlive a generation bump"""
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        app.config['RESPONSE_CACHE_ENABLED'] = True
+        try:
+            response = self.client.get('/api/files', headers=headers)
+            self.assertEqual(json.loads(response.data)['files'], [])
+        finally:
+            app.config['RESPONSE_CACHE_ENABLED'] = False
+            app.extensions.pop('response_cache', None)
+
+    def test_pool_endpoint(self):
+        """Test the pool metrics endpoint is limited to operations users"""
+        response = self.client.get('/api/ops/db-pool', headers={'Authorization': f'Bearer {self.client_token}'})
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.get('/api/ops/db-pool', headers={'Authorization': f'Bearer {self.ops_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(json.loads(response.data)['binds']), {'primary', REPLICA_BIND})
+
+    def test_pool_checkout_wait_stats(self):
+        """Test checkouts and pool timeouts are counted, and survive dispose()"""
+        directory = tempfile.mkdtemp()
+        engine = create_engine(f'sqlite:///{directory}/pool.db', poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+                with self.assertRaises(exc.TimeoutError):
+                    engine.connect()
+
+            status = pool_status(engine)
+            self.assertEqual(status['checkouts'], 2)
+            self.assertEqual(status['timeouts'], 1)
+            self.assertGreaterEqual(status['wait_seconds_max'], 0.05)
+            self.assertEqual(sum(status['wait_histogram'].values()), 2)
+
+            engine.dispose()
+            with engine.connect():
+                pass
+            self.assertEqual(pool_status(engine)['checkouts'], 3)
+        finally:
+            engine.dispose()
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,15 @@ import unittest
 import json
 import os
 import io
-from app import app, db
-from models import User, File, UserRole, DownloadToken
-from utils import generate_token
+import datetime
+import hashlib
+import shutil
+from sqlalchemy import event
+from app import create_app, db
+from models import User, File, Blob, UserRole, DownloadToken, RedeemedToken
+from utils import generate_token, encode_cursor
+
+app = create_app('config.TestingConfig')
 
 class FileTestCase(unittest.TestCase):
     """Test case for file upload and download routes"""
@@ -12,10 +18,11 @@ class FileTestCase(unittest.TestCase):
     def setUp(self):
         """Set up test environment"""
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         app.config['UPLOAD_FOLDER'] = 'test_uploads'
         app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024  # 1MB for testing
         self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
         
         # Create test upload folder
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -57,14 +64,8 @@ class FileTestCase(unittest.TestCase):
             db.session.remove()
             db.drop_all()
         
-        # Clean up test files
-        for root, dirs, files in os.walk(app.config['UPLOAD_FOLDER']):
-            for file in files:
-                os.remove(os.path.join(root, file))
-        
-        # Remove test folder
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            os.rmdir(app.config['UPLOAD_FOLDER'])
+        # Clean up test files and the blob store shard directories
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
     
     def test_upload_file_operations_user(self):
         """Test file upload by operations user"""
@@ -95,6 +96,225 @@ class FileTestCase(unittest.TestCase):
             self.assertIsNotNone(file)
             self.assertEqual(file.uploader_id, self.ops_user_id)
     
+    def test_upload_file_hashes_and_leaves_no_spool(self):
+        """Test multipart uploads record size and SHA-256 and clean up their temp file"""
+        content = os.urandom(3 * 1024 * 256 + 17)
+        
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), 'deck.pptx')},
+            headers={'Authorization': f'Bearer {self.ops_token}'},
+            content_type='multipart/form-data'
+        )
+        
+        self.assertEqual(response.status_code, 201)
+        with app.app_context():
+            file = File.query.filter_by(original_filename='deck.pptx').first()
+            self.assertEqual(file.file_size, len(content))
+            self.assertEqual(file.content_hash, hashlib.sha256(content).hexdigest())
+            with open(file.file_path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+        
+        leftovers = [n for n in os.listdir(app.config['UPLOAD_FOLDER']) if n.endswith('.part')]
+        self.assertEqual(leftovers, [])
+    
+    def test_upload_raw_stream(self):
+        """Test uploading a raw application/octet-stream body"""
+        content = b'raw spreadsheet bytes' * 1000
+        
+        response = self.client.post(
+            '/api/upload',
+            data=content,
+            headers={
+                'Authorization': f'Bearer {self.ops_token}',
+                'X-Filename': 'report.xlsx'
+            },
+            content_type='application/octet-stream'
+        )
+        
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['file']['filename'], 'report.xlsx')
+        self.assertEqual(data['file']['file_size'], len(content))
+        
+        with app.app_context():
+            file = File.query.filter_by(original_filename='report.xlsx').first()
+            self.assertEqual(file.content_hash, hashlib.sha256(content).hexdigest())
+    
+    def test_upload_raw_stream_invalid_type(self):
+        """Test raw uploads are rejected before anything is written for bad extensions"""
+        response = self.client.post(
+            '/api/upload',
+            data=b'not allowed',
+            headers={
+                'Authorization': f'Bearer {self.ops_token}',
+                'X-Filename': 'script.sh'
+            },
+            content_type='application/octet-stream'
+        )
+        
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(os.listdir(app.config['UPLOAD_FOLDER']), [])
+    
+    def upload(self, content, filename):
+        return self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            headers={'Authorization': f'Bearer {self.ops_token}'},
+            content_type='multipart/form-data'
+        )
+    
+    def test_duplicate_uploads_share_blob(self):
+        """Test re-uploading identical content stores it once and reference counts it"""
+        content = b'the same deck uploaded again and again'
+        digest = hashlib.sha256(content).hexdigest()
+        
+        first = json.loads(self.upload(content, 'deck.pptx').data)['file']
+        second = json.loads(self.upload(content, 'deck-copy.pptx').data)['file']
+        self.assertNotEqual(first['id'], second['id'])
+        
+        with app.app_context():
+            blob = db.session.get(Blob, digest)
+            self.assertEqual(blob.ref_count, 2)
+            paths = {f.file_path for f in File.query.all()}
+            self.assertEqual(paths, {os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4], digest)})
+        
+        stored = [n for _, _, names in os.walk(app.config['UPLOAD_FOLDER']) for n in names]
+        self.assertEqual(stored, [digest])
+    
+    def test_delete_file_releases_blob(self):
+        """Test the shared content is only unlinked when its last file is deleted"""
+        content = b'shared workbook'
+        digest = hashlib.sha256(content).hexdigest()
+        headers = {'Authorization': f'Bearer {self.ops_token}'}
+        
+        first = json.loads(self.upload(content, 'a.xlsx').data)['file']
+        second = json.loads(self.upload(content, 'b.xlsx').data)['file']
+        path = os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4], digest)
+        
+        response = self.client.delete(f'/api/files/{first["id"]}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.exists(path))
+        with app.app_context():
+            self.assertEqual(db.session.get(Blob, digest).ref_count, 1)
+        
+        response = self.client.delete(f'/api/files/{second["id"]}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(path))
+        with app.app_context():
+            self.assertIsNone(db.session.get(Blob, digest))
+    
+    def test_delete_file_with_outstanding_link(self):
+        """Test a file with an unused download link is deleted along with the link"""
+        content = b'linked workbook'
+        digest = hashlib.sha256(content).hexdigest()
+        file_id = json.loads(self.upload(content, 'linked.xlsx').data)['file']['id']
+        path = os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4], digest)
+        
+        response = self.client.get(f'/api/download-file/{file_id}',
+                                   headers={'Authorization': f'Bearer {self.client_token}'})
+        self.assertEqual(response.status_code, 200)
+        with app.app_context():
+            self.assertEqual(DownloadToken.query.filter_by(file_id=file_id).count(), 1)
+        
+        response = self.client.delete(f'/api/files/{file_id}', headers={'Authorization': f'Bearer {self.ops_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(os.path.exists(path))
+        with app.app_context():
+            self.assertEqual(DownloadToken.query.count(), 0)
+            self.assertIsNone(db.session.get(File, file_id))
+            self.assertIsNone(db.session.get(Blob, digest))
+    
+    def test_failed_delete_keeps_content(self):
+        """Test content is only unlinked once the deletion has committed"""
+        content = b'kept workbook'
+        digest = hashlib.sha256(content).hexdigest()
+        file_id = json.loads(self.upload(content, 'kept.xlsx').data)['file']['id']
+        path = os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4], digest)
+        
+        def fail(session):
+            raise RuntimeError('commit failed')
+        
+        event.listen(db.session, 'before_commit', fail)
+        try:
+            response = self.client.delete(f'/api/files/{file_id}', headers={'Authorization': f'Bearer {self.ops_token}'})
+        finally:
+            event.remove(db.session, 'before_commit', fail)
+        self.assertEqual(response.status_code, 500)
+        self.assertTrue(os.path.exists(path))
+        with app.app_context():
+            self.assertIsNotNone(db.session.get(File, file_id))
+            self.assertEqual(db.session.get(Blob, digest).ref_count, 1)
+    
+    def test_rekey_legacy_uploads(self):
+        """Test the migration tool moves uuid-named uploads into the blob store"""
+        from rekey_uploads import rekey_uploads
+        
+        content = b'legacy upload'
+        digest = hashlib.sha256(content).hexdigest()
+        with app.app_context():
+            for name in ('legacy1.docx', 'legacy2.docx'):
+                path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                with open(path, 'wb') as f:
+                    f.write(content)
+                db.session.add(File(
+                    filename=name,
+                    original_filename=name,
+                    file_path=path,
+                    file_type='docx',
+                    file_size=len(content),
+                    uploader_id=self.ops_user_id
+                ))
+            db.session.commit()
+        
+        stats = rekey_uploads(app)
+        self.assertEqual(stats['rekeyed'], 2)
+        
+        with app.app_context():
+            self.assertEqual(db.session.get(Blob, digest).ref_count, 2)
+            for file in File.query.all():
+                self.assertEqual(file.content_hash, digest)
+                with open(file.file_path, 'rb') as f:
+                    self.assertEqual(f.read(), content)
+        
+        stored = [n for _, _, names in os.walk(app.config['UPLOAD_FOLDER']) for n in names]
+        self.assertEqual(stored, [digest])
+        
+        self.assertEqual(stats['ref_count_mismatches'], 0)
+        
+        # Re-running is a no-op
+        self.assertEqual(rekey_uploads(app)['already_keyed'], 2)
+    
+    def test_rekey_counts_references_per_file(self):
+        """Test each rekeyed file holds its blob reference at once, so a delete mid-run keeps shared content"""
+        from rekey_uploads import rekey_file
+        from storage import LocalStorage
+        
+        content = b'legacy upload'
+        with app.app_context():
+            files = []
+            for name in ('legacy1.docx', 'legacy2.docx'):
+                path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                with open(path, 'wb') as f:
+                    f.write(content)
+                files.append(File(filename=name, original_filename=name, file_path=path, file_type='docx',
+                                  file_size=len(content), uploader_id=self.ops_user_id))
+            db.session.add_all(files)
+            db.session.commit()
+            
+            # An interrupted run: both files rekeyed and committed, no final pass
+            storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+            for file in files:
+                rekey_file(file, storage, 65536)
+            db.session.commit()
+            file_ids = [file.id for file in files]
+            blob_path = files[0].file_path
+            self.assertEqual(db.session.get(Blob, files[0].content_hash).ref_count, 2)
+        
+        headers = {'Authorization': f'Bearer {self.ops_token}'}
+        self.assertEqual(self.client.delete(f'/api/files/{file_ids[0]}', headers=headers).status_code, 200)
+        self.assertTrue(os.path.exists(blob_path))
+    
     def test_upload_file_client_user(self):
         """Test file upload by client user (should be denied)"""
         # Create a test file
@@ -166,6 +386,144 @@ class FileTestCase(unittest.TestCase):
         self.assertEqual(len(data['files']), 1)
         self.assertEqual(data['files'][0]['filename'], 'test_file_1.docx')
     
+    def test_list_files_keyset_pagination(self):
+        """Test paging through the file listing with a cursor"""
+        base_time = datetime.datetime(2024, 1, 1)
+        with app.app_context():
+            for i in range(5):
+                db.session.add(File(
+                    filename=f'page_{i}.docx',
+                    original_filename=f'page_{i}.docx',
+                    file_path=os.path.join(app.config['UPLOAD_FOLDER'], f'page_{i}.docx'),
+                    file_type='docx' if i % 2 == 0 else 'xlsx',
+                    file_size=100 + i,
+                    uploader_id=self.ops_user_id,
+                    uploaded_at=base_time + datetime.timedelta(minutes=i)
+                ))
+            db.session.commit()
+        
+        seen = []
+        cursor = None
+        while True:
+            url = '/api/files?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url, headers={'Authorization': f'Bearer {self.client_token}'})
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertLessEqual(len(data['files']), 2)
+            seen.extend(f['filename'] for f in data['files'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        
+        # Newest first by default, every file exactly once
+        self.assertEqual(seen, [f'page_{i}.docx' for i in reversed(range(5))])
+    
+    def test_list_files_filters_and_sort(self):
+        """Test server-side filtering and sorting of the file listing"""
+        base_time = datetime.datetime(2024, 1, 1)
+        with app.app_context():
+            for i in range(4):
+                db.session.add(File(
+                    filename=f'filter_{i}.docx',
+                    original_filename=f'filter_{i}.{"docx" if i < 2 else "pptx"}',
+                    file_path=os.path.join(app.config['UPLOAD_FOLDER'], f'filter_{i}.docx'),
+                    file_type='docx' if i < 2 else 'pptx',
+                    file_size=1000 - i,
+                    uploader_id=self.ops_user_id,
+                    uploaded_at=base_time + datetime.timedelta(days=i)
+                ))
+            db.session.commit()
+        
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        
+        response = self.client.get('/api/files?file_type=pptx', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual({f['file_type'] for f in data['files']}, {'pptx'})
+        self.assertEqual(len(data['files']), 2)
+        
+        response = self.client.get('/api/files?uploaded_after=2024-01-02&uploaded_before=2024-01-04', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual([f['filename'] for f in data['files']], ['filter_2.pptx', 'filter_1.docx'])
+        
+        response = self.client.get('/api/files?uploader=testops&sort=file_size&order=asc', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual([f['file_size'] for f in data['files']], [997, 998, 999, 1000])
+        
+        response = self.client.get('/api/files?uploader=nobody', headers=headers)
+        self.assertEqual(json.loads(response.data)['files'], [])
+    
+    def _count_listing_queries(self, file_count):
+        """Seed file_count files from distinct uploaders and count statements issued by a listing"""
+        with app.app_context():
+            for i in range(file_count):
+                uploader = User(
+                    username=f'uploader_{file_count}_{i}',
+                    email=f'uploader_{file_count}_{i}@example.com',
+                    password_hash='x',
+                    role=UserRole.OPERATIONS,
+                    is_verified=True
+                )
+                db.session.add(uploader)
+                db.session.flush()
+                db.session.add(File(
+                    filename=f'count_{i}.docx',
+                    original_filename=f'count_{i}.docx',
+                    file_path=os.path.join(app.config['UPLOAD_FOLDER'], f'count_{i}.docx'),
+                    file_type='docx',
+                    file_size=10,
+                    uploader_id=uploader.id
+                ))
+            db.session.commit()
+            engine = db.engine
+        
+        # Start cold so both runs pay for authenticating the caller
+        app.extensions.pop('user_cache', None)
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get(
+                '/api/files',
+                headers={'Authorization': f'Bearer {self.client_token}'}
+            )
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['files']), file_count)
+        return len(statements)
+    
+    def test_list_files_constant_query_count(self):
+        """Test the listing does not issue a query per file uploader (N+1)"""
+        single = self._count_listing_queries(1)
+        
+        with app.app_context():
+            File.query.delete()
+            db.session.commit()
+        
+        many = self._count_listing_queries(20)
+        self.assertEqual(single, many)
+        # One statement to authenticate the caller and one for the page
+        self.assertLessEqual(many, 2)
+    
+    def test_list_files_invalid_params(self):
+        """Test the file listing rejects malformed pagination arguments"""
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        
+        for query in ('cursor=not-a-cursor', 'sort=password', 'limit=0', 'uploaded_after=yesterday'):
+            response = self.client.get(f'/api/files?{query}', headers=headers)
+            self.assertEqual(response.status_code, 400, query)
+        
+        # Well-formed cursors whose value has the wrong type for the sort
+        for sort, value in (('filename', 5), ('filename', None), ('file_size', 'big'), ('file_size', 1.5),
+                            ('file_size', [1]), ('uploaded_at', 7)):
+            cursor = encode_cursor(sort, 'asc', value, 1)
+            response = self.client.get(f'/api/files?sort={sort}&order=asc&cursor={cursor}', headers=headers)
+            self.assertEqual(response.status_code, 400, (sort, value))
+            self.assertEqual(json.loads(response.data)['message'], 'Invalid cursor')
+    
     def test_get_download_link(self):
         """Test getting download link for a file"""
         # First create a test file
@@ -200,6 +558,131 @@ class FileTestCase(unittest.TestCase):
             tokens = DownloadToken.query.filter_by(file_id=file_id, user_id=self.client_user_id).all()
             self.assertTrue(len(tokens) > 0)
     
+    def test_download_file(self):
+        """Test downloading an uploaded file through a download token"""
+        content = b'downloadable content'
+        file_id = json.loads(self.upload(content, 'notes.docx').data)['file']['id']
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        
+        link = json.loads(self.client.get(f'/api/download-file/{file_id}', headers=headers).data)['download-link']
+        response = self.client.get(link, headers=headers)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        self.assertIn('notes.docx', response.headers['Content-Disposition'])
+        response.close()
+    
+    def test_download_range_and_conditional(self):
+        """Test resumed, segmented and revalidated downloads"""
+        content = bytes(range(256)) * 40
+        digest = hashlib.sha256(content).hexdigest()
+        file_id = json.loads(self.upload(content, 'big.xlsx').data)['file']['id']
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        link = json.loads(self.client.get(f'/api/download-file/{file_id}', headers=headers).data)['download-link']
+        
+        response = self.client.get(link, headers=dict(headers, Range='bytes=100-199'))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[100:200])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(content)}')
+        self.assertEqual(response.headers['ETag'], f'"{digest}"')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response.headers)
+        
+        # The redeemed token cannot start a new full download...
+        self.assertEqual(self.client.get(link, headers=headers).status_code, 401)
+        
+        # ...but it can resume one
+        response = self.client.get(link, headers=dict(headers, Range='bytes=10000-'))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[10000:])
+        
+        response = self.client.get(link, headers=dict(headers, **{'If-None-Match': f'"{digest}"'}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        # A stale If-Range validator gets the whole (changed) representation
+        response = self.client.get(link, headers=dict(headers, Range='bytes=0-9', **{'If-Range': '"other"'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        response.close()
+        
+        response = self.client.get(link, headers=dict(headers, Range=f'bytes={len(content)}-'))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{len(content)}')
+    
+    def test_download_offloaded_to_proxy(self):
+        """Test X-Accel-Redirect and X-Sendfile delivery modes only emit headers"""
+        content = b'served by nginx'
+        digest = hashlib.sha256(content).hexdigest()
+        file_id = json.loads(self.upload(content, 'deck.pptx').data)['file']['id']
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        
+        try:
+            app.config['DOWNLOAD_DELIVERY'] = 'x-accel-redirect'
+            link = json.loads(self.client.get(f'/api/download-file/{file_id}', headers=headers).data)['download-link']
+            response = self.client.get(link, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['X-Accel-Redirect'],
+                             f'/protected-uploads/{digest[:2]}/{digest[2:4]}/{digest}')
+            self.assertIn('deck.pptx', response.headers['Content-Disposition'])
+            self.assertEqual(response.headers['ETag'], f'"{digest}"')
+            
+            app.config['DOWNLOAD_DELIVERY'] = 'x-sendfile'
+            link = json.loads(self.client.get(f'/api/download-file/{file_id}', headers=headers).data)['download-link']
+            response = self.client.get(link, headers=headers)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['X-Sendfile'], os.path.abspath(
+                os.path.join(app.config['UPLOAD_FOLDER'], digest[:2], digest[2:4], digest)))
+            self.assertNotIn('X-Accel-Redirect', response.headers)
+        finally:
+            app.config['DOWNLOAD_DELIVERY'] = 'app'
+    
+    def test_signed_download_tokens(self):
+        """Test signed download links need no row until redeemed, and are single use across workers"""
+        content = b'signed link content'
+        file_id = json.loads(self.upload(content, 'signed.docx').data)['file']['id']
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        
+        try:
+            app.config['DOWNLOAD_TOKEN_MODE'] = 'signed'
+            link = json.loads(self.client.get(f'/api/download-file/{file_id}', headers=headers).data)['download-link']
+            with app.app_context():
+                self.assertEqual(DownloadToken.query.count(), 0)
+            
+            # Another user cannot redeem it
+            with app.app_context():
+                other = User(username='otherclient', email='other@example.com', password_hash='x',
+                             role=UserRole.CLIENT, is_verified=True)
+                db.session.add(other)
+                db.session.commit()
+                other_token = generate_token(other.id, other.role)
+            response = self.client.get(link, headers={'Authorization': f'Bearer {other_token}'})
+            self.assertEqual(response.status_code, 401)
+            
+            response = self.client.get(link, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, content)
+            response.close()
+            
+            # Replays are refused, resumes are not
+            self.assertEqual(self.client.get(link, headers=headers).status_code, 401)
+            response = self.client.get(link, headers=dict(headers, Range='bytes=0-5'))
+            self.assertEqual(response.status_code, 206)
+            response.close()
+            self.assertIn('/s1.', link)
+            
+            # Another worker, with an empty replay cache, refuses it too
+            app.extensions.pop('download_replay_cache', None)
+            self.assertEqual(self.client.get(link, headers=headers).status_code, 401)
+            with app.app_context():
+                self.assertEqual(RedeemedToken.query.count(), 1)
+            
+            tampered = link[:-6] + ('A' if link[-6] != 'A' else 'B') + link[-5:]
+            self.assertEqual(self.client.get(tampered, headers=headers).status_code, 401)
+        finally:
+            app.config['DOWNLOAD_TOKEN_MODE'] = 'database'
+    
     def test_get_download_link_operations_user(self):
         """Test getting download link as operations user (should be denied)"""
         # First create a test file
@@ -0,0 +1,130 @@
+import unittest
+import io
+import os
+import json
+import shutil
+import hashlib
+import datetime
+from app import create_app, db
+from models import User, File, Blob, UserRole, DownloadToken
+from storage import get_storage, blob_key
+from utils import generate_token
+from janitor import run_janitor
+
+app = create_app('config.TestingConfig')
+
+class JanitorTestCase(unittest.TestCase):
+    """Test case for the background maintenance job"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        app.config['UPLOAD_FOLDER'] = 'test_uploads'
+        app.config['JANITOR_ORPHAN_GRACE'] = 0
+        app.config['JANITOR_BATCH_SIZE'] = 2
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.client_user_id = client_user.id
+
+    def tearDown(self):
+        """Clean up after tests"""
+        app.config['JANITOR_ORPHAN_GRACE'] = 3600
+        app.config['JANITOR_BATCH_SIZE'] = 1000
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self, content, filename):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            headers={'Authorization': f'Bearer {self.ops_token}'},
+            content_type='multipart/form-data'
+        )
+        return json.loads(response.data)['file']['id']
+
+    def test_purges_expired_and_spent_tokens(self):
+        """Test expired and used tokens are deleted in batches and live ones kept"""
+        file_id = self.upload(b'token target', 'a.docx')
+        now = datetime.datetime.utcnow()
+
+        with app.app_context():
+            for i in range(5):
+                db.session.add(DownloadToken(token=f'expired-{i}', file_id=file_id, user_id=self.client_user_id,
+                                             expiration=now - datetime.timedelta(minutes=1)))
+            db.session.add(DownloadToken(token='spent', file_id=file_id, user_id=self.client_user_id,
+                                         expiration=now + datetime.timedelta(hours=1), is_used=True,
+                                         used_at=now - datetime.timedelta(days=1)))
+            db.session.add(DownloadToken(token='resumable', file_id=file_id, user_id=self.client_user_id,
+                                         expiration=now + datetime.timedelta(hours=1), is_used=True,
+                                         used_at=now))
+            db.session.add(DownloadToken(token='fresh', file_id=file_id, user_id=self.client_user_id,
+                                         expiration=now + datetime.timedelta(hours=1)))
+            db.session.commit()
+
+            stats = run_janitor()
+
+            self.assertEqual(stats['download_tokens'], 6)
+            remaining = {t.token for t in DownloadToken.query.all()}
+            self.assertEqual(remaining, {'resumable', 'fresh'})
+            self.assertGreaterEqual(app.extensions['janitor_totals']['runs'], 1)
+
+    def test_reports_and_reaps_orphans(self):
+        """Test orphan blobs, stale spools and dangling file rows are found and reaped"""
+        kept_id = self.upload(b'still referenced', 'kept.docx')
+        lost_id = self.upload(b'content that goes missing', 'lost.docx')
+
+        orphan = b'stored but never committed'
+        orphan_digest = hashlib.sha256(orphan).hexdigest()
+        spool = os.path.join(app.config['UPLOAD_FOLDER'], '.upload-crashed.part')
+        with open(spool, 'wb') as f:
+            f.write(b'partial')
+
+        with app.app_context():
+            storage = get_storage()
+            storage.put_stream(blob_key(orphan_digest), io.BytesIO(orphan))
+            lost = db.session.get(File, lost_id)
+            storage.delete(blob_key(lost.content_hash))
+
+            # Report only
+            stats = run_janitor()
+            self.assertEqual(stats['orphan_blobs'], 1)
+            self.assertEqual(stats['orphan_bytes'], len(orphan))
+            self.assertEqual(stats['dangling_files'], 1)
+            self.assertEqual(stats['stale_spools'], 1)
+            self.assertTrue(storage.exists(blob_key(orphan_digest)))
+            self.assertIsNotNone(db.session.get(File, lost_id))
+
+            stats = run_janitor(reap=True)
+            self.assertFalse(storage.exists(blob_key(orphan_digest)))
+            self.assertIsNone(db.session.get(File, lost_id))
+            self.assertIsNotNone(db.session.get(File, kept_id))
+            self.assertEqual(Blob.query.count(), 1)
+
+            stats = run_janitor(reap=True)
+            self.assertEqual((stats['orphan_blobs'], stats['dangling_files'], stats['unreferenced_blobs']), (0, 0, 0))
+
+        self.assertFalse(os.path.exists(spool))
+
+if __name__ == '__main__':
+    unittest.main()
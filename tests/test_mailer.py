@@ -0,0 +1,130 @@
+import unittest
+import json
+import socket
+import datetime
+from app import create_app, db, mail
+from models import User, OutboundEmail, EmailStatus
+from mailer import process_outbox, queue_email
+
+app = create_app('config.TestingConfig')
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+class RecordingHandler:
+    """aiosmtpd handler keeping every message it receives"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+class MailQueueTestCase(unittest.TestCase):
+    """Test case for the outbound mail queue"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.saved_config = {k: app.config[k] for k in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_USE_TLS', 'MAIL_MAX_ATTEMPTS')}
+
+        with app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        app.config.pop('MAIL_SUPPRESS_SEND', None)
+        app.config.update(self.saved_config)
+        mail.init_app(app)
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def use_smtp_server(self, host, port):
+        app.config.update(MAIL_SERVER=host, MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(app)
+
+    def test_signup_queues_verification_email(self):
+        """Test signup commits the user and the email together without contacting SMTP"""
+        # Nothing listens here, so a synchronous send would fail the request
+        self.use_smtp_server('127.0.0.1', unused_port())
+
+        response = self.client.post(
+            '/api/signup',
+            data=json.dumps({
+                'username': 'queued',
+                'email': 'queued@example.com',
+                'password': 'securepassword'
+            }),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('check your email', json.loads(response.data)['message'])
+        with app.app_context():
+            email = OutboundEmail.query.one()
+            self.assertEqual(email.recipient, 'queued@example.com')
+            self.assertEqual(email.status, EmailStatus.PENDING)
+            self.assertIn(User.query.one().verification_token, email.html)
+
+    def test_failed_delivery_backs_off(self):
+        """Test failed sends are retried later and given up after MAIL_MAX_ATTEMPTS"""
+        self.use_smtp_server('127.0.0.1', unused_port())
+        app.config['MAIL_MAX_ATTEMPTS'] = 2
+
+        with app.app_context():
+            queue_email('a@example.com', 'Subject', '<p>Body</p>')
+            db.session.commit()
+
+            self.assertEqual(process_outbox(), {'sent': 0, 'failed': 1})
+            email = OutboundEmail.query.one()
+            self.assertEqual(email.status, EmailStatus.PENDING)
+            self.assertEqual(email.attempts, 1)
+            self.assertIsNotNone(email.last_error)
+            self.assertGreater(email.next_attempt_at, datetime.datetime.utcnow())
+
+            # Not due yet
+            self.assertEqual(process_outbox(), {'sent': 0, 'failed': 0})
+
+            email.next_attempt_at = datetime.datetime.utcnow()
+            db.session.commit()
+            self.assertEqual(process_outbox(), {'sent': 0, 'failed': 1})
+            self.assertEqual(OutboundEmail.query.one().status, EmailStatus.FAILED)
+
+    @unittest.skipUnless(Controller, 'aiosmtpd is required for SMTP delivery tests')
+    def test_delivers_in_batches(self):
+        """Test queued mail is delivered to a local SMTP server, including batches left by a crashed worker"""
+        handler = RecordingHandler()
+        controller = Controller(handler, hostname='127.0.0.1', port=unused_port())
+        controller.start()
+        self.addCleanup(controller.stop)
+        self.use_smtp_server('127.0.0.1', controller.port)
+
+        with app.app_context():
+            for i in range(5):
+                queue_email(f'user{i}@example.com', 'Subject', '<p>Body</p>')
+            db.session.commit()
+
+            stuck = OutboundEmail.query.first()
+            stuck.status = EmailStatus.SENDING
+            stuck.claimed_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            db.session.commit()
+
+            self.assertEqual(process_outbox(batch_size=2), {'sent': 5, 'failed': 0})
+            self.assertEqual(OutboundEmail.query.filter_by(status=EmailStatus.SENT).count(), 5)
+
+        self.assertEqual(sorted(m.rcpt_tos[0] for m in handler.messages),
+                         [f'user{i}@example.com' for i in range(5)])
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+if __name__ == '__main__':
+    unittest.main()
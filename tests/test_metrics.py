@@ -0,0 +1,135 @@
+import unittest
+import io
+import re
+import os
+import shutil
+import hashlib
+from app import create_app, db
+from models import User, UserRole
+from utils import generate_token
+from metrics import prometheus_client
+from storage import get_storage, blob_key
+from janitor import run_janitor
+
+app = create_app('config.TestingConfig')
+
+def sample(text, name, **labels):
+    """Value of one sample in Prometheus text output, 0 if absent"""
+    for line in text.splitlines():
+        match = re.fullmatch(r'(\w+)(?:\{(.*)\})? (\S+)', line)
+        if not match or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or ''))
+        if all(found.get(k) == str(v) for k, v in labels.items()):
+            return float(match.group(3))
+    return 0.0
+
+@unittest.skipUnless(prometheus_client, "prometheus_client is not installed")
+class MetricsTestCase(unittest.TestCase):
+    """Test case for the Prometheus metrics endpoint"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        app.config['UPLOAD_FOLDER'] = 'test_uploads'
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.client_token = generate_token(client_user.id, client_user.role)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        app.config['METRICS_AUTH_TOKEN'] = None
+        app.config['JANITOR_ORPHAN_GRACE'] = 3600
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        return response.get_data(as_text=True)
+
+    def test_request_metrics(self):
+        """Test requests, bytes, queries and cache lookups are recorded per endpoint"""
+        before = self.scrape()
+        headers = {'Authorization': f'Bearer {self.client_token}'}
+        content = b'x' * 5000
+
+        self.client.post(
+            '/api/upload',
+            data=content,
+            headers={'Authorization': f'Bearer {self.ops_token}', 'Content-Type': 'application/octet-stream',
+                     'X-Filename': 'metrics.docx'}
+        )
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/files', headers=headers).status_code, 200)
+        self.client.get('/no-such-page')
+        after = self.scrape()
+
+        def delta(name, **labels):
+            return sample(after, name, **labels) - sample(before, name, **labels)
+
+        self.assertEqual(delta('fileshare_http_requests_total',
+                               method='GET', endpoint='file.list_files', status=200), 3)
+        self.assertEqual(delta('fileshare_http_requests_total',
+                               method='GET', endpoint='unmatched', status=404), 1)
+        self.assertEqual(delta('fileshare_http_request_duration_seconds_count',
+                               method='GET', endpoint='file.list_files'), 3)
+        self.assertEqual(delta('fileshare_http_request_bytes_total', endpoint='file.upload_file'), len(content))
+        self.assertGreater(delta('fileshare_http_response_bytes_total', endpoint='file.list_files'), 0)
+        # Authentication misses the cache once, then a single listing query per request
+        self.assertEqual(delta('fileshare_db_queries_per_request_sum', endpoint='file.list_files'), 4)
+        self.assertEqual(delta('fileshare_cache_lookups_total', cache='user', result='hit'), 2)
+        self.assertEqual(delta('fileshare_cache_lookups_total', cache='user', result='miss'), 2)
+
+    def test_janitor_metrics(self):
+        """Test janitor runs export what they reclaimed and when they finished"""
+        before = self.scrape()
+        app.config['JANITOR_ORPHAN_GRACE'] = 0
+        orphan = b'stored but never committed'
+
+        with app.app_context():
+            get_storage().put_stream(blob_key(hashlib.sha256(orphan).hexdigest()), io.BytesIO(orphan))
+            run_janitor()  # Report only
+            after_report = self.scrape()
+            run_janitor(reap=True)
+        after = self.scrape()
+
+        def delta(text, name, **labels):
+            return sample(text, name, **labels) - sample(before, name, **labels)
+
+        self.assertEqual(delta(after_report, 'fileshare_janitor_reclaimed_total', task='orphan_blobs'), 0)
+        self.assertEqual(delta(after, 'fileshare_janitor_reclaimed_total', task='orphan_blobs'), 1)
+        self.assertEqual(delta(after, 'fileshare_janitor_reclaimed_bytes_total', task='orphan_blobs'), len(orphan))
+        self.assertGreater(sample(after, 'fileshare_janitor_last_run_timestamp_seconds'), 0)
+
+    def test_metrics_token(self):
+        """Test METRICS_AUTH_TOKEN restricts scraping"""
+        app.config['METRICS_AUTH_TOKEN'] = 'scrape-secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+import io
+import os
+import json
+import zipfile
+import datetime
+import shutil
+from app import create_app, db
+from models import User, UserRole, Blob, File, PreviewStatus
+from previews import generate_preview, preview_key, get_preview_generator
+from storage import get_storage
+from janitor import generate_pending_previews
+from utils import generate_token
+
+app = create_app('config.TestingConfig')
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+A_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+S_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+def package(parts):
+    """Build an OOXML zip from {part name: content}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, content in parts.items():
+            z.writestr(name, content)
+    return buffer.getvalue()
+
+def docx(*paragraphs, thumbnail=None):
+    body = ''.join(f'<w:p><w:r><w:t>{p[:3]}</w:t></w:r><w:r><w:t>{p[3:]}</w:t></w:r></w:p>' for p in paragraphs)
+    parts = {'word/document.xml': f'<w:document xmlns:w="{W_NS}"><w:body>{body}</w:body></w:document>'}
+    if thumbnail:
+        parts['docProps/thumbnail.png'] = thumbnail
+    return package(parts)
+
+def pptx():
+    slide = (f'<p:sld xmlns:p="p" xmlns:a="{A_NS}"><a:p><a:r><a:t>Second slide</a:t></a:r></a:p></p:sld>')
+    return package({
+        'ppt/presentation.xml': f'<p:presentation xmlns:p="p" xmlns:r="{R_NS}"><p:sldIdLst>'
+                                f'<p:sldId id="256" r:id="rId7"/></p:sldIdLst></p:presentation>',
+        'ppt/_rels/presentation.xml.rels': f'<Relationships xmlns="{REL_NS}">'
+                                           f'<Relationship Id="rId7" Target="slides/slide2.xml"/></Relationships>',
+        'ppt/slides/slide1.xml': slide.replace('Second', 'Other'),
+        'ppt/slides/slide2.xml': slide.replace('Second slide', 'Quarterly review'),
+    })
+
+def xlsx():
+    return package({
+        'xl/workbook.xml': f'<workbook xmlns="{S_NS}" xmlns:r="{R_NS}"><sheets>'
+                           f'<sheet name="Totals" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        'xl/_rels/workbook.xml.rels': f'<Relationships xmlns="{REL_NS}">'
+                                      f'<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>',
+        'xl/sharedStrings.xml': f'<sst xmlns="{S_NS}"><si><t>Region</t></si><si><t>Sales</t></si>'
+                                f'<si><t>North</t></si></sst>',
+        'xl/worksheets/sheet1.xml': f'<worksheet xmlns="{S_NS}"><sheetData>'
+                                    f'<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c></row>'
+                                    f'<row r="2"><c r="A2" t="s"><v>2</v></c><c r="C2"><v>42</v></c></row>'
+                                    f'</sheetData></worksheet>',
+    })
+
+class PreviewTestCase(unittest.TestCase):
+    """Test case for file preview generation and the preview endpoint"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_headers = {'Authorization': f'Bearer {generate_token(ops_user.id, ops_user.role)}'}
+            self.client_headers = {'Authorization': f'Bearer {generate_token(client_user.id, client_user.role)}'}
+
+    def tearDown(self):
+        """Clean up after tests"""
+        app.config['PREVIEW_WORKERS'] = 0
+        app.extensions.pop('preview_jobs', None)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self, filename, content):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            headers=self.ops_headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 201)
+        file_id = json.loads(response.data)['file']['id']
+        with app.app_context():
+            return file_id, db.session.get(File, file_id).content_hash
+
+    def generate(self, digest):
+        with app.app_context():
+            return generate_preview(digest)
+
+    def preview(self, file_id, **headers):
+        return self.client.get(f'/api/files/{file_id}/preview', headers=dict(self.client_headers, **headers))
+
+    def test_embedded_thumbnail(self):
+        """Test the package thumbnail is served as the preview, cacheable and revalidatable"""
+        file_id, digest = self.upload('letter.docx', docx('Dear reader', thumbnail=PNG))
+        self.assertEqual(self.preview(file_id).status_code, 202)
+
+        self.assertEqual(self.generate(digest), PreviewStatus.READY)
+        response = self.preview(file_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.data, PNG)
+        self.assertIn('max-age', response.headers['Cache-Control'])
+
+        response = self.preview(file_id, **{'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_summaries(self):
+        """Test text summaries of documents and slides and a table of the first sheet"""
+        doc_id, doc_digest = self.upload('notes.docx', docx('First paragraph', 'Second paragraph'))
+        ppt_id, ppt_digest = self.upload('deck.pptx', pptx())
+        xls_id, xls_digest = self.upload('sales.xlsx', xlsx())
+        for digest in (doc_digest, ppt_digest, xls_digest):
+            self.assertEqual(self.generate(digest), PreviewStatus.READY)
+
+        summary = json.loads(self.preview(doc_id).data)
+        self.assertEqual(summary, {'kind': 'text', 'text': 'First paragraph\nSecond paragraph'})
+        self.assertEqual(json.loads(self.preview(ppt_id).data)['text'], 'Quarterly review')
+        self.assertEqual(json.loads(self.preview(xls_id).data),
+                         {'kind': 'table', 'sheet': 'Totals', 'rows': [['Region', 'Sales'], ['North', '', '42']]})
+
+    def test_unreadable_file(self):
+        """Test content that is not an OOXML package has no preview"""
+        file_id, digest = self.upload('broken.docx', b'not a zip file')
+        self.assertEqual(self.generate(digest), PreviewStatus.UNAVAILABLE)
+        self.assertEqual(self.preview(file_id).status_code, 404)
+
+    def test_delete_removes_preview(self):
+        """Test deleting the last reference to content also deletes its preview"""
+        file_id, digest = self.upload('letter.docx', docx('Dear reader'))
+        self.generate(digest)
+        with app.app_context():
+            storage = get_storage()
+            self.assertTrue(storage.exists(preview_key(digest)))
+            self.client.delete(f'/api/files/{file_id}', headers=self.ops_headers)
+            self.assertFalse(storage.exists(preview_key(digest)))
+
+    def test_background_generation(self):
+        """Test uploads queue generation on the worker pool"""
+        app.config['PREVIEW_WORKERS'] = 1
+        file_id, digest = self.upload('letter.docx', docx('Dear reader'))
+        with app.app_context():
+            get_preview_generator().executor.shutdown(wait=True)
+        self.assertEqual(json.loads(self.preview(file_id).data)['text'], 'Dear reader')
+
+    def test_janitor_generates_pending(self):
+        """Test the janitor picks up previews the upload path never generated"""
+        file_id, digest = self.upload('letter.docx', docx('Dear reader'))
+        with app.app_context():
+            self.assertEqual(generate_pending_previews(10), 0)  # Too recent
+            blob = db.session.get(Blob, digest)
+            blob.created_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            db.session.commit()
+            self.assertEqual(generate_pending_previews(10), 1)
+            self.assertEqual(db.session.get(Blob, digest).preview_status, PreviewStatus.READY)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+import os
+import re
+import json
+import time
+import shutil
+from app import create_app, db
+from config import TestingConfig
+from models import User, UserRole
+from utils import generate_token
+from profiling import ProfilerMiddleware, StackSampler, _cprofile_lock
+
+class ProfilingTestingConfig(TestingConfig):
+    PROFILE_ENABLED = True
+    PROFILE_TOKEN = 'profile-secret'
+    PROFILE_DIR = 'test_profiles'
+
+app = create_app(ProfilingTestingConfig)
+profiler = app.wsgi_app.app  # Inside ProxyFix
+
+class ProfilingTestCase(unittest.TestCase):
+    """Test case for per-request profiling"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        with app.app_context():
+            db.create_all()
+
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add(client_user)
+            db.session.commit()
+
+            self.client_token = generate_token(client_user.id, client_user.role)
+
+    def tearDown(self):
+        """Clean up after tests"""
+        profiler.mode = 'cprofile'
+        profiler.sample_rate = 0
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['PROFILE_DIR'], ignore_errors=True)
+
+    def list_files(self, **headers):
+        response = self.client.get('/api/files', headers=dict(headers, Authorization=f'Bearer {self.client_token}'))
+        # Like a WSGI server, close the body once sent; that is when the profile is written
+        response.close()
+        return response
+
+    def test_disabled_by_default(self):
+        """Test the middleware is not installed unless PROFILE_ENABLED"""
+        self.assertNotIsInstance(create_app('config.TestingConfig').wsgi_app.app, ProfilerMiddleware)
+
+    def test_requires_token_or_sampling(self):
+        """Test requests are only profiled with the right header or when sampled"""
+        for headers in ({}, {'X-Profile': 'wrong'}):
+            response = self.list_files(**headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertFalse(os.path.exists(app.config['PROFILE_DIR']))
+
+        profiler.sample_rate = 1.0
+        self.assertIn('X-Profile-Id', self.list_files().headers)
+
+    def test_cprofile_with_sql_timeline(self):
+        """Test a cProfile dump and the SQL statement timeline are written"""
+        response = self.list_files(**{'X-Profile': 'profile-secret'})
+        self.assertEqual(response.status_code, 200)
+        base = os.path.join(app.config['PROFILE_DIR'], response.headers['X-Profile-Id'])
+
+        self.assertTrue(os.path.getsize(base + '.prof'))
+        with open(base + '.json') as f:
+            report = json.load(f)
+        self.assertEqual((report['path'], report['status']), ('/api/files', 200))
+        # Authenticating the caller, the listing page, and the change feed cursor an empty page cannot carry
+        self.assertEqual(len(report['queries']), 3)
+        self.assertIn('FROM files', report['queries'][1]['statement'])
+        self.assertLessEqual(report['queries'][0]['offset_ms'], report['queries'][1]['offset_ms'])
+
+    def test_concurrent_cprofile_falls_back_to_sampling(self):
+        """Test a request arriving during another cProfile capture is sampled instead"""
+        with _cprofile_lock:
+            response = self.list_files(**{'X-Profile': 'profile-secret'})
+        self.assertEqual(response.status_code, 200)
+        base = os.path.join(app.config['PROFILE_DIR'], response.headers['X-Profile-Id'])
+        self.assertTrue(os.path.exists(base + '.collapsed'))
+        self.assertFalse(os.path.exists(base + '.prof'))
+
+        # A finished capture releases the lock
+        response = self.list_files(**{'X-Profile': 'profile-secret'})
+        base = os.path.join(app.config['PROFILE_DIR'], response.headers['X-Profile-Id'])
+        self.assertTrue(os.path.exists(base + '.prof'))
+        self.assertFalse(_cprofile_lock.locked())
+
+    def test_sampling_writes_folded_stacks(self):
+        """Test sampling mode writes flamegraph folded stacks"""
+        profiler.mode = 'sampling'
+        profiler.interval = 0.0005
+        response = self.list_files(**{'X-Profile': 'profile-secret'})
+        base = os.path.join(app.config['PROFILE_DIR'], response.headers['X-Profile-Id'])
+
+        with open(base + '.collapsed') as f:
+            for line in f.read().splitlines():
+                self.assertRegex(line, r'^\S.*;.* \d+$')
+
+        # A fast request may see few samples, so check stack capture on a known busy loop
+        sampler = StackSampler(0.001)
+        sampler.start()
+        deadline = time.monotonic() + 0.1
+        while time.monotonic() < deadline:
+            pass
+        sampler.stop()
+        leaf = ('test_sampling_writes_folded_stacks (test_profiling.py:'
+                f'{self.test_sampling_writes_folded_stacks.__code__.co_firstlineno})')
+        busy = sum(count for stack, count in sampler.stacks.items() if stack.endswith(leaf))
+        self.assertGreater(busy, sum(sampler.stacks.values()) / 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+import io
+import os
+import json
+import shutil
+from sqlalchemy import event
+from app import create_app, db
+from config import TestingConfig
+from models import User, File, UserRole
+from utils import generate_token
+from response_cache import get_response_cache
+
+class ResponseCacheTestingConfig(TestingConfig):
+    RESPONSE_CACHE_ENABLED = True
+
+app = create_app(ResponseCacheTestingConfig)
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Test case for the file listing and details response cache"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['RESPONSE_CACHE_URL'] = None
+        self.client = app.test_client()
+        # Ids are reused across tests, so start with empty caches
+        app.extensions.pop('user_cache', None)
+        app.extensions.pop('response_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_headers = {'Authorization': f'Bearer {generate_token(ops_user.id, ops_user.role)}'}
+            self.client_headers = {'Authorization': f'Bearer {generate_token(client_user.id, client_user.role)}'}
+            self.engine = db.engine
+
+        self.file_id = self.upload('first.docx')
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self, filename):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(filename.encode()), filename)},
+            headers=self.ops_headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.data)['file']['id']
+
+    def count_statements(self, path, **headers):
+        """Request path as the client user; returns (response, SQL statements issued)"""
+        statements = []
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get(path, headers=dict(self.client_headers, **headers))
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+        return response, len(statements)
+
+    def filenames(self, response):
+        return [f['filename'] for f in json.loads(response.data)['files']]
+
+    def test_repeated_listing_skips_database(self):
+        """Test repeated listings and details are served without any SQL"""
+        first, _ = self.count_statements('/api/files?limit=10')
+        second, queries = self.count_statements('/api/files?limit=10')
+        self.assertEqual(queries, 0)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+        # Different arguments are a different entry
+        _, queries = self.count_statements('/api/files?limit=5')
+        self.assertEqual(queries, 1)
+
+        self.count_statements(f'/api/files/{self.file_id}')
+        details, queries = self.count_statements(f'/api/files/{self.file_id}')
+        self.assertEqual(queries, 0)
+        self.assertEqual(json.loads(details.data)['file']['filename'], 'first.docx')
+
+    def test_encoded_arguments_are_distinct(self):
+        """Test an argument value containing & and = does not share an entry with real arguments"""
+        self.client.get('/api/files?file_type=docx%26uploader%3Dtestops', headers=self.client_headers)
+        response = self.client.get('/api/files?file_type=docx&uploader=testops', headers=self.client_headers)
+        self.assertEqual(self.filenames(response), ['first.docx'])
+
+    def test_local_ttl_is_capped(self):
+        """Test entries expire quickly without a shared tier, since other workers cannot invalidate them"""
+        with app.app_context():
+            self.assertEqual(get_response_cache().ttl, app.config['RESPONSE_CACHE_LOCAL_TTL'])
+            app.config['RESPONSE_CACHE_URL'] = 'memory://'
+            app.extensions.pop('response_cache', None)
+            self.assertEqual(get_response_cache().ttl, app.config['RESPONSE_CACHE_TTL'])
+
+    def test_conditional_request(self):
+        """Test a matching If-None-Match gets an empty 304"""
+        etag = self.client.get('/api/files', headers=self.client_headers).headers['ETag']
+        response, queries = self.count_statements('/api/files', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(queries, 0)
+
+    def test_writes_invalidate(self):
+        """Test uploads, deletes and bulk deletes make the next listing fresh"""
+        etag = self.client.get('/api/files', headers=self.client_headers).headers['ETag']
+
+        second_id = self.upload('second.docx')
+        response = self.client.get('/api/files', headers=dict(self.client_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.filenames(response), ['second.docx', 'first.docx'])
+
+        self.client.delete(f'/api/files/{second_id}', headers=self.ops_headers)
+        response = self.client.get('/api/files', headers=self.client_headers)
+        self.assertEqual(self.filenames(response), ['first.docx'])
+        # Same files as at first, but a newer change feed cursor
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.client.get(f'/api/files/{second_id}', headers=self.client_headers).status_code, 404)
+
+        with app.app_context():
+            File.query.filter_by(id=self.file_id).delete()
+            db.session.commit()
+        self.assertEqual(self.filenames(self.client.get('/api/files', headers=self.client_headers)), [])
+
+    def test_shared_tier(self):
+        """Test entries and the generation live in the shared tier, surviving a cold local tier"""
+        app.config['RESPONSE_CACHE_URL'] = 'memory://'
+        app.extensions.pop('response_cache', None)
+
+        self.client.get('/api/files', headers=self.client_headers)
+        with app.app_context():
+            cache = app.extensions['response_cache']
+            cache.local.clear()
+            generation = cache.generation()
+
+        response, queries = self.count_statements('/api/files')
+        self.assertEqual(queries, 0)
+        self.assertEqual(self.filenames(response), ['first.docx'])
+
+        self.upload('second.docx')
+        self.assertEqual(cache.generation(), generation + 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+import io
+import os
+import re
+import json
+import shutil
+from urllib.parse import urlsplit
+from sqlalchemy import event, text
+from app import create_app, db
+from models import User, UserRole, File
+from utils import generate_token
+
+app = create_app('config.TestingConfig')
+
+try:
+    from alembic.migration import MigrationContext
+    from alembic.autogenerate import compare_metadata
+    from database import upgrade_schema, include_object
+except ImportError:
+    MigrationContext = None
+
+HOT_TABLES = ('users', 'files', 'download_tokens')
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Test case checking the hot request paths are served by indexes"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache and rate limits
+        app.extensions.pop('user_cache', None)
+        app.extensions.pop('rate_limiters', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            db.session.add(ops_user)
+            db.session.commit()
+
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.engine = db.engine
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def capture(self, requests):
+        """Run requests() and return the SELECT statements it sent, with their parameters"""
+        statements = []
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(self.engine, 'before_cursor_execute', record)
+        try:
+            requests()
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', record)
+        return statements
+
+    def assert_indexed(self, statements):
+        """Assert no statement scans a hot table without an index or sorts in a temp b-tree"""
+        self.assertTrue(statements)
+        with self.engine.connect() as connection:
+            for statement, parameters in statements:
+                plan = [row[3] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+                for step in plan:
+                    table_scan = re.fullmatch(r'SCAN (\w+)', step)
+                    self.assertFalse(table_scan and table_scan.group(1) in HOT_TABLES,
+                                     f'Full table scan in {plan} for {statement}')
+                    self.assertNotIn('TEMP B-TREE', step, f'Sort without an index in {plan} for {statement}')
+
+    def test_signup_verification_uses_index(self):
+        """Test the email verification lookup uses the verification token index"""
+        response = self.client.post('/api/signup', json={
+            'username': 'newclient', 'email': 'newclient@example.com', 'password': 'password123'})
+        self.assertEqual(response.status_code, 201)
+        path = urlsplit(json.loads(response.data)['verification_url']).path
+
+        statements = self.capture(lambda: self.client.get(path))
+        self.assert_indexed(statements)
+        with self.engine.connect() as connection:
+            plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statements[0][0], statements[0][1]).all()
+        self.assertIn('ix_users_verification_token', plan[0][3])
+
+    def test_listing_and_download_use_indexes(self):
+        """Test file listings and download token redemption avoid scans and sorts"""
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(b'test content'), 'test.docx')},
+            headers={'Authorization': f'Bearer {self.ops_token}'},
+            content_type='multipart/form-data'
+        )
+        file_id = json.loads(response.data)['file']['id']
+
+        client = User(username='testclient', email='testclient@example.com',
+                      role=UserRole.CLIENT, is_verified=True, password_hash='x')
+        with app.app_context():
+            db.session.add(client)
+            db.session.commit()
+            headers = {'Authorization': f'Bearer {generate_token(client.id, client.role)}'}
+
+        def requests():
+            for query in ('', '?sort=file_size&order=asc', '?uploader=testops', '?file_type=docx'):
+                self.assertEqual(self.client.get(f'/api/files{query}', headers=headers).status_code, 200)
+            response = self.client.get(f'/api/download-file/{file_id}', headers=headers)
+            link = urlsplit(json.loads(response.data)['download-link']).path
+            self.assertEqual(self.client.get(link, headers=headers).status_code, 200)
+
+        self.assert_indexed(self.capture(requests))
+
+@unittest.skipUnless(MigrationContext, "alembic is not installed")
+class MigrationTestCase(unittest.TestCase):
+    """Test case for the Alembic migrations"""
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+            with db.engine.begin() as connection:
+                connection.execute(text('DROP TABLE IF EXISTS alembic_version'))
+
+    def test_migrations_match_models(self):
+        """Test upgrading an empty database gives exactly the schema the models declare"""
+        with app.app_context():
+            upgrade_schema()
+            with db.engine.connect() as connection:
+                self.assertEqual(compare_metadata(MigrationContext.configure(connection, opts={'include_object': include_object}),
+                                                  db.metadata), [])
+
+    def test_legacy_database_is_upgraded(self):
+        """Test a database created by init-db before migrations gets every later column, table and index"""
+        with app.app_context():
+            # The pre-migration schema, unversioned, with a file uploaded back then
+            upgrade_schema('0001')
+            with db.engine.begin() as connection:
+                connection.execute(text('DROP TABLE alembic_version'))
+                connection.execute(text(
+                    "INSERT INTO users (id, username, email, password_hash, role, is_verified) "
+                    "VALUES (1, 'legacy', 'legacy@example.com', 'x', 'OPERATIONS', 1)"))
+                connection.execute(text(
+                    "INSERT INTO files (id, filename, original_filename, file_path, file_type, file_size, "
+                    "uploader_id, uploaded_at) VALUES (1, 'a.docx', 'a.docx', '/tmp/a.docx', 'docx', 5, 1, "
+                    "'2024-01-01 00:00:00')"))
+
+            upgrade_schema()
+            files = File.query.all()
+            self.assertEqual([(f.original_filename, f.content_hash) for f in files], [('a.docx', None)])
+            with db.engine.connect() as connection:
+                self.assertEqual(MigrationContext.configure(connection).get_current_revision(), '0011')
+                self.assertEqual(compare_metadata(MigrationContext.configure(connection, opts={'include_object': include_object}),
+                                                  db.metadata), [])
+
+if __name__ == '__main__':
+    unittest.main()
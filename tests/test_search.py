@@ -0,0 +1,192 @@
+import unittest
+import io
+import os
+import json
+import zipfile
+import datetime
+import shutil
+from app import create_app, db
+from models import User, UserRole, File
+from search import index_files, reindex, unindexed_files
+from janitor import index_pending_files
+from utils import generate_token
+
+app = create_app('config.TestingConfig')
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+A_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+S_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+def package(parts):
+    """Build an OOXML zip from {part name: content}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, content in parts.items():
+            z.writestr(name, content)
+    return buffer.getvalue()
+
+def docx(*paragraphs):
+    body = ''.join(f'<w:p><w:r><w:t>{p}</w:t></w:r></w:p>' for p in paragraphs)
+    return package({'word/document.xml': f'<w:document xmlns:w="{W_NS}"><w:body>{body}</w:body></w:document>'})
+
+def pptx(*slides):
+    return package(dict(
+        {'ppt/presentation.xml': '<p:presentation xmlns:p="p"/>'},
+        **{f'ppt/slides/slide{i}.xml': f'<p:sld xmlns:p="p" xmlns:a="{A_NS}"><a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+           for i, text in enumerate(slides, 1)}
+    ))
+
+def xlsx(sheet, *strings):
+    return package({
+        'xl/workbook.xml': f'<workbook xmlns="{S_NS}"><sheets><sheet name="{sheet}" sheetId="1"/></sheets></workbook>',
+        'xl/sharedStrings.xml': f'<sst xmlns="{S_NS}">' + ''.join(f'<si><t>{s}</t></si>' for s in strings) + '</sst>',
+    })
+
+class SearchTestCase(unittest.TestCase):
+    """Test case for full-text search indexing and the search endpoint"""
+
+    def setUp(self):
+        """Set up test environment"""
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_headers = {'Authorization': f'Bearer {generate_token(ops_user.id, ops_user.role)}'}
+            self.client_headers = {'Authorization': f'Bearer {generate_token(client_user.id, client_user.role)}'}
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload(self, filename, content, index=True):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), filename)},
+            headers=self.ops_headers,
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 201)
+        file_id = json.loads(response.data)['file']['id']
+        if index:
+            # SEARCH_WORKERS is 0 in tests, so index as the background job would
+            with app.app_context():
+                self.assertEqual(index_files([file_id]), 1)
+        return file_id
+
+    def search(self, query, status=200, **params):
+        response = self.client.get('/api/files/search', query_string=dict(params, q=query),
+                                   headers=self.client_headers)
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.data)
+
+    def ids(self, query, **params):
+        return [hit['file']['id'] for hit in self.search(query, **params)['results']]
+
+    def test_searches_document_contents(self):
+        """Test the text of documents, slides and spreadsheets is found, with highlighted snippets"""
+        report = self.upload('report.docx', docx('Annual budget forecast', 'Prepared by &lt;finance&gt;'))
+        deck = self.upload('deck.pptx', pptx('Welcome', 'Quarterly budgets'))
+        sheet = self.upload('sheet.xlsx', xlsx('Inventory', 'Warehouse', 'Pallets'))
+
+        self.assertCountEqual(self.ids('budget'), [report, deck])  # Stemmed: budgets matches too
+        self.assertEqual(self.ids('inventory pallets'), [sheet])
+        self.assertEqual(self.ids('annual quarterly'), [])  # Every word must match
+
+        hit = self.search('forecast')['results'][0]
+        self.assertEqual(hit['file']['filename'], 'report.docx')
+        self.assertIn('<mark>forecast</mark>', hit['snippet'])
+        self.assertGreater(hit['score'], 0)
+        self.assertIn('&lt;<mark>finance</mark>&gt;', self.search('finance')['results'][0]['snippet'])
+
+    def test_filename_ranks_first(self):
+        """Test a match in the file name outranks one in the content"""
+        in_content = self.upload('notes.docx', docx('Minutes of the merger meeting'))
+        in_name = self.upload('merger.docx', docx('Nothing to see'))
+
+        self.assertEqual(self.ids('merger'), [in_name, in_content])
+
+    def test_pagination(self):
+        """Test results are paged and deep pages are refused"""
+        file_ids = [self.upload(f'memo{i}.docx', docx(f'Shared memo number {i}')) for i in range(5)]
+
+        first = self.search('memo', limit=2)
+        second = self.search('memo', limit=2, page=2)
+        third = self.search('memo', limit=2, page=3)
+        self.assertEqual((first['next_page'], second['next_page'], third['next_page']), (2, 3, None))
+        found = [hit['file']['id'] for page in (first, second, third) for hit in page['results']]
+        self.assertCountEqual(found, file_ids)
+
+        self.search('memo', status=400, page=0)
+        self.search('memo', status=400, limit=100, page=11)
+
+    def test_query_syntax_is_not_interpreted(self):
+        """Test operators and punctuation in a query are treated as plain words"""
+        file_id = self.upload('plan.docx', docx('Launch and plan NEAR final'))
+
+        self.assertEqual(self.ids('"launch" AND (plan*'), [file_id])
+        self.assertEqual(self.ids('near: final -'), [file_id])
+        self.search('*:"()', status=400)
+        self.search('', status=400)
+
+    def test_deleted_files_leave_the_index(self):
+        """Test a deleted file is no longer found"""
+        file_id = self.upload('secret.docx', docx('Confidential roadmap'))
+        self.assertEqual(self.ids('roadmap'), [file_id])
+
+        response = self.client.delete(f'/api/files/{file_id}', headers=self.ops_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ids('roadmap'), [])
+        with app.app_context():
+            # Indexing a file deleted meanwhile adds nothing
+            self.assertEqual(index_files([file_id]), 0)
+        self.assertEqual(self.ids('roadmap'), [])
+
+    def test_janitor_and_reindex(self):
+        """Test files the background pool missed are indexed by the janitor and by reindex"""
+        old = self.upload('old.docx', docx('Archived contract'), index=False)
+        new = self.upload('new.docx', docx('Archived invoice'), index=False)
+        self.assertEqual(self.ids('archived'), [])
+
+        with app.app_context():
+            file = db.session.get(File, old)
+            file.uploaded_at = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+            db.session.commit()
+
+            # Only files past SEARCH_RETRY_AFTER
+            self.assertEqual(index_pending_files(10), 1)
+            self.assertEqual(unindexed_files(10), [new])
+            self.assertEqual(reindex(missing_only=True), 1)
+            self.assertEqual(unindexed_files(10), [])
+            self.assertEqual(reindex(), 2)
+
+        self.assertCountEqual(self.ids('archived'), [old, new])
+
+    def test_duplicate_content_reuses_text(self):
+        """Test a second upload of the same content is indexed under its own name"""
+        content = docx('Shared specification')
+        first = self.upload('spec.docx', content)
+        second = self.upload('copy.docx', content)
+
+        self.assertCountEqual(self.ids('specification'), [first, second])
+        self.assertEqual(self.ids('copy'), [second])
+
+if __name__ == '__main__':
+    unittest.main()
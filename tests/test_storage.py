@@ -0,0 +1,174 @@
+import unittest
+import io
+import os
+import json
+import shutil
+import hashlib
+from app import create_app, db
+from models import User, UserRole
+from storage import LocalStorage, S3Storage, blob_key
+from utils import generate_token
+
+app = create_app('config.TestingConfig')
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = None
+    mock_aws = None
+
+class StorageBackendTests:
+    """Behaviour shared by every storage backend"""
+
+    def test_put_and_read(self):
+        """Test storing a local file and reading it back whole and by range"""
+        path = os.path.join(self.spool_dir, 'spool')
+        with open(path, 'wb') as f:
+            f.write(b'0123456789')
+
+        key = blob_key(hashlib.sha256(b'0123456789').hexdigest())
+        self.storage.put_file(key, path)
+
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(self.storage.exists(key))
+        self.assertEqual(self.storage.size(key), 10)
+        self.assertEqual(b''.join(self.storage.open(key)), b'0123456789')
+        self.assertEqual(b''.join(self.storage.open(key, 2, 5)), b'2345')
+        self.assertEqual(b''.join(self.storage.open(key, 7, None, chunk_size=1)), b'789')
+
+    def test_put_stream_and_delete(self):
+        """Test streaming writes and deletes"""
+        self.storage.put_stream('aa/bb/streamed', io.BytesIO(b'streamed content'))
+        self.assertEqual(b''.join(self.storage.open('aa/bb/streamed')), b'streamed content')
+
+        self.storage.delete('aa/bb/streamed')
+        self.assertFalse(self.storage.exists('aa/bb/streamed'))
+
+
+class LocalStorageTestCase(StorageBackendTests, unittest.TestCase):
+    """Test case for the local filesystem backend"""
+
+    def setUp(self):
+        self.spool_dir = 'test_storage'
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.storage = LocalStorage(self.spool_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def test_no_presigned_urls(self):
+        """Test the local backend serves bytes itself"""
+        self.assertIsNone(self.storage.presigned_url('aa/bb/x', 'x.docx', 60))
+        self.assertEqual(self.storage.local_path('aa/bb/x'), os.path.join(self.spool_dir, 'aa', 'bb', 'x'))
+
+
+@unittest.skipUnless(mock_aws, 'boto3 and moto are required for S3 backend tests')
+class S3StorageTestCase(StorageBackendTests, unittest.TestCase):
+    """Test case for the S3-compatible backend against a moto mock"""
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        self.storage = S3Storage('test-bucket', prefix='blobs', client=client)
+
+        self.spool_dir = 'test_storage'
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def test_presigned_url(self):
+        """Test presigned URLs point at the prefixed object"""
+        url = self.storage.presigned_url('aa/bb/x', 'Q1 report.xlsx', 60)
+        self.assertIn('test-bucket', url)
+        self.assertIn('blobs/aa/bb/x', url)
+        self.assertEqual(self.storage.location('aa/bb/x'), 's3://test-bucket/blobs/aa/bb/x')
+
+
+@unittest.skipUnless(mock_aws, 'boto3 and moto are required for S3 backend tests')
+class S3DownloadTestCase(unittest.TestCase):
+    """Test case for uploading and downloading through the S3 backend"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['UPLOAD_FOLDER'] = 'test_uploads'
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        self.mock = mock_aws()
+        self.mock.start()
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='test-bucket')
+        app.extensions['storage'] = S3Storage('test-bucket', client=s3)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(username='testops', email='testops@example.com',
+                            role=UserRole.OPERATIONS, is_verified=True)
+            ops_user.set_password('password123')
+            client_user = User(username='testclient', email='testclient@example.com',
+                               role=UserRole.CLIENT, is_verified=True)
+            client_user.set_password('password123')
+            db.session.add_all([ops_user, client_user])
+            db.session.commit()
+
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.client_token = generate_token(client_user.id, client_user.role)
+
+    def tearDown(self):
+        app.extensions.pop('storage', None)
+        app.config['STORAGE_PRESIGNED_DOWNLOADS'] = False
+        self.mock.stop()
+
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def upload_and_get_link(self, content):
+        response = self.client.post(
+            '/api/upload',
+            data={'file': (io.BytesIO(content), 'deck.pptx')},
+            headers={'Authorization': f'Bearer {self.ops_token}'},
+            content_type='multipart/form-data'
+        )
+        self.assertEqual(response.status_code, 201)
+        file_id = json.loads(response.data)['file']['id']
+
+        response = self.client.get(
+            f'/api/download-file/{file_id}',
+            headers={'Authorization': f'Bearer {self.client_token}'}
+        )
+        return json.loads(response.data)['download-link']
+
+    def test_download_streams_from_bucket(self):
+        """Test downloads are streamed from the bucket and nothing stays on local disk"""
+        content = os.urandom(4096)
+        link = self.upload_and_get_link(content)
+
+        stored = [n for _, _, names in os.walk(app.config['UPLOAD_FOLDER']) for n in names]
+        self.assertEqual(stored, [])
+
+        response = self.client.get(link, headers={'Authorization': f'Bearer {self.client_token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        self.assertIn('deck.pptx', response.headers['Content-Disposition'])
+
+    def test_download_presigned_redirect(self):
+        """Test downloads can be redirected to a presigned bucket URL"""
+        app.config['STORAGE_PRESIGNED_DOWNLOADS'] = True
+        link = self.upload_and_get_link(b'redirected')
+
+        response = self.client.get(link, headers={'Authorization': f'Bearer {self.client_token}'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('test-bucket', response.headers['Location'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import json
+import os
+import shutil
+import hashlib
+import datetime
+from app import create_app, db
+from models import User, File, UserRole, UploadSession
+from utils import generate_token, purge_expired_upload_sessions
+
+app = create_app('config.TestingConfig')
+
+class ResumableUploadTestCase(unittest.TestCase):
+    """Test case for the resumable (chunked) upload protocol"""
+
+    def setUp(self):
+        """Set up test environment"""
+        app.config['TESTING'] = True
+        app.config['UPLOAD_FOLDER'] = 'test_uploads'
+        app.config['UPLOAD_SESSION_MIN_CHUNK_SIZE'] = 4
+        self.client = app.test_client()
+        # User ids are reused across tests, so start with an empty principal cache
+        app.extensions.pop('user_cache', None)
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        with app.app_context():
+            db.create_all()
+
+            ops_user = User(
+                username='testops',
+                email='testops@example.com',
+                role=UserRole.OPERATIONS,
+                is_verified=True
+            )
+            ops_user.set_password('password123')
+
+            other_ops_user = User(
+                username='otherops',
+                email='otherops@example.com',
+                role=UserRole.OPERATIONS,
+                is_verified=True
+            )
+            other_ops_user.set_password('password123')
+
+            db.session.add_all([ops_user, other_ops_user])
+            db.session.commit()
+
+            self.ops_user_id = ops_user.id
+            self.ops_token = generate_token(ops_user.id, ops_user.role)
+            self.other_token = generate_token(other_ops_user.id, other_ops_user.role)
+
+        self.headers = {'Authorization': f'Bearer {self.ops_token}'}
+        self.content = os.urandom(10 * 1024 + 5)
+        self.chunk_size = 4096
+
+    def tearDown(self):
+        """Clean up after tests"""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+        shutil.rmtree(app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    def start_session(self, **extra):
+        payload = {
+            'filename': 'quarterly.xlsx',
+            'file_size': len(self.content),
+            'chunk_size': self.chunk_size
+        }
+        payload.update(extra)
+        response = self.client.post(
+            '/api/uploads',
+            data=json.dumps(payload),
+            headers=self.headers,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.data)['upload']
+
+    def put_chunk(self, upload_id, index, headers=None):
+        body = self.content[index * self.chunk_size:(index + 1) * self.chunk_size]
+        return self.client.put(
+            f'/api/uploads/{upload_id}/chunks/{index}',
+            data=body,
+            headers=dict(self.headers, **(headers or {})),
+            content_type='application/octet-stream'
+        )
+
+    def test_chunked_upload_out_of_order(self):
+        """Test uploading chunks in any order, resuming and finalizing"""
+        upload = self.start_session(sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(upload['total_chunks'], 3)
+
+        self.assertEqual(self.put_chunk(upload['id'], 2).status_code, 200)
+        self.assertEqual(self.put_chunk(upload['id'], 0).status_code, 200)
+
+        # Finalizing with a missing chunk is refused
+        response = self.client.post(f'/api/uploads/{upload["id"]}/complete', headers=self.headers)
+        self.assertEqual(response.status_code, 409)
+
+        # The client learns which chunks to resend after an interruption
+        response = self.client.get(f'/api/uploads/{upload["id"]}', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['received_chunks'], [0, 2])
+
+        self.assertEqual(self.put_chunk(upload['id'], 1).status_code, 200)
+
+        response = self.client.post(f'/api/uploads/{upload["id"]}/complete', headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data['file']['filename'], 'quarterly.xlsx')
+        self.assertEqual(data['file']['file_size'], len(self.content))
+
+        with app.app_context():
+            file = File.query.filter_by(original_filename='quarterly.xlsx').first()
+            self.assertEqual(file.content_hash, hashlib.sha256(self.content).hexdigest())
+            with open(file.file_path, 'rb') as f:
+                self.assertEqual(f.read(), self.content)
+            self.assertEqual(UploadSession.query.count(), 0)
+
+    def test_chunk_validation(self):
+        """Test wrong sizes, bad checksums and out of range chunks are rejected"""
+        upload = self.start_session()
+
+        response = self.client.put(
+            f'/api/uploads/{upload["id"]}/chunks/0',
+            data=b'short',
+            headers=self.headers,
+            content_type='application/octet-stream'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = self.put_chunk(upload['id'], 0, headers={'X-Chunk-SHA256': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.put_chunk(upload['id'], 7)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(f'/api/uploads/{upload["id"]}', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['received_chunks'], [])
+
+    def test_session_belongs_to_uploader(self):
+        """Test another user cannot see or write to an upload session"""
+        upload = self.start_session()
+
+        response = self.client.get(
+            f'/api/uploads/{upload["id"]}',
+            headers={'Authorization': f'Bearer {self.other_token}'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_abort_and_purge_sessions(self):
+        """Test abandoned sessions are deleted along with their chunks"""
+        aborted = self.start_session()
+        self.put_chunk(aborted['id'], 0)
+        response = self.client.delete(f'/api/uploads/{aborted["id"]}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+        stale = self.start_session()
+        self.put_chunk(stale['id'], 0)
+
+        with app.app_context():
+            upload_session = db.session.get(UploadSession, stale['id'])
+            upload_session.expires_at = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+            db.session.commit()
+
+            self.assertEqual(purge_expired_upload_sessions(), 1)
+            self.assertEqual(UploadSession.query.count(), 0)
+
+        sessions_root = os.path.join(app.config['UPLOAD_FOLDER'], '.sessions')
+        self.assertEqual(os.listdir(sessions_root), [])
+
+if __name__ == '__main__':
+    unittest.main()
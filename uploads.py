@@ -0,0 +1,158 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from flask import Request, current_app, has_app_context
+
+# Streaming upload utilities
+
+class HashingSpoolFile:
+    """Temporary file in the upload folder that counts and hashes bytes as they are written
+
+    The file is created next to its final destination so that a finished
+    upload can be moved into place with an atomic rename instead of a copy.
+    Unless keep() is called the temporary file is removed on close().
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._kept = False
+        self.size = 0
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """SHA-256 of everything written so far"""
+        return self._hash.hexdigest()
+
+    def keep(self):
+        """Close the file and hand its path over to the caller instead of deleting it"""
+        self._file.close()
+        self._kept = True
+        return self.name
+
+    def close(self):
+        self._file.close()
+        if not self._kept and os.path.exists(self.name):
+            os.remove(self.name)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush etc. for consumers such as FileStorage
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Environ key of a request body the server already received into a
+# HashingSpoolFile (asgi.py); raw uploads store it without copying
+SPOOLED_BODY_ENVIRON = 'fileshare.spooled_body'
+
+def spool_stream(stream, directory, chunk_size):
+    """Copy a readable stream into a HashingSpoolFile in fixed-size chunks"""
+    spool = HashingSpoolFile(directory)
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+
+# Resumable upload session storage
+#
+# Parts of a resumable upload live in UPLOAD_FOLDER/.sessions/<session id>/
+# as <index>.chunk files. A part is written to a temporary file first and
+# renamed into place, so a chunk file only exists once it is complete.
+
+SESSIONS_DIRNAME = '.sessions'
+
+def session_dir(upload_folder, session_id):
+    return os.path.join(upload_folder, SESSIONS_DIRNAME, session_id)
+
+def chunk_path(upload_folder, session_id, index):
+    return os.path.join(session_dir(upload_folder, session_id), f'{index}.chunk')
+
+def write_chunk(stream, upload_folder, session_id, index, chunk_size):
+    """Stream one part of a session to disk and return its (size, sha256)"""
+    with spool_stream(stream, session_dir(upload_folder, session_id), chunk_size) as spool:
+        spool.flush()
+        size, digest = spool.size, spool.hexdigest()
+        os.replace(spool.keep(), chunk_path(upload_folder, session_id, index))
+    return size, digest
+
+def discard_chunk(upload_folder, session_id, index):
+    path = chunk_path(upload_folder, session_id, index)
+    if os.path.exists(path):
+        os.remove(path)
+
+def received_chunks(upload_folder, session_id):
+    """Sorted indexes of the completely received parts of a session"""
+    directory = session_dir(upload_folder, session_id)
+    if not os.path.isdir(directory):
+        return []
+    indexes = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == '.chunk' and stem.isdigit():
+            indexes.append(int(stem))
+    return sorted(indexes)
+
+def claim_session_dir(upload_folder, session_id):
+    """Atomically move a session's parts aside for assembly
+
+    Returns the new directory, or None if another request already claimed it,
+    which makes concurrent finalize calls for the same session safe.
+    """
+    directory = session_dir(upload_folder, session_id)
+    claimed = f'{directory}.assembling'
+    try:
+        os.rename(directory, claimed)
+    except OSError:
+        return None
+    return claimed
+
+def assemble_chunks(directory, total_chunks, upload_folder, chunk_size):
+    """Concatenate parts 0..total_chunks-1 into a HashingSpoolFile in upload_folder"""
+    spool = HashingSpoolFile(upload_folder)
+    try:
+        for index in range(total_chunks):
+            with open(os.path.join(directory, f'{index}.chunk'), 'rb') as part:
+                while True:
+                    data = part.read(chunk_size)
+                    if not data:
+                        break
+                    spool.write(data)
+    except Exception:
+        spool.close()
+        raise
+    return spool
+
+def remove_session_dir(directory):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class UploadRequest(Request):
+    """Request that spools multipart file parts straight into the upload folder
+
+    Werkzeug would otherwise buffer each part in memory or /tmp, after which
+    save_file had to copy it again and stat it to learn its size.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not has_app_context():
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return HashingSpoolFile(current_app.config['UPLOAD_FOLDER'])
@@ -1,15 +1,27 @@
 import os
+import json
+import base64
+import hashlib
 import secrets
 import datetime
 import uuid
 from functools import wraps
-from flask import jsonify, request, current_app
+from flask import jsonify, request, current_app, has_app_context
 import jwt
+from sqlalchemy import select, delete, func, tuple_, event
+from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
-from cryptography.fernet import Fernet
-from flask_mail import Message
-from app import mail, db
-from models import User, UserRole, DownloadToken
+from cryptography.fernet import Fernet, InvalidToken
+from app import db
+from mailer import queue_email
+from models import User, UserPrincipal, UserRole, File, Blob, DownloadToken, RedeemedToken, UploadSession
+from uploads import (HashingSpoolFile, spool_stream, session_dir, received_chunks, claim_session_dir,
+                     assemble_chunks, remove_session_dir, SESSIONS_DIRNAME)
+from storage import get_storage, blob_key
+from previews import preview_key, schedule_preview
+from search import schedule_indexing
+from changes import settled_cursor
+from cache import TTLCache
 
 # Authentication utilities
 def generate_token(user_id, role, expiry=None):
@@ -20,7 +32,7 @@ def generate_token(user_id, role, expiry=None):
     payload = {
         'exp': expiry,
         'iat': datetime.datetime.utcnow(),
-        'sub': user_id,
+        'sub': str(user_id),
         'role': role.value
     }
     
@@ -30,8 +42,42 @@ def generate_token(user_id, role, expiry=None):
         algorithm='HS256'
     )
 
+def get_user_cache():
+    """Per-process cache of UserPrincipal snapshots keyed by user id"""
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        cache = current_app.extensions['user_cache'] = TTLCache(
+            current_app.config['USER_CACHE_SIZE'],
+            current_app.config['USER_CACHE_TTL'],
+            name='user'
+        )
+    return cache
+
+def get_user_principal(user_id):
+    """Authenticated user's principal, only querying the database on a cache miss"""
+    cache = get_user_cache()
+    principal = cache.get(user_id)
+    if principal is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        principal = UserPrincipal.from_user(user)
+        cache.set(user_id, principal)
+    return principal
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user_principal(mapper, connection, user):
+    """Drop a changed user from this process's cache; other workers expire it after USER_CACHE_TTL"""
+    if has_app_context() and 'user_cache' in current_app.extensions:
+        current_app.extensions['user_cache'].pop(user.id)
+
 def token_required(f):
-    """Decorator for routes that require a valid token"""
+    """Decorator for routes that require a valid token
+
+    The view receives a cached UserPrincipal (id, username, email, role,
+    is_verified, created_at) rather than a User row.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
@@ -49,7 +95,7 @@ def token_required(f):
                 current_app.config['JWT_SECRET_KEY'], 
                 algorithms=['HS256']
             )
-            current_user = User.query.get(data['sub'])
+            current_user = get_user_principal(int(data['sub']))
             
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 401
@@ -63,6 +109,21 @@ def token_required(f):
         
     return decorated
 
+def read_replica(f):
+    """Decorator for read-only views: their queries go to the replica bind when one is configured
+
+    Replicas lag the primary, so only use it where slightly stale data is
+    acceptable. Anything the view writes still goes to the primary.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        db.session.info['read_replica'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_replica', None)
+    return decorated
+
 def require_role(roles):
     """Decorator to check if user has required role"""
     def decorator(f):
@@ -85,57 +146,460 @@ def save_file(file, uploader_id):
     if not allowed_file(file.filename):
         return None, "File type not allowed"
     
-    # Create upload folder if it doesn't exist
-    os.makedirs(current_app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Multipart parts are already spooled and hashed by UploadRequest
+    spool = file.stream
+    if not isinstance(spool, HashingSpoolFile):
+        spool = spool_stream(
+            file.stream,
+            current_app.config['UPLOAD_FOLDER'],
+            current_app.config['UPLOAD_CHUNK_SIZE']
+        )
+    
+    return store_spooled_file(spool, file.filename, uploader_id)
+
+def save_stream(stream, original_filename, uploader_id, spool=None):
+    """Save a raw request body stream to filesystem and database
+
+    A body the server already spooled to a HashingSpoolFile is passed as
+    spool and stored as is instead of being copied from the stream.
+    """
+    if not original_filename or not allowed_file(original_filename):
+        return None, "File type not allowed"
+    
+    if spool is None:
+        spool = spool_stream(
+            stream,
+            current_app.config['UPLOAD_FOLDER'],
+            current_app.config['UPLOAD_CHUNK_SIZE']
+        )
     
-    # Generate secure filename
-    original_filename = file.filename
-    filename = secure_filename(file.filename)
+    return store_spooled_file(spool, original_filename, uploader_id)
+
+def store_spooled_file(spool, original_filename, uploader_id):
+    """Move a finished HashingSpoolFile into the blob store and create its file record
+
+    Content that is already stored only gains a reference: the spool is
+    discarded and nothing is written a second time.
+    """
+    filename = secure_filename(original_filename)
     file_extension = filename.rsplit('.', 1)[1].lower()
-    unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
+    digest = spool.hexdigest()
+    storage = get_storage()
+    
+    for attempt in range(2):
+        created = False
+        try:
+            created, file_path = acquire_blob(spool, storage, digest)
+            
+            # Create file record in database
+            file_record = File(
+                filename=f"{digest}.{file_extension}",
+                original_filename=original_filename,
+                file_path=file_path,
+                file_type=file_extension,
+                file_size=spool.size,
+                content_hash=digest,
+                uploader_id=uploader_id
+            )
+            db.session.add(file_record)
+            db.session.commit()
+            spool.close()
+            if created:
+                schedule_preview(digest)
+            schedule_indexing(file_record.id)
+            return file_record, None
+        except IntegrityError:
+            # A concurrent upload inserted the same blob first; take a reference to it instead
+            db.session.rollback()
+            if attempt:
+                spool.close()
+                return None, "Could not store file, please retry"
+        except Exception as e:
+            db.session.rollback()
+            spool.close()
+            # Only remove content nobody else references
+            if created and not db.session.get(Blob, digest):
+                storage.delete(blob_key(digest))
+            return None, str(e)
+
+def acquire_blob(spool, storage, digest):
+    """Take a reference to the blob for digest, storing the spool if it is new
+
+    Returns (created, location). Must be followed by a commit.
+    """
+    key = blob_key(digest)
+    blob = db.session.get(Blob, digest, with_for_update=True)
+    
+    if blob:
+        blob.ref_count = Blob.ref_count + 1
+        if storage.exists(key):
+            return False, storage.location(key)
+        # The row survived but its content went missing; heal it with this upload
+    else:
+        db.session.add(Blob(hash=digest, size=spool.size, ref_count=1))
+        db.session.flush()
     
-    # Save file to disk
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(file_path)
+    storage.put_file(key, spool.keep())
+    return True, storage.location(key)
+
+def release_blob(file_record):
+    """Drop a file's blob reference in the caller's transaction
+
+    Returns True when that was the last reference: once the transaction has
+    committed, unlink_content() deletes the stored bytes. Nothing is unlinked
+    before the commit, so a failed commit loses no content.
+    """
+    if not file_record.content_hash:
+        # Legacy upload stored outside the blob store
+        return True
+    
+    blob = db.session.get(Blob, file_record.content_hash, with_for_update=True)
+    if not blob:
+        return False
+    
+    if blob.ref_count > 1:
+        blob.ref_count = Blob.ref_count - 1
+        return False
     
-    # Create file record in database
-    from models import File
-    file_size = os.path.getsize(file_path)
-    file_record = File(
-        filename=unique_filename,
+    db.session.delete(blob)
+    return True
+
+def unlink_content(file_path, digest):
+    """Delete content released by release_blob, after its commit
+
+    A placeholder blob row claims the digest while the content and preview
+    are unlinked, then is rolled back: a concurrent upload of the same bytes
+    waits on it and stores them afresh. Content whose digest is in use again
+    is kept. Returns whether anything was unlinked.
+    """
+    if not digest:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            return True
+        return False
+    
+    db.session.add(Blob(hash=digest, size=0, ref_count=0))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    try:
+        storage = get_storage()
+        storage.delete(blob_key(digest))
+        storage.delete(preview_key(digest))
+    finally:
+        db.session.rollback()
+    return True
+
+def delete_download_tokens(file_ids):
+    """Delete the download tokens of files being deleted, in the caller's transaction"""
+    db.session.execute(delete(DownloadToken).where(DownloadToken.file_id.in_(file_ids)))
+
+# Resumable upload utilities
+def create_upload_session(uploader_id, original_filename, file_size, chunk_size=None, expected_hash=None):
+    """Validate and create a resumable upload session"""
+    config = current_app.config
+    
+    if not original_filename or not allowed_file(original_filename):
+        return None, "File type not allowed"
+    
+    if not isinstance(file_size, int) or file_size < 1:
+        return None, "file_size must be a positive integer"
+    
+    if config.get('MAX_CONTENT_LENGTH') and file_size > config['MAX_CONTENT_LENGTH']:
+        return None, "File is too large"
+    
+    if chunk_size is None:
+        chunk_size = config['UPLOAD_SESSION_CHUNK_SIZE']
+    
+    if not isinstance(chunk_size, int) or not (
+            config['UPLOAD_SESSION_MIN_CHUNK_SIZE'] <= chunk_size <= config['UPLOAD_SESSION_MAX_CHUNK_SIZE']):
+        return None, (f"chunk_size must be between {config['UPLOAD_SESSION_MIN_CHUNK_SIZE']} "
+                      f"and {config['UPLOAD_SESSION_MAX_CHUNK_SIZE']} bytes")
+    
+    if expected_hash is not None:
+        expected_hash = str(expected_hash).lower()
+        if len(expected_hash) != 64 or any(c not in '0123456789abcdef' for c in expected_hash):
+            return None, "sha256 must be a hex encoded SHA-256 digest"
+    
+    upload_session = UploadSession(
+        id=uuid.uuid4().hex,
+        uploader_id=uploader_id,
         original_filename=original_filename,
-        file_path=file_path,
-        file_type=file_extension,
         file_size=file_size,
-        uploader_id=uploader_id
+        chunk_size=chunk_size,
+        expected_hash=expected_hash,
+        expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=config['UPLOAD_SESSION_TTL'])
     )
     
     try:
-        db.session.add(file_record)
+        db.session.add(upload_session)
         db.session.commit()
-        return file_record, None
+        os.makedirs(session_dir(config['UPLOAD_FOLDER'], upload_session.id), exist_ok=True)
+        return upload_session, None
     except Exception as e:
         db.session.rollback()
-        # Delete the file if database operation fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
         return None, str(e)
 
+def touch_upload_session(upload_session):
+    """Push back the expiry of a session that is still receiving parts"""
+    upload_session.expires_at = datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    db.session.commit()
+
+def finalize_upload_session(upload_session):
+    """Assemble all parts of a session into a file record via the save_file path"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    
+    missing = sorted(set(range(upload_session.total_chunks)) -
+                     set(received_chunks(upload_folder, upload_session.id)))
+    if missing:
+        return None, f"Missing chunks: {missing[:20]}"
+    
+    directory = claim_session_dir(upload_folder, upload_session.id)
+    if directory is None:
+        return None, "Upload is already being finalized"
+    
+    spool = assemble_chunks(directory, upload_session.total_chunks, upload_folder,
+                            current_app.config['UPLOAD_CHUNK_SIZE'])
+    
+    if upload_session.expected_hash and spool.hexdigest() != upload_session.expected_hash:
+        spool.close()
+        remove_session_dir(directory)
+        db.session.delete(upload_session)
+        db.session.commit()
+        return None, "Assembled file does not match the declared sha256"
+    
+    file_record, error = store_spooled_file(spool, upload_session.original_filename,
+                                            upload_session.uploader_id)
+    
+    if error:
+        # Put the parts back so the client can retry finalizing
+        os.rename(directory, session_dir(upload_folder, upload_session.id))
+        return None, error
+    
+    remove_session_dir(directory)
+    db.session.delete(upload_session)
+    db.session.commit()
+    return file_record, None
+
+def discard_upload_session(upload_session):
+    """Delete a session and any parts it has received"""
+    remove_session_dir(session_dir(current_app.config['UPLOAD_FOLDER'], upload_session.id))
+    db.session.delete(upload_session)
+    db.session.commit()
+
+def purge_expired_upload_sessions(batch_size=500):
+    """Garbage collect abandoned upload sessions and stray session directories"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    now = datetime.datetime.utcnow()
+    purged = 0
+    
+    while True:
+        expired = UploadSession.query.filter(UploadSession.expires_at < now).limit(batch_size).all()
+        if not expired:
+            break
+        for upload_session in expired:
+            remove_session_dir(session_dir(upload_folder, upload_session.id))
+            db.session.delete(upload_session)
+        db.session.commit()
+        purged += len(expired)
+    
+    # Directories whose session row is gone (crash mid-finalize, late parts)
+    sessions_root = os.path.join(upload_folder, SESSIONS_DIRNAME)
+    if os.path.isdir(sessions_root):
+        names = os.listdir(sessions_root)
+        live = {row.id for row in db.session.execute(
+            select(UploadSession.id).where(UploadSession.id.in_([n.split('.')[0] for n in names]))
+        )} if names else set()
+        for name in names:
+            if name.split('.')[0] not in live:
+                remove_session_dir(os.path.join(sessions_root, name))
+    
+    return purged
+
+# File listing utilities
+FILE_SORT_COLUMNS = {
+    'uploaded_at': File.uploaded_at,
+    'filename': File.original_filename,
+    'file_size': File.file_size,
+}
+# Type of the cursor value for the sorts stored as JSON values
+FILE_SORT_TYPES = {
+    'filename': str,
+    'file_size': int,
+}
+
+def _parse_datetime(value):
+    """Parse an ISO 8601 date or datetime query parameter"""
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def encode_cursor(sort, order, value, file_id):
+    """Encode the keyset position of the last row of a page as an opaque cursor"""
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, order, value, file_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort, order):
+    """Decode a cursor produced by encode_cursor for the given sort and order"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, file_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        return None, "Invalid cursor"
+
+    if cursor_sort != sort or cursor_order != order or not isinstance(file_id, int):
+        return None, "Cursor does not match the requested sort order"
+
+    if sort == 'uploaded_at':
+        value = _parse_datetime(value)
+    elif not isinstance(value, FILE_SORT_TYPES[sort]) or isinstance(value, bool):
+        value = None
+    if value is None:
+        return None, "Invalid cursor"
+
+    return (value, file_id), None
+
+def parse_file_list_params(args):
+    """Validate the pagination, sorting and filter arguments of the file listing"""
+    sort = args.get('sort', 'uploaded_at')
+    if sort not in FILE_SORT_COLUMNS:
+        return None, f"Invalid sort field. Allowed: {', '.join(FILE_SORT_COLUMNS)}"
+
+    order = args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        return None, "Invalid order. Allowed: asc, desc"
+
+    page_size = current_app.config['FILES_PAGE_SIZE']
+    max_page_size = current_app.config['FILES_MAX_PAGE_SIZE']
+    try:
+        limit = int(args.get('limit', page_size))
+    except ValueError:
+        return None, "Invalid limit"
+    if limit < 1:
+        return None, "Invalid limit"
+    limit = min(limit, max_page_size)
+
+    params = {
+        'sort': sort,
+        'order': order,
+        'limit': limit,
+        'cursor': None,
+        'file_types': None,
+        'uploader': args.get('uploader'),
+        'uploaded_after': None,
+        'uploaded_before': None,
+    }
+
+    cursor = args.get('cursor')
+    if cursor:
+        params['cursor'], error = decode_cursor(cursor, sort, order)
+        if error:
+            return None, error
+
+    file_type = args.get('file_type')
+    if file_type:
+        params['file_types'] = [t.strip().lower() for t in file_type.split(',') if t.strip()]
+
+    for key in ('uploaded_after', 'uploaded_before'):
+        if args.get(key):
+            params[key] = _parse_datetime(args[key])
+            if params[key] is None:
+                return None, f"Invalid {key} date, expected ISO 8601"
+
+    return params, None
+
+def build_file_list_query(params):
+    """Build the keyset-paginated file listing query for validated params
+
+    Selects only the serialized columns (see File.listing_columns) joined to
+    the uploader, so a page costs one statement and no ORM object loading.
+    Each row also carries changes_cursor, the settled change feed position
+    read in the same snapshot as the page.
+    """
+    sort_column = FILE_SORT_COLUMNS[params['sort']]
+    changes_cursor = settled_cursor().label('changes_cursor')
+    query = select(*File.listing_columns(), changes_cursor).join(User, File.uploader_id == User.id)
+
+    if params['file_types']:
+        query = query.where(File.file_type.in_(params['file_types']))
+
+    if params['uploader']:
+        query = query.where(User.username == params['uploader'])
+
+    if params['uploaded_after']:
+        query = query.where(File.uploaded_at >= params['uploaded_after'])
+
+    if params['uploaded_before']:
+        query = query.where(File.uploaded_at < params['uploaded_before'])
+
+    # Seek past the last row of the previous page instead of using OFFSET
+    if params['cursor']:
+        position = tuple_(sort_column, File.id)
+        if params['order'] == 'desc':
+            query = query.where(position < tuple_(*params['cursor']))
+        else:
+            query = query.where(position > tuple_(*params['cursor']))
+
+    if params['order'] == 'desc':
+        query = query.order_by(sort_column.desc(), File.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), File.id.asc())
+
+    return query.limit(params['limit'] + 1)
+
+def paginate_files(params):
+    """Run the listing query and return (rows, next_cursor) for one page"""
+    rows = db.session.execute(build_file_list_query(params)).all()
+
+    next_cursor = None
+    if len(rows) > params['limit']:
+        rows = rows[:params['limit']]
+        last = rows[-1]
+        value = getattr(last, FILE_SORT_COLUMNS[params['sort']].key)
+        next_cursor = encode_cursor(params['sort'], params['order'], value, last.id)
+
+    return rows, next_cursor
+
 # URL encryption utilities
 def get_encryption_key():
-    """Get or generate Fernet encryption key"""
+    """Get the Fernet encryption key
+
+    Without an explicit ENCRYPTION_KEY the key is derived from the JWT
+    secret, so every worker process agrees on it.
+    """
     key = current_app.config.get('ENCRYPTION_KEY')
     if not key:
-        # Generate a key and store it in the app config
-        key = Fernet.generate_key()
+        secret = current_app.config['JWT_SECRET_KEY'].encode()
+        key = base64.urlsafe_b64encode(hashlib.sha256(b'download-tokens:' + secret).digest())
         current_app.config['ENCRYPTION_KEY'] = key
     return key
 
+SIGNED_TOKEN_PREFIX = 's1.'  # Marks signed tokens apart from database ones
+
+def get_replay_cache():
+    """Per-process cache of signed token redemption times, in front of the redeemed_tokens table"""
+    cache = current_app.extensions.get('download_replay_cache')
+    if cache is None:
+        cache = current_app.extensions['download_replay_cache'] = TTLCache(
+            current_app.config['DOWNLOAD_REPLAY_CACHE_SIZE'],
+            current_app.config['DOWNLOAD_TOKEN_TTL']
+        )
+    return cache
+
 def encrypt_url(file_id, user_id):
     """Generate encrypted download token for a file"""
+    if current_app.config['DOWNLOAD_TOKEN_MODE'] == 'signed':
+        return encrypt_signed_token(file_id, user_id), None
+    
     # Create a download token
     token = secrets.token_urlsafe(32)
-    expiration = datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config['DOWNLOAD_TOKEN_TTL'])
     
     download_token = DownloadToken(
         token=token,
@@ -155,12 +619,82 @@ def encrypt_url(file_id, user_id):
         db.session.rollback()
         return None, str(e)
 
-def validate_download_token(token, user_id):
-    """Validate a download token"""
-    download_token = DownloadToken.query.filter_by(token=token, is_used=False).first()
+def encrypt_signed_token(file_id, user_id):
+    """Self-contained Fernet token carrying file id, user id and a nonce; needs no database row"""
+    payload = json.dumps({
+        'f': file_id,
+        'u': user_id,
+        'n': secrets.token_urlsafe(9)
+    }, separators=(',', ':'))
+    return SIGNED_TOKEN_PREFIX + Fernet(get_encryption_key()).encrypt(payload.encode()).decode()
+
+def redeem_signed_token(nonce, now, ttl):
+    """Record a signed token's redemption for every worker; returns when it was first redeemed, None if now"""
+    cache = get_replay_cache()
+    used_at = cache.get(nonce)
+    if used_at is not None:
+        return used_at
+    
+    db.session.add(RedeemedToken(nonce=nonce, used_at=now, expires_at=now + datetime.timedelta(seconds=ttl)))
+    try:
+        db.session.commit()
+        first = None
+    except IntegrityError:
+        # Redeemed before, possibly by another worker
+        db.session.rollback()
+        first = db.session.scalar(select(RedeemedToken.used_at).where(RedeemedToken.nonce == nonce)) or now
+    cache.set(nonce, first or now, ttl)
+    return first
+
+def validate_signed_token(token, user_id, resume=False):
+    """Validate a token from encrypt_signed_token
+
+    Expiry comes from the Fernet timestamp. Single use is enforced by a
+    redeemed_tokens row keyed by the token nonce, which the janitor purges
+    once the token has expired.
+    """
+    ttl = current_app.config['DOWNLOAD_TOKEN_TTL']
+    try:
+        payload = json.loads(Fernet(get_encryption_key()).decrypt(token[len(SIGNED_TOKEN_PREFIX):].encode(), ttl=ttl))
+    except InvalidToken:
+        return None, "Invalid or expired download token"
+    
+    if payload['u'] != user_id:
+        return None, "You are not authorized to use this download token"
+    
+    now = datetime.datetime.utcnow()
+    used_at = redeem_signed_token(payload['n'], now, ttl)
+    resume_window = datetime.timedelta(seconds=current_app.config['DOWNLOAD_RESUME_WINDOW'])
+    if used_at is not None and (not resume or now > used_at + resume_window):
+        return None, "Invalid or used download token"
+    
+    file = db.session.get(File, payload['f'])
+    if not file:
+        return None, "File not found!"
+    
+    return file, None
+
+def validate_download_token(token, user_id, resume=False):
+    """Validate a download token
+
+    Tokens are single use. With resume=True (a Range or conditional request)
+    a token the same user already redeemed is accepted again for
+    DOWNLOAD_RESUME_WINDOW seconds, so interrupted downloads can be resumed
+    and fetched in parallel segments.
+    """
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        return validate_signed_token(token, user_id, resume)
+    
+    download_token = DownloadToken.query.filter_by(token=token).first()
     
     if not download_token:
         return None, "Invalid or used download token"
+    
+    if download_token.is_used:
+        resume_window = datetime.timedelta(seconds=current_app.config['DOWNLOAD_RESUME_WINDOW'])
+        if not resume or not download_token.used_at or \
+                datetime.datetime.utcnow() > download_token.used_at + resume_window:
+            return None, "Invalid or used download token"
         
     if download_token.is_expired():
         return None, "Download token has expired"
@@ -169,17 +703,19 @@ def validate_download_token(token, user_id):
         return None, "You are not authorized to use this download token"
     
     # Mark token as used
-    download_token.is_used = True
-    db.session.commit()
+    if not download_token.is_used:
+        download_token.is_used = True
+        download_token.used_at = datetime.datetime.utcnow()
+        db.session.commit()
     
     return download_token.file, None
 
 # Email utilities
 def send_verification_email(user, verification_url):
-    """Send email verification email"""
-    msg = Message(
+    """Queue the email verification email; it goes out once the caller commits"""
+    return queue_email(
+        recipient=user.email,
         subject="Verify Your Email Address",
-        recipients=[user.email],
         html=f"""
         <h1>Email Verification</h1>
         <p>Hi {user.username},</p>
@@ -189,9 +725,3 @@ def send_verification_email(user, verification_url):
         <p>If you did not create an account, please ignore this email.</p>
         """
     )
-    
-    try:
-        mail.send(msg)
-        return True, None
-    except Exception as e:
-        return False, str(e)